@@ -0,0 +1,47 @@
+"""
+Gunicorn settings for serving the app in production.
+
+    gunicorn -c python:app.gunicorn_conf
+
+Every setting can be changed with the GUNICORN_* environment variables below.
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+wsgi_app = 'app.wsgi:application'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# pre-forked worker processes, the usual 2 x cores + 1 by default
+workers = _env_int('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+# more than one thread per worker switches to the threaded worker, which
+# also keeps idle keep-alive connections from blocking a whole process
+threads = _env_int('GUNICORN_THREADS', 1)
+worker_class = 'gthread' if threads > 1 else 'sync'
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+
+# recycle workers after some requests so leaks can't grow forever, the
+# jitter keeps all the workers from restarting at the same time
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# import Django once in the master, workers then start by forking it
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# an empty GUNICORN_ACCESS_LOG turns the access log off
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+
+def pre_fork(server, worker):
+    """Close the master's database connections before forking a worker"""
+    # with preload_app a connection opened while loading the app would be
+    # shared by every worker, each one has to open its own
+    from django.db import connections
+    connections.close_all()
@@ -78,18 +78,87 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# seconds a connection is kept open between requests, 0 closes it at the end
+# of every request and an empty value never closes it
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '0')
+
 DATABASES = {
     'default': {
         # 'ENGINE': 'django.db.backends.sqlite3',
         # 'NAME': BASE_DIR / 'db.sqlite3',
-        'ENGINE': 'django.db.backends.postgresql',
+        # Django's postgresql backend plus health checks and pooling, see
+        # core/db/backends/postgresql/base.py
+        'ENGINE': 'core.db.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': int(DB_CONN_MAX_AGE) if DB_CONN_MAX_AGE else None,
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS') == '1',
+        'OPTIONS': {},
     }
 }
 
+# DB_POOL_MAX_SIZE > 0 shares a pool of connections between the threads of
+# each worker process, connections go back to the pool at the end of every
+# request thus keep DB_CONN_MAX_AGE at 0 with it. DB_POOL_MIN_SIZE are opened
+# when the pool starts, the others on demand and all of them stay open
+if int(os.environ.get('DB_POOL_MAX_SIZE', 0)):
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+        'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    }
+
+
+# DB_REPLICA_HOSTS=host1,host2:5433 adds read replicas of the default
+# database, the safe requests of the painting API read from them
+DATABASE_REPLICAS = []
+for index, replica_host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    replica_host, _, replica_port = replica_host.strip().partition(':')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port,
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        # tests run against the default database only
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+# DB_SHARD_HOSTS=host1,host2:5433 spreads the users over more databases
+# next to the default one, each user's categories, supplies and paintings
+# live on one of them, see core/sharding.py; the shards are not replicated
+DATABASE_SHARDS = []
+for index, shard_host in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(',')), 1):
+    shard_host, _, shard_port = shard_host.strip().partition(':')
+    DATABASES[f'shard_{index}'] = {
+        **DATABASES['default'],
+        'HOST': shard_host,
+        'PORT': shard_port,
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+    }
+    DATABASE_SHARDS.append(f'shard_{index}')
+if DATABASE_SHARDS:
+    # the users from before the sharding stay where they are, the new ones
+    # are spread over all the databases
+    DATABASE_SHARDS.insert(0, 'default')
+
+DATABASE_ROUTERS = ['core.db.routers.ShardRouter',
+                    'core.db.routers.ReplicaRouter']
+
+# seconds each process keeps the shard of a user, a move waits that long
+# for every process to see the user's data is read only, then moved
+SHARD_DIRECTORY_TTL = int(os.environ.get('SHARD_DIRECTORY_TTL', 30))
+
+# seconds a user keeps reading from the default database after a write, so
+# they see their own changes while the replicas catch up
+DATABASE_REPLICA_STICKY_SECONDS = int(
+    os.environ.get('DB_REPLICA_STICKY_SECONDS', 5)
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -135,9 +204,109 @@ MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 # using this static we can access the django admin all the static files
 
+# media files are served by core.views.serve_media, 'x-accel-redirect'
+# (nginx) or 'x-sendfile' (apache) let the front server send the bytes
+# instead of the Python worker
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+# internal nginx location aliased to MEDIA_ROOT, used by x-accel-redirect
+MEDIA_ACCEL_REDIRECT_URL = os.environ.get('MEDIA_ACCEL_REDIRECT_URL',
+                                          '/protected-media/')
+# files under these paths never change once written (uuid file names)
+MEDIA_IMMUTABLE_PREFIXES = ['uploads/']
+MEDIA_CACHE_MAX_AGE = 3600
+# seconds an upload replaced by its optimized copy stays on disk
+REPLACED_IMAGE_GRACE = int(os.environ.get('REPLACED_IMAGE_GRACE',
+                                          7 * 24 * 3600))
+
+# resized images of core.renditions, only these widths and heights are
+# rendered, each one is a file on disk
+IMAGE_RENDITION_SIZES = [64, 128, 256, 512, 1024, 2048]
+# directory of the renditions inside of MEDIA_ROOT
+IMAGE_CACHE_PREFIX = 'cache/'
+# the least recently used renditions are deleted over this size
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES',
+                                           1024 * 1024 * 1024))
+# formats served to the clients accepting them, by order of preference,
+# those Pillow can't write (AVIF without its plugin) are skipped
+IMAGE_NEGOTIATED_FORMATS = ['avif', 'webp']
+
+# batch upload of images: files per request, and threads validating and
+# reading the metadata of the files of a request
+IMAGE_BATCH_MAX_FILES = 100
+IMAGE_BATCH_WORKERS = int(os.environ.get('IMAGE_BATCH_WORKERS', 4))
+
+# similar image search keeps a BK-tree of the image hashes of the users
+# searching in every worker, the least recently used ones are dropped
+SIMILARITY_MAX_TREES = int(os.environ.get('SIMILARITY_MAX_TREES', 100))
+
+# background jobs of core.jobs, run by the run_workers command
+JOB_MAX_ATTEMPTS = 3
+# seconds before the first retry, doubled after each failed attempt
+JOB_RETRY_DELAY = 10
+JOB_MAX_RETRY_DELAY = 3600
+# a job running for longer belongs to a dead worker and is run again
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 600))
+
+# sync endpoint: a new cursor starts this many seconds before the sync,
+# catching the changes of transactions still running at that time
+SYNC_CURSOR_OVERLAP = 5
+# older cursors get a full sync, the tombstones are kept as long
+SYNC_CURSOR_MAX_AGE = 30 * 86400
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'core.User' #core is the app and User is the model name
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # token buckets of core.throttling, the upload and login views have
+    # their own budget
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.ReadThrottle',
+        'core.throttling.WriteThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.environ.get('THROTTLE_RATE_READ', '1000/min'),
+        'write': os.environ.get('THROTTLE_RATE_WRITE', '300/min'),
+        'upload': os.environ.get('THROTTLE_RATE_UPLOAD', '60/min'),
+        'login': os.environ.get('THROTTLE_RATE_LOGIN', '10/min'),
+    },
+    # the anonymous clients are throttled by address: the X-Forwarded-For
+    # header is sent by the client itself unless a proxy appends to it, set
+    # NUM_PROXIES=1 behind nginx; with 0 the address of the connection is
+    # used
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+# the local memory cache is per process, e.g.
+# CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+# CACHE_LOCATION=memcached:11211 shares it between the workers
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+# core.caching keeps up to TIERED_CACHE_MAX_ITEMS values in each process
+# for TIERED_CACHE_LOCAL_TTL seconds at most, the longest a value changed
+# by another process can be served when its invalidation is missed; the
+# values stay TIERED_CACHE_TIMEOUT seconds in the Django cache, unless it is
+# the local memory cache, which core.caching doesn't use
+TIERED_CACHE_MAX_ITEMS = int(os.environ.get('TIERED_CACHE_MAX_ITEMS', 10000))
+TIERED_CACHE_LOCAL_TTL = float(os.environ.get('TIERED_CACHE_LOCAL_TTL', 5))
+TIERED_CACHE_TIMEOUT = int(os.environ.get('TIERED_CACHE_TIMEOUT', 300))
+
+# seconds an API request waits for an identical one running in the same
+# process before doing the work itself, see core/singleflight.py
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 5))
+
+# cache alias holding the throttle buckets
+THROTTLE_CACHE = 'default'
@@ -0,0 +1,51 @@
+"""
+Settings for workers that only serve the REST API.
+
+Use DJANGO_SETTINGS_MODULE=app.settings_api. The admin, sessions, messages
+and the browsable API are left out, thus the workers import and start
+faster. Clients authenticate with their token only, which is why the
+session and CSRF middleware are not needed either.
+"""
+
+from app.settings import *  # noqa: F401,F403
+from app.settings import INSTALLED_APPS, MIDDLEWARE, TEMPLATES, \
+                         REST_FRAMEWORK
+
+API_ONLY_REMOVED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+]
+
+API_ONLY_REMOVED_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    # DRF authenticates the token itself, this one needs sessions
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+INSTALLED_APPS = [
+    app for app in INSTALLED_APPS if app not in API_ONLY_REMOVED_APPS
+]
+
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if middleware not in API_ONLY_REMOVED_MIDDLEWARE
+]
+
+TEMPLATES = [dict(TEMPLATES[0], OPTIONS={'context_processors': [
+    processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+    if processor != 'django.contrib.messages.context_processors.messages'
+]})]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'core.authentication.CachedTokenAuthentication',
+    ],
+}
@@ -13,17 +13,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+import re
+
+from django.apps import apps
+from django.urls import path, re_path, include
 from django.conf import settings
 
+from core.views import serve_media
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/painting/', include('painting.urls')),
     # django by default serves any static files but does not serve any media
     # file by default
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)  # makes
-# the media URL available in the development server thus we can test images
-# without having to set up a web server for serving these media files
+    re_path(
+        r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+        serve_media,
+        name='media'
+    ),  # unlike django.conf.urls.static this supports ranges, conditional
+    # requests and handing the file over to nginx, thus it is used in
+    # production too
+]
+
+# the API only settings (app.settings_api) leave the admin out, it is only
+# imported when installed
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
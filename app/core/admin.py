@@ -1,15 +1,76 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 # recommended convention for
 # coverting strings to human readable text to get it passed through translation
 # engine and later will be easier to extend in multiple language
 
-from core import models
+from core import deletion, models
 
 
-class UserAdmin(BaseUserAdmin):  # extend baseuseradmin
+class EstimatedCountPaginator(Paginator):
+    """Paginator using the planner row estimate of big unfiltered tables"""
+    # COUNT(*) reads the whole table on PostgreSQL, pg_class.reltuples is
+    # kept up to date by (auto)vacuum and analyze
+    estimate_above = 100000
+
+    def _estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None  # only the whole table has an estimate
+        with connection.cursor() as cursor:
+            # a partitioned table has no rows of its own, its reltuples
+            # stays 0 or -1: add up the estimates of its partitions
+            cursor.execute(
+                'SELECT (CASE WHEN t.relkind = %s THEN ('
+                '  SELECT COALESCE(SUM(GREATEST(p.reltuples, 0)), 0) '
+                '  FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid '
+                '  WHERE i.inhparent = t.oid'
+                ') ELSE t.reltuples END)::bigint '
+                'FROM pg_class t WHERE t.oid = %s::regclass',
+                ['p', queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate()
+        if estimate is not None and estimate > self.estimate_above:
+            return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin staying fast on tables with millions of rows"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # no second COUNT(*) of the table
+    list_per_page = 50
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search with exact lookups, those can use the indexes"""
+        # the default icontains search is a LIKE '%term%' scanning every row
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        query = Q()
+        for field in self.get_search_fields(request):
+            if field == 'id' or field.endswith('__id'):
+                if not term.isdecimal():
+                    continue
+            query |= Q(**{field: term})
+        return queryset.filter(query) if query else queryset.none(), False
+
+
+class UserAdmin(LargeTableAdmin, BaseUserAdmin):  # extend baseuseradmin
     ordering = ['id']
+    search_fields = ('id', 'email')  # primary key and unique index
+    actions = ['soft_delete']
     list_display = ['email', 'name']
     fieldsets = (
         (None, {'fields': ('email', 'password')}),  # first field is titlte of
@@ -30,9 +91,41 @@ class UserAdmin(BaseUserAdmin):  # extend baseuseradmin
         }),  # the ',' should be here,otherwise python would consider as object
     )
 
+    @admin.action(description=_('Soft delete selected users'))
+    def soft_delete(self, request, queryset):
+        # the delete action cascades through every painting at once,
+        # purge_deleted removes the data of these users in small batches
+        for user in queryset.filter(deleted_at__isnull=True):
+            deletion.soft_delete_user(user)
+
+
+class PaintingAttrAdmin(LargeTableAdmin):
+    """Admin of the categories and supplies"""
+    list_display = ('name', 'user', 'painting_count')
+    # the user of every row is joined instead of queried row by row
+    list_select_related = ('user',)
+    # a select widget would load every user
+    raw_id_fields = ('user',)
+    search_fields = ('id', 'user__email')
+
+
+class PaintingAdmin(LargeTableAdmin):
+    list_display = ('title', 'user', 'painting_create_date', 'image_format',
+                    'deleted_at')
+    list_select_related = ('user',)
+    # the select widgets would load every category and supply of every user
+    raw_id_fields = ('user', 'categories', 'supplies')
+    search_fields = ('id', 'user__email')
+
+
+class JobAdmin(LargeTableAdmin):
+    list_display = ('task', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status',)  # the choices, no query to list them
+    search_fields = ('id',)
+
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Category)  # do not need the UserAdmin as we are
-admin.site.register(models.Supply)
-admin.site.register(models.Painting)
-# using a basic model of read, update and delete here
+admin.site.register(models.Category, PaintingAttrAdmin)
+admin.site.register(models.Supply, PaintingAttrAdmin)
+admin.site.register(models.Painting, PaintingAdmin)
+admin.site.register(models.Job, JobAdmin)
@@ -0,0 +1,41 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from core import caching
+from core.models import User
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication reading the tokens and users from core.caching
+
+    Every request of the API looks up its token and user, after the first
+    request of a user both usually come from the memory of the process.
+    The signals in core.signals forget them when they change.
+    """
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        user_id = caching.tiered.get_or_set(
+            caching.token_key(key),
+            lambda: model.objects.filter(key=key)
+            .values_list('user_id', flat=True).first()
+        )
+        user = None
+        if user_id is not None:
+            user = caching.tiered.get_or_set(
+                caching.user_key(user_id),
+                # the password hashes stay out of the caches
+                lambda: User.objects.defer('password')
+                .filter(pk=user_id).first()
+            )
+        if user is None:  # a deleted user takes their tokens along
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+
+        token = model(key=key, user=user)
+        token._state.adding = False  # it is a row of the database
+        return (user, token)
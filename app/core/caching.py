@@ -0,0 +1,271 @@
+"""Two tier cache: a small LRU in each process in front of the Django cache
+
+A hit of the first tier costs no network round trip. A value changed by
+one process must not be served by the LRUs of the others though:
+invalidate() deletes the keys from the Django cache and, on PostgreSQL,
+sends them with NOTIFY to every process, whose listener thread drops
+them from its LRU. A notification can be missed, e.g. while the listener
+reconnects, thus the entries of the LRU also expire after
+TIERED_CACHE_LOCAL_TTL seconds, which bounds how stale a value can be.
+
+The second tier must be shared by the processes (memcached, Redis...): a
+LocMemCache is skipped, the invalidations of the other processes never
+reach it and its copies would outlive the bound.
+
+The keys are deleted once more when the transaction changing the data
+commits: a request reading meanwhile would cache the rows from before.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import pickle
+import select
+import threading
+import time
+
+import psycopg2
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'tiered_cache'
+# PostgreSQL refuses the notifications of 8000 bytes and more
+MAX_PAYLOAD = 7000
+RECONNECT_DELAY = 5  # seconds between the attempts of the listener
+_missing = object()
+
+
+class TieredCache:
+    """In-process LRU in front of a Django cache"""
+
+    def __init__(self, alias='default', max_items=None, local_ttl=None,
+                 timeout=None, database=DEFAULT_DB_ALIAS):
+        self.alias = alias
+        self.max_items = max_items
+        self.local_ttl = local_ttl
+        self.timeout = timeout
+        self.database = database  # broadcasting the invalidations
+        self._local = collections.OrderedDict()  # key: (expiry, pickle)
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+        self._listener = None
+
+    @property
+    def shared(self):
+        """Return the Django cache, None if it is the process's memory"""
+        cache = caches[self.alias]
+        return None if isinstance(cache, LocMemCache) else cache
+
+    def _setting(self, value, name):
+        return getattr(settings, name) if value is None else value
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return _missing
+            if entry[0] <= time.monotonic():
+                del self._local[key]
+                return _missing
+            self._local.move_to_end(key)
+        # every caller gets its own copy, as from the Django cache
+        return pickle.loads(entry[1])
+
+    def _set_local(self, key, value):
+        ttl = self._setting(self.local_ttl, 'TIERED_CACHE_LOCAL_TTL')
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        max_items = self._setting(self.max_items, 'TIERED_CACHE_MAX_ITEMS')
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, data)
+            self._local.move_to_end(key)
+            while len(self._local) > max_items:
+                self._local.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the value of a key from the first tier that has it"""
+        self.start_listener()
+        value = self._get_local(key)
+        if value is not _missing:
+            self._count('local_hits')
+            return value
+        shared = self.shared
+        value = _missing if shared is None else shared.get(key, _missing)
+        if value is _missing:
+            self._count('misses')
+            return default
+        self._count('shared_hits')
+        self._set_local(key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        """Store a value in both tiers"""
+        timeout = self._setting(timeout if timeout is not None
+                                else self.timeout, 'TIERED_CACHE_TIMEOUT')
+        if self.shared is not None:
+            self.shared.set(key, value, timeout)
+        self._set_local(key, value)
+
+    def get_or_set(self, key, load, timeout=None):
+        """Return the cached value of a key, or store what load() returns"""
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = load()
+            self.set(key, value, timeout)
+        return value
+
+    def discard(self, keys):
+        """Drop keys from the LRU of this process only"""
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _invalidate_now(self, keys):
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+        self.discard(keys)
+        self.notify(keys)
+
+    def invalidate(self, keys, using=DEFAULT_DB_ALIAS):
+        """Delete keys from every tier of every process
+
+        using is the database whose transaction changed the data.
+        """
+        keys = list(keys)
+        self._invalidate_now(keys)
+        if connections[using].in_atomic_block:
+            transaction.on_commit(lambda: self._invalidate_now(keys),
+                                  using=using)
+
+    def notify(self, keys):
+        """Send keys to the listeners of the other processes"""
+        connection = connections[self.database]
+        if connection.vendor != 'postgresql':
+            return  # a single process in development and tests
+        chunk = []
+        with connection.cursor() as cursor:
+            for key in keys + [None]:
+                if key is None or \
+                        len(json.dumps(chunk + [key])) > MAX_PAYLOAD:
+                    if chunk:
+                        cursor.execute('SELECT pg_notify(%s, %s)',
+                                       [CHANNEL, json.dumps(chunk)])
+                    chunk = []
+                if key is not None:
+                    chunk.append(key)
+
+    def hit_ratios(self):
+        """Return the ratios of the lookups answered by each tier"""
+        total = sum(self.counts.values()) or 1
+        return {
+            'local': self.counts['local_hits'] / total,
+            'shared': self.counts['shared_hits'] / total,
+            'overall': (self.counts['local_hits'] +
+                        self.counts['shared_hits']) / total,
+        }
+
+    def start_listener(self):
+        """Start the listener thread of this process, on PostgreSQL"""
+        listener = self._listener
+        if listener is not None and listener.pid == os.getpid():
+            return  # threads don't survive a fork, the workers start theirs
+        if connections[self.database].vendor != 'postgresql':
+            return
+        with self._lock:
+            if self._listener is listener:
+                self._listener = Listener(self)
+                self._listener.start()
+
+
+class Listener(threading.Thread):
+    """Thread dropping the keys invalidated by the other processes"""
+    daemon = True
+
+    def __init__(self, cache):
+        super().__init__(name='tiered-cache-listener')
+        self.cache = cache
+        self.pid = os.getpid()
+        self.listening = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception:
+                logger.exception('Cache invalidation listener failed')
+            self.listening.clear()
+            # the notifications sent meanwhile are lost
+            self.cache.clear_local()
+            self.stopped.wait(RECONNECT_DELAY)
+
+    def listen(self):
+        # a connection of its own, Django's are per thread and would be
+        # closed at the end of the requests
+        wrapper = connections[self.cache.database]
+        connection = psycopg2.connect(**wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            # what was cached before listening may be stale already
+            self.cache.clear_local()
+            self.listening.set()
+            while not self.stopped.is_set():
+                if not select.select([connection], [], [], 5)[0]:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self.cache.discard(json.loads(notify.payload))
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+tiered = TieredCache()
+
+
+def user_key(user_id):
+    return f'tiered:user:{user_id}'
+
+
+def token_key(key):
+    # the tokens don't end up in the cache, only their hash
+    return f'tiered:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def attrs_key(model_name, user_id, assigned_only):
+    """Return the key of the list of categories or supplies of a user"""
+    return f'tiered:{model_name}:{user_id}:{int(assigned_only)}'
+
+
+def stats_key(user_id):
+    return f'tiered:stats:{user_id}'
+
+
+def user_data_keys(user_id):
+    """Return the keys of the cached lists and stats of a user"""
+    return [attrs_key(name, user_id, assigned_only)
+            for name in ('category', 'supply')
+            for assigned_only in (False, True)] + [stats_key(user_id)]
+
+
+def user_data_changed(user_id, using=DEFAULT_DB_ALIAS):
+    """Forget the cached lists and stats of a user"""
+    tiered.invalidate(user_data_keys(user_id), using)
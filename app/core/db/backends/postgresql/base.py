@@ -0,0 +1,194 @@
+"""
+PostgreSQL backend adding connection health checks and an in-process pool.
+
+Enable it with 'ENGINE': 'core.db.backends.postgresql'. On top of Django's
+backend it understands:
+
+    'CONN_HEALTH_CHECKS': True
+        check a persistent connection (CONN_MAX_AGE > 0) is still alive the
+        first time it is used in a request, instead of failing the request
+
+    'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10, 'timeout': 5}}
+        take connections from a pool shared by all the threads of a worker
+        process and give them back at the end of each request; min_size
+        are opened up front, up to max_size stay open once returned
+"""
+import os
+import threading
+import time
+
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+from psycopg2 import extensions, extras, pool as pg_pool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool(pg_pool.ThreadedConnectionPool):
+    """Pool keeping every returned connection, with a blocking getconn()"""
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # psycopg2 closes the connections given back once minconn of them
+        # are idle: a busy worker would connect again on most requests.
+        # maxconn already bounds the open connections, keep them all
+        self.minconn = self.maxconn
+        # the threads waiting for a connection sleep on it until putconn()
+        self._lock = threading.Condition(self._lock)
+
+    def getconn(self, key=None, timeout=0):
+        """Get a free connection, waiting timeout seconds at most for one"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                try:
+                    return self._getconn(key)
+                except pg_pool.PoolError:
+                    # every connection is in use by other threads
+                    remaining = deadline - time.monotonic()
+                    if self.closed or remaining <= 0:
+                        raise
+                    self._lock.wait(remaining)
+
+    def putconn(self, conn=None, key=None, close=False):
+        with self._lock:
+            self._putconn(conn, key, close)
+            self._lock.notify()
+
+    def closeall(self):
+        with self._lock:
+            self._closeall()
+            self._lock.notify_all()
+
+
+def get_pool(alias, conn_params, min_size=1, max_size=10, **kwargs):
+    """Return the connection pool of a database alias, creating it once"""
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.closed:
+            pool = ConnectionPool(min_size, max_size, **conn_params)
+            _pools[alias] = pool
+        return pool
+
+
+def close_pools(alias=None):
+    """Close the pools of this process and all of their connections"""
+    with _pools_lock:
+        for name in [alias] if alias else list(_pools):
+            pool = _pools.pop(name, None)
+            if pool is not None and not pool.closed:
+                pool.closeall()
+
+
+def _forget_pools():
+    """Drop the pools inherited from the parent process after a fork"""
+    # the sockets are shared with the parent, closing them here would
+    # terminate the parent's sessions, thus only forget about them
+    _pools.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_checks = self.settings_dict.get('CONN_HEALTH_CHECKS',
+                                                    False)
+        self.health_check_done = False
+        self.pool = None  # the pool the current connection came from
+
+    @property
+    def pool_options(self):
+        """Return the pool settings, empty when pooling is turned off"""
+        return dict(self.settings_dict['OPTIONS'].get('pool') or {})
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        # 'pool' is ours, psycopg2 would reject it as a connection parameter
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        options = self.pool_options
+        if not options:
+            return super().get_new_connection(conn_params)
+
+        timeout = options.pop('timeout', 5)
+        pool = get_pool(self.alias, conn_params, **options)
+        connection = self._checkout(pool, timeout)
+        self.pool = pool
+
+        # same set up as a brand new connection in Django's backend
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        if isolation_level is None:
+            self.isolation_level = connection.isolation_level
+        else:
+            self.isolation_level = isolation_level
+            if isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=isolation_level)
+        extras.register_default_jsonb(conn_or_curs=connection,
+                                      loads=lambda x: x)
+        return connection
+
+    def _checkout(self, pool, timeout):
+        """Take a working connection from the pool, waiting if it's empty"""
+        deadline = time.monotonic() + timeout
+        while True:
+            connection = pool.getconn(
+                timeout=max(deadline - time.monotonic(), 0))
+            if connection.closed or (
+                    self.health_checks and not self._alive(connection)):
+                pool.putconn(connection, close=True)
+                continue
+            return connection
+
+    def _alive(self, connection):
+        """Run the cheapest possible query on a raw connection"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Exception:
+            return False
+        if connection.get_transaction_status() != \
+                extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()  # SELECT 1 opened one outside autocommit
+        return True
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+
+        connection, pool, self.pool = self.connection, self.pool, None
+        with self.wrap_database_errors:
+            broken = connection.closed or self.errors_occurred
+            if not broken and connection.get_transaction_status() != \
+                    extensions.TRANSACTION_STATUS_IDLE:
+                # never give a connection in a transaction to another thread
+                connection.rollback()
+            pool.putconn(connection, close=broken)
+
+    @async_unsafe
+    def ensure_connection(self):
+        if self.connection is not None and self.health_checks and \
+                not self.health_check_done and not self.in_atomic_block:
+            # a persistent connection may have been closed by the server or
+            # a proxy since the last request, replace it before it fails
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
+
+    @async_unsafe
+    def connect(self):
+        super().connect()
+        self.health_check_done = True  # brand new, no need to check it
+
+    def close_if_unusable_or_obsolete(self):
+        # called at the start and end of every request
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
@@ -0,0 +1,142 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+
+# set for the duration of a request whose reads may go to a replica, see
+# ReplicaReadMixin in painting/views.py
+_read_from_replica = contextvars.ContextVar('read_from_replica',
+                                            default=False)
+# the database holding the data of the user of the request, see ShardMixin
+# in painting/views.py and core/sharding.py
+_shard = contextvars.ContextVar('shard', default=None)
+# the tables of the data of a user, they all live on the user's shard; the
+# users, tokens and jobs stay on the default database
+SHARDED_MODELS = {
+    'core.category', 'core.supply', 'core.painting',
+    'core.painting_categories', 'core.painting_supplies',
+    'core.userpaintingstats', 'core.monthlypaintingcount',
+    'core.synctombstone',
+}
+
+
+def get_replicas():
+    """Return the aliases of the configured read replicas"""
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def use_replicas(enabled=True):
+    """Allow reads to go to replicas, return a token for reset_replicas()"""
+    return _read_from_replica.set(enabled)
+
+
+def reset_replicas(token):
+    """Restore the replica state from before use_replicas()"""
+    _read_from_replica.reset(token)
+
+
+def get_shards():
+    """Return the aliases of the databases the users are spread over"""
+    return getattr(settings, 'DATABASE_SHARDS', [])
+
+
+def use_shard(database):
+    """Send the queries of the user data to a shard, see reset_shard()"""
+    return _shard.set(database)
+
+
+def reset_shard(token):
+    """Restore the shard from before use_shard()"""
+    _shard.reset(token)
+
+
+def _pin_key(user):
+    return f'db-primary-pin:{user.pk}'
+
+
+def pin_to_primary(user):
+    """Send the reads of a user to the primary for a short while"""
+    # replicas lag behind the primary, thus right after a write the user
+    # must read from the primary to see their own changes
+    seconds = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+    if get_replicas() and seconds and user.is_authenticated:
+        cache.set(_pin_key(user), True, seconds)
+
+
+def is_pinned_to_primary(user):
+    """Return True if the user wrote something very recently"""
+    if not get_replicas() or not user.is_authenticated:
+        return False
+    return cache.get(_pin_key(user), False)
+
+
+class ShardRouter:
+    """Send the queries of the user data to the shard of the user
+
+    Listed before ReplicaRouter: the data of the users on the default
+    database is left to it, thus still read from the replicas.
+    """
+
+    def _db(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and \
+                instance._meta.label_lower in SHARDED_MODELS and \
+                instance._state.db in get_shards():
+            # the related rows of a painting are on its database, whatever
+            # the request, e.g. in the move_user_shard command
+            database = instance._state.db
+        else:
+            database = _shard.get()
+        if database == DEFAULT_DB_ALIAS:
+            return None
+        return database
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # a painting on a shard belongs to a user on the default database
+        databases = {DEFAULT_DB_ALIAS, *get_shards(), *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    # every shard gets the whole schema, the tables of the users and jobs
+    # just stay empty there
+
+
+class ReplicaRouter:
+    """Send reads to a random replica when the request allows it"""
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if replicas and _read_from_replica.get():
+            return random.choice(replicas)
+        return None  # let Django use the default database
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and \
+                instance._state.db not in get_replicas():
+            return None  # e.g. on a shard, saved where it was read from
+        # objects read from a replica would otherwise be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False  # replicas get the schema from the primary
+        return None
@@ -0,0 +1,91 @@
+"""Merge the categories and supplies of a user differing only by case"""
+from django.db import transaction
+from django.db.models import Count, Min, Value
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+
+def duplicate_groups(model, using='default', user_ids=None):
+    """Return (user id, lower case name, id to keep) of duplicated names"""
+    rows = model.objects.using(using)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return rows.annotate(name_lower=Lower('name')) \
+        .values('user_id', 'name_lower') \
+        .annotate(n=Count('id'), keep=Min('id')) \
+        .filter(n__gt=1) \
+        .values_list('user_id', 'name_lower', 'keep') \
+        .order_by()
+
+
+def merge_group(model, through, column, user_id, name_lower, keep,
+                using='default', batch_size=1000):
+    """Move the paintings of the duplicates onto the kept row, delete them
+
+    Return the number of deleted duplicates.
+    """
+    with transaction.atomic(using=using):
+        duplicates = list(
+            model.objects.using(using)
+            .annotate(name_lower=Lower('name'))
+            .filter(user_id=user_id, name_lower=name_lower)
+            .exclude(id=keep)
+            .values_list('id', flat=True)
+        )
+        links = through.objects.using(using)
+        # the paintings whose categories or supplies change
+        touched = set(
+            links.filter(**{f'{column}__in': duplicates})
+            .values_list('painting_id', flat=True)
+        )
+        linked = links.filter(**{column: keep}).values('painting_id')
+        # a painting may be linked to the kept row and to a duplicate, or
+        # to several duplicates, it must end up with a single link
+        painting_ids = set(
+            links.filter(**{f'{column}__in': duplicates})
+            .exclude(painting_id__in=linked)
+            .values_list('painting_id', flat=True)
+        )
+        # the M2M rows are rewritten in bulk, without m2m_changed signals,
+        # the counter of the kept row is recomputed below
+        links.filter(**{f'{column}__in': duplicates}).delete()
+        links.bulk_create(
+            [through(painting_id=painting_id, **{column: keep})
+             for painting_id in painting_ids],
+            batch_size=batch_size
+        )
+        model.objects.using(using).filter(id__in=duplicates).delete()
+        counted = links.filter(**{column: keep})
+        # migration 0009 runs before the paintings could be soft deleted
+        # or synced
+        painting = through._meta.get_field('painting').related_model
+        fields = {f.name for f in painting._meta.fields}
+        if 'deleted_at' in fields:
+            counted = counted.filter(painting__deleted_at__isnull=True)
+        if 'updated_at' in fields and touched:
+            # the clients syncing drop the ids of the deleted duplicates,
+            # the links are part of a painting, see signals._touch_paintings
+            painting.objects.using(using).filter(id__in=touched) \
+                .update(updated_at=timezone.now())
+        model.objects.using(using).filter(id=keep).update(
+            painting_count=counted.count()
+        )
+    return len(duplicates)
+
+
+def merge_duplicates(model, through, column, using='default', user_ids=None):
+    """Merge every duplicated name, return the number of deleted rows"""
+    # one transaction per name keeps the locks short on big tables
+    return sum(
+        merge_group(model, through, column, user_id, name_lower, keep, using)
+        for user_id, name_lower, keep
+        in list(duplicate_groups(model, using, user_ids))
+    )
+
+
+def filter_name(queryset, name):
+    """Filter the rows named name whatever the case"""
+    # LOWER(name) = LOWER(%s) can use the unique (user_id, LOWER(name))
+    # index, name__iexact can't
+    return queryset.annotate(name_lower=Lower('name')) \
+        .filter(name_lower=Lower(Value(name)))
@@ -0,0 +1,123 @@
+"""Soft delete of paintings and users, and the batched purge of the rows"""
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from core import caching, renditions, sharding, stats
+from core.models import Category, Supply, Painting, SyncTombstone, User, \
+                        UserPaintingStats, MonthlyPaintingCount
+
+
+def soft_delete_painting(painting, using='default'):
+    """Hide a painting, return False if it was deleted already"""
+    with transaction.atomic(using=using):
+        now = timezone.now()
+        # updated_at: the clients syncing learn about the deletion
+        hidden = Painting.objects.using(using) \
+            .filter(pk=painting.pk, deleted_at__isnull=True) \
+            .update(deleted_at=now, updated_at=now)
+        if hidden:
+            # the counters drop now, the pre_delete signal of the purge
+            # skips the paintings that are soft deleted
+            stats.painting_removed(painting, using)
+            if painting.image_phash:
+                stats.image_hashes_changed(painting.user_id, using)
+            caching.user_data_changed(painting.user_id, using)
+            painting.deleted_at = now
+    return bool(hidden)
+
+
+def soft_delete_user(user, using='default'):
+    """Deactivate a user, the paintings are purged with the user later"""
+    # a single row update whatever the number of paintings, an inactive
+    # user can't log in thus their paintings can't be seen anymore
+    user.deleted_at = timezone.now()
+    user.is_active = False
+    user.save(using=using, update_fields=['deleted_at', 'is_active'])
+
+
+def delete_files(names):
+    """Remove image files, called once the rows are really deleted"""
+    for name in names:
+        default_storage.delete(name)
+        for variant in renditions.variant_names(name):
+            default_storage.delete(variant)
+
+
+def purge_paintings(paintings, batch_size=500, using='default',
+                    tombstones=True):
+    """Delete paintings with their links and images, batch by batch
+
+    Return the number of deleted paintings.
+    """
+    purged = 0
+    while True:
+        batch = list(paintings.using(using).order_by('id')
+                     .values_list('id', 'image', 'user_id', 'deleted_at')
+                     [:batch_size])
+        if not batch:
+            return purged
+        ids = [painting_id for painting_id, _, _, _ in batch]
+        # one short transaction per batch, the locks are released quickly
+        with transaction.atomic(using=using):
+            if tombstones:
+                # for the clients that didn't sync since the soft delete
+                SyncTombstone.objects.using(using).bulk_create([
+                    SyncTombstone(user_id=user_id, object_id=painting_id,
+                                  kind=SyncTombstone.PAINTING,
+                                  deleted_at=deleted_at)
+                    for painting_id, _, user_id, deleted_at in batch
+                ])
+            # not counted anymore, the counters of the paintings of deleted
+            # users are deleted with the users
+            Painting.objects.using(using) \
+                .filter(id__in=ids, deleted_at__isnull=True) \
+                .update(deleted_at=timezone.now())
+            for through in (Painting.categories.through,
+                            Painting.supplies.through):
+                through.objects.using(using).filter(painting_id__in=ids) \
+                    .delete()
+            Painting.objects.using(using).filter(id__in=ids).delete()
+            files = [image for _, image, _, _ in batch if image]
+            # a rolled back transaction must not lose the images
+            transaction.on_commit(lambda files=files: delete_files(files),
+                                  using=using)
+        purged += len(batch)
+
+
+def purge_user(user_id, batch_size=500, using='default'):
+    """Delete a user after their paintings, categories and supplies"""
+    # the data of the user may be on a shard, the user is on `using`
+    data = sharding.database_for(user_id) if using == 'default' else using
+    purged = purge_paintings(Painting.objects.filter(user_id=user_id),
+                             batch_size, data, tombstones=False)
+    for model in (Category, Supply):
+        rows = model.objects.using(data).filter(user_id=user_id)
+        while True:
+            ids = list(rows.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            # their paintings are gone, thus the M2M tables have no row left
+            model.objects.using(data).filter(id__in=ids).delete()
+    if data != using:
+        # not cascaded from a user on another database
+        for model in (UserPaintingStats, MonthlyPaintingCount):
+            model.objects.using(data).filter(user_id=user_id).delete()
+    # what is left to cascade is a few rows: token, counters, shard
+    User.objects.using(using).filter(id=user_id).delete()
+    SyncTombstone.objects.using(data).filter(user_id=user_id).delete()
+    sharding.forget(user_id)
+    return purged
+
+
+def purge_tombstones(before, batch_size=500, using='default'):
+    """Delete the tombstones older than the oldest accepted sync cursor"""
+    tombstones = SyncTombstone.objects.using(using).filter(
+        deleted_at__lt=before)
+    purged = 0
+    while True:
+        ids = list(tombstones.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        SyncTombstone.objects.using(using).filter(id__in=ids).delete()
+        purged += len(ids)
@@ -0,0 +1,168 @@
+"""Image helpers, Pillow is only imported when an image is handled"""
+import io
+
+# the metadata columns of a painting without image
+EMPTY_METADATA = {
+    'image_width': None,
+    'image_height': None,
+    'image_size': None,
+    'image_format': '',
+    'image_dominant_color': '',
+    'image_phash': '',
+}
+
+# side of the thumbnail the colour and hash are computed from, decoding a
+# big JPEG straight at this size is much faster than decoding it fully
+SAMPLE_SIZE = 64
+
+
+def dhash(image):
+    """Return the 64 bit difference hash of an image as 16 hex digits"""
+    # similar looking images get hashes only a few bits apart, whatever
+    # their size or encoding
+    from PIL import Image
+
+    gray = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:016x}'
+
+
+def hamming(hash1, hash2):
+    """Return the number of different bits of two hex hashes"""
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1')
+
+
+def dominant_color(image):
+    """Return the most common colour of an image as #rrggbb"""
+    # reduce to a few colours first, otherwise every pixel is its own colour
+    palette_image = image.convert('RGB').quantize(colors=8)
+    count, index = max(palette_image.getcolors())
+    palette = palette_image.getpalette()
+    red, green, blue = palette[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def image_metadata(file):
+    """Return the metadata columns of an image file"""
+    from PIL import Image
+
+    file.seek(0)
+    with Image.open(file) as image:
+        image_format = image.format or ''
+        width, height = image.size
+        # JPEGs are decoded at 1/2 .. 1/8 scale, no need for every pixel
+        image.draft('RGB', (SAMPLE_SIZE, SAMPLE_SIZE))
+        sample = image.convert('RGB')
+    sample.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+    file.seek(0)
+
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': file.size,
+        'image_format': image_format.lower(),
+        'image_dominant_color': dominant_color(sample),
+        'image_phash': dhash(sample),
+    }
+
+
+# the JPEG segments kept: JFIF, ICC profile (APP2) and Adobe (APP14), which
+# tells how the colours were transformed
+JPEG_KEPT_APPS = (0xe0, 0xe2, 0xee)
+
+
+def strip_jpeg(data, orientation=1):
+    """Return a JPEG without its EXIF, XMP and comments, None if malformed
+
+    Only the segments before the image data are rewritten, the pixels stay
+    the same bytes. An orientation other than 1 is kept in a minimal EXIF.
+    """
+    from PIL import Image
+
+    if data[:2] != b'\xff\xd8':
+        return None
+    segments = [data[:2]]
+    position = 2
+    while True:
+        if position + 4 > len(data) or data[position] != 0xff:
+            return None
+        marker = data[position + 1]
+        if marker == 0xff:  # fill byte
+            position += 1
+            continue
+        if marker == 0xda:  # start of scan, the image data up to the end
+            tail = data[position:]
+            break
+        end = position + 2 + int.from_bytes(data[position + 2:position + 4],
+                                            'big')
+        segment = data[position:end]
+        if marker == 0xfe:  # comment
+            kept = False
+        elif marker == 0xe2:  # APP2 holds other things than profiles too
+            kept = segment[4:16] == b'ICC_PROFILE\x00'
+        else:  # the tables and the frame header are no APPn
+            kept = not 0xe0 <= marker <= 0xef or marker in JPEG_KEPT_APPS
+        if kept:
+            segments.append(segment)
+        position = end
+
+    if orientation != 1:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif = exif.tobytes()
+        if not exif.startswith(b'Exif\x00\x00'):  # older Pillows
+            exif = b'Exif\x00\x00' + exif
+        # after the JFIF segment, which must come first
+        index = 2 if len(segments) > 1 and segments[1][1] == 0xe0 else 1
+        segments.insert(index, b'\xff\xe1' +
+                        (len(exif) + 2).to_bytes(2, 'big') + exif)
+    return b''.join(segments) + tail
+
+
+def optimize(file):
+    """Return an image without its metadata, None if not worth it
+
+    Nothing is decoded and encoded again with a loss: the segments of a
+    JPEG holding EXIF, XMP and comments are removed, its EXIF orientation
+    stays; a PNG is turned upright and compressed again, losslessly. The
+    colour profile is kept. The result is only returned if it saves bytes
+    or turned a PNG.
+    """
+    from PIL import Image, ImageOps
+
+    file.seek(0)
+    original = file.read()
+    file.seek(0)
+    with Image.open(io.BytesIO(original)) as image:
+        image_format = image.format
+        if getattr(image, 'is_animated', False):
+            return None  # saving would keep the first frame only
+        orientation = image.getexif().get(0x0112, 1)
+        if image_format == 'JPEG':
+            data = strip_jpeg(original, orientation)
+            if data is None or len(data) >= len(original):
+                return None
+            return data
+        if image_format != 'PNG':
+            return None
+        options = {'optimize': True}
+        # the colour profile changes how the image looks, EXIF, XMP and
+        # comments don't
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+        if 'transparency' in image.info:
+            options['transparency'] = image.info['transparency']
+        upright = ImageOps.exif_transpose(image)
+        output = io.BytesIO()
+        upright.save(output, image_format, **options)
+
+    data = output.getvalue()
+    if orientation == 1 and len(data) >= len(original):
+        return None
+    return data
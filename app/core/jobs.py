@@ -0,0 +1,133 @@
+"""Background jobs queued in the database, see run_workers"""
+import datetime
+import logging
+import time
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+
+def task_path(task):
+    """Return the dotted path of a task given as a function or a path"""
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, args=(), kwargs=None, delay=0, max_attempts=None,
+            using='default'):
+    """Queue a call of task(*args, **kwargs) for the workers
+
+    The arguments are stored as JSON. Enqueued inside a transaction the job
+    is only seen by the workers once the transaction is committed.
+    """
+    return Job.objects.using(using).create(
+        task=task_path(task),
+        args=list(args),
+        kwargs=kwargs or {},
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds to wait before running a job again after a failed attempt"""
+    return min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1),
+               settings.JOB_MAX_RETRY_DELAY)
+
+
+def claim(limit=1, using='default'):
+    """Mark due jobs as running and return them
+
+    SKIP LOCKED lets concurrent workers claim different rows without
+    waiting for each other. Running jobs older than JOB_TIMEOUT belong to a
+    worker that died, they are claimed again.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=settings.JOB_TIMEOUT)
+    with transaction.atomic(using=using):
+        jobs = list(
+            Job.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(Q(status=Job.QUEUED, run_at__lte=now) |
+                    Q(status=Job.RUNNING, started_at__lt=stale))
+            .order_by('run_at', 'id')[:limit]
+        )
+        if jobs:
+            Job.objects.using(using).filter(id__in=[j.id for j in jobs]) \
+                .update(status=Job.RUNNING, started_at=now,
+                        attempts=F('attempts') + 1)
+    for job in jobs:
+        job.status = Job.RUNNING
+        job.started_at = now
+        job.attempts += 1
+    return jobs
+
+
+def run(job, using='default'):
+    """Run a claimed job, then record its success or schedule a retry"""
+    start = time.monotonic()
+    try:
+        import_string(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = retry_delay(job.attempts)
+            changes = {'status': Job.QUEUED,
+                       'run_at': now + datetime.timedelta(seconds=delay)}
+            logger.warning('Job %s %s failed, retry in %ss',
+                           job.id, job.task, delay)
+        else:
+            changes = {'status': Job.FAILED, 'finished_at': now}
+            logger.error('Job %s %s failed %s times', job.id, job.task,
+                         job.attempts)
+        changes['last_error'] = error
+    else:
+        changes = {'status': Job.DONE, 'finished_at': timezone.now()}
+        logger.info('Job %s %s done in %.3fs', job.id, job.task,
+                    time.monotonic() - start)
+
+    # only if the job is still ours, it may have been claimed again after
+    # JOB_TIMEOUT
+    Job.objects.using(using).filter(
+        id=job.id, status=Job.RUNNING, started_at=job.started_at
+    ).update(**changes)
+    for name, value in changes.items():
+        setattr(job, name, value)
+    return job.status == Job.DONE
+
+
+def work(batch=1, using='default'):
+    """Claim and run one batch of jobs, return the number of jobs run"""
+    jobs = claim(batch, using)
+    for job in jobs:
+        run(job, using)
+    return len(jobs)
+
+
+def metrics(using='default'):
+    """Return the number of jobs by status and the queue latency"""
+    jobs = Job.objects.using(using)
+    counts = dict(jobs.values_list('status').annotate(Count('id'))
+                  .order_by())
+    now = timezone.now()
+    oldest = jobs.filter(status=Job.QUEUED, run_at__lte=now) \
+        .aggregate(oldest=Min('run_at'))['oldest']
+    duration = jobs.filter(status=Job.DONE).aggregate(
+        duration=Avg(F('finished_at') - F('started_at')))['duration']
+    return {
+        **{status: counts.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        # how long the oldest due job has been waiting for a worker
+        'lag_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'average_run_seconds': duration.total_seconds() if duration else 0,
+    }
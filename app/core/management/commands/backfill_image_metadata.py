@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import imaging, sharding, stats
+from core.models import Painting
+
+
+class Command(BaseCommand):
+    """Django command filling the image metadata of older paintings"""
+    help = 'Compute the stored metadata of images uploaded before it existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--database',
+            help='Only fill the paintings of this database, every shard by '
+                 'default'
+        )
+
+    def handle(self, *args, **options):
+        databases = sharding.databases()
+        if options['database']:
+            databases = [options['database']]
+        done = failed = 0
+        for database in databases:
+            filled, unreadable = self.backfill(database,
+                                               options['batch_size'])
+            done += filled
+            failed += unreadable
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored the metadata of {done} images ({failed} unreadable).'
+        ))
+
+    def backfill(self, using, batch_size):
+        """Fill the paintings of a database, return (done, failed)"""
+        # paintings get the metadata at upload, only the images uploaded
+        # before it was stored are missing it
+        missing = Painting.objects.using(using) \
+            .exclude(image='').exclude(image=None) \
+            .filter(image_phash='', deleted_at__isnull=True).order_by('id')
+        # updated_at: the clients syncing download the new metadata
+        fields = list(imaging.EMPTY_METADATA) + ['updated_at']
+        done = failed = last_id = 0
+        while True:
+            batch = list(missing.filter(id__gt=last_id)
+                         [:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            filled = []
+            now = timezone.now()
+            for painting in batch:
+                try:
+                    with painting.image.open('rb') as image:
+                        metadata = imaging.image_metadata(image)
+                except (OSError, ValueError) as exc:
+                    # missing or broken file, nothing to store
+                    self.stderr.write(f'Painting {painting.id}: {exc}')
+                    failed += 1
+                    continue
+                for field, value in metadata.items():
+                    setattr(painting, field, value)
+                painting.updated_at = now
+                filled.append(painting)
+            if filled:
+                Painting.objects.using(using).bulk_update(filled, fields)
+            for user_id in {painting.user_id for painting in filled
+                            if painting.image_phash}:
+                stats.image_hashes_changed(user_id, using)
+            done += len(filled)
+        return done, failed
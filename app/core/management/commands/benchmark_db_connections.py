@@ -0,0 +1,92 @@
+import copy
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_started, request_finished
+from django.db import connections
+
+
+POOLED_ENGINE = 'core.db.backends.postgresql'
+
+# settings applied on top of the database settings for each compared mode
+MODES = {
+    'new': {'CONN_MAX_AGE': 0},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    'pooled': {'CONN_MAX_AGE': 0, 'pool': True},
+}
+
+
+class Command(BaseCommand):
+    """Django command measuring requests/sec for each connection mode"""
+    help = 'Compare new, persistent and pooled database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Simulated requests per thread')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--modes', default=','.join(MODES))
+
+    def handle(self, *args, **options):
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f'Unknown modes: {", ".join(sorted(unknown))}')
+
+        self.stdout.write(
+            f'{options["threads"]} threads x {options["requests"]} requests'
+        )
+        for mode in modes:
+            alias = self._add_alias(options['database'], mode,
+                                    options['threads'])
+            try:
+                rate = self._run(alias, options['requests'],
+                                 options['threads'])
+            finally:
+                self._remove_alias(alias)
+            self.stdout.write(f'{mode:>12}: {rate:10.1f} requests/sec')
+
+    def _add_alias(self, database, mode, threads):
+        """Register a copy of a database configured for one mode"""
+        settings_dict = copy.deepcopy(connections.databases[database])
+        overrides = dict(MODES[mode])
+        settings_dict['OPTIONS'].pop('pool', None)
+        if overrides.pop('pool', False):
+            if settings_dict['ENGINE'] != POOLED_ENGINE:
+                raise CommandError(f'Pooling needs ENGINE={POOLED_ENGINE}')
+            settings_dict['OPTIONS']['pool'] = {
+                'min_size': 1, 'max_size': threads
+            }
+        settings_dict.update(overrides)
+        alias = f'benchmark_{mode}'
+        connections.databases[alias] = settings_dict
+        return alias
+
+    def _remove_alias(self, alias):
+        """Forget a benchmark alias and close its pool"""
+        settings_dict = connections.databases.pop(alias)
+        if settings_dict['OPTIONS'].get('pool'):
+            from core.db.backends.postgresql.base import close_pools
+            close_pools(alias)
+
+    def _run(self, alias, requests, threads):
+        """Run the request loop in threads, return requests per second"""
+        def simulate():
+            for _ in range(requests):
+                # the same signals Django sends around every real request,
+                # they close or recycle connections depending on the mode
+                request_started.send(sender=self.__class__)
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+            connections[alias].close()
+
+        workers = [threading.Thread(target=simulate) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return requests * threads / (time.perf_counter() - start)
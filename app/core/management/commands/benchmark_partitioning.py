@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import partitioning
+
+
+SCHEMA = 'partition_benchmark'
+QUERIES = {
+    # the list of PaintingViewSet, newest first
+    'list': 'SELECT id, title FROM {table} WHERE user_id = %s '
+            'ORDER BY updated_at DESC LIMIT 50',
+    'count': 'SELECT count(*) FROM {table} WHERE user_id = %s',
+}
+
+
+class Command(BaseCommand):
+    """Django command comparing a heap and a hash partitioned table"""
+    help = ('Measure per-user queries and vacuum of a partitioned table. '
+            'No figures are recorded yet, it was never run against a '
+            'PostgreSQL server.')
+    # the synthetic tables live in their own schema, dropped at the end
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--samples', type=int, default=200,
+                            help='Users queried per table and query')
+        parser.add_argument('--keep', action='store_true',
+                            help=f'Keep the {SCHEMA} schema')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        try:
+            partitioning.check_vendor(options['database'])
+        except partitioning.PartitioningError as error:
+            raise CommandError(str(error))
+        with connection.cursor() as cursor:
+            try:
+                self._create(cursor, options)
+                self._queries(cursor, options)
+                self._vacuum(cursor, options)
+            finally:
+                if not options['keep']:
+                    cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+
+    def _create(self, cursor, options):
+        columns = ('id bigserial, user_id integer NOT NULL, '
+                   'title varchar(255) NOT NULL, '
+                   'updated_at timestamp with time zone NOT NULL')
+        cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+        cursor.execute(f'CREATE TABLE {SCHEMA}.heap ({columns}, '
+                       'PRIMARY KEY (id))')
+        cursor.execute(f'CREATE TABLE {SCHEMA}.part ({columns}, '
+                       'PRIMARY KEY (id, user_id)) '
+                       'PARTITION BY HASH (user_id)')
+        partitions = options['partitions']
+        for remainder in range(partitions):
+            cursor.execute(
+                f'CREATE TABLE {SCHEMA}.part_{remainder} PARTITION OF '
+                f'{SCHEMA}.part FOR VALUES WITH '
+                f'(MODULUS {partitions}, REMAINDER {remainder})')
+        for table in ('heap', 'part'):
+            cursor.execute(f'CREATE INDEX ON {SCHEMA}.{table} '
+                           '(user_id, updated_at)')
+
+        start = time.perf_counter()
+        cursor.execute(
+            f'INSERT INTO {SCHEMA}.heap (user_id, title, updated_at) '
+            'SELECT 1 + floor(random() * %s), md5(g::text), '
+            "now() - g * interval '1 second' "
+            'FROM generate_series(1, %s) g',
+            [options['users'], options['rows']])
+        cursor.execute(f'INSERT INTO {SCHEMA}.part SELECT * FROM '
+                       f'{SCHEMA}.heap')
+        for table in ('heap', 'part'):
+            cursor.execute(f'ANALYZE {SCHEMA}.{table}')
+        self.stdout.write(f'Created {options["rows"]} rows of '
+                          f'{options["users"]} users in each table in '
+                          f'{time.perf_counter() - start:.1f}s')
+
+    def _queries(self, cursor, options):
+        users = [random.randint(1, options['users'])
+                 for _ in range(options['samples'])]
+        for name, query in QUERIES.items():
+            for table in ('heap', 'part'):
+                sql = query.format(table=f'{SCHEMA}.{table}')
+                timings = []
+                for user_id in users:
+                    start = time.perf_counter()
+                    cursor.execute(sql, [user_id])
+                    cursor.fetchall()
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{name:>6} {table}: '
+                    f'mean {statistics.mean(timings):7.3f} ms, '
+                    f'p95 {timings[int(len(timings) * 0.95) - 1]:7.3f} ms'
+                )
+
+    def _vacuum(self, cursor, options):
+        # the churn of a day: a tenth of the rows deleted
+        for table in ('heap', 'part'):
+            cursor.execute(f'DELETE FROM {SCHEMA}.{table} WHERE id % 10 = 0')
+        # VACUUM can't run in a transaction, the cursor is in autocommit
+        for table in ('heap', 'part', 'part_0'):
+            start = time.perf_counter()
+            cursor.execute(f'VACUUM {SCHEMA}.{table}')
+            self.stdout.write(
+                f'vacuum {table}: {time.perf_counter() - start:7.3f} s')
+        self.stdout.write('part_0 is what a vacuum of a single partition '
+                          'costs, autovacuum handles them one by one')
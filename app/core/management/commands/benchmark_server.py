@@ -0,0 +1,131 @@
+import http.client
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+SERVERS = ('runserver', 'gunicorn')
+
+
+class Command(BaseCommand):
+    """Django command comparing runserver with the gunicorn setup"""
+    help = 'Measure startup time and throughput of the app servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default=','.join(SERVERS))
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--path', default='/api/painting/paintings/',
+                            help='URL requested by the benchmark')
+        parser.add_argument('--token', default='',
+                            help='API token sent with every request')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--startup-timeout', type=float, default=60)
+
+    def handle(self, *args, **options):
+        servers = options['servers'].split(',')
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(
+                f'Unknown servers: {", ".join(sorted(unknown))}')
+
+        for server in servers:
+            process = subprocess.Popen(
+                self._command(server, options['port']),
+                cwd=settings.BASE_DIR,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                # logging every request would slow the server down
+                env={**os.environ, 'GUNICORN_ACCESS_LOG': ''},
+                start_new_session=True  # to stop its worker processes too
+            )
+            try:
+                startup = self._wait_ready(process, options)
+                rate, latencies = self._load(options)
+            finally:
+                if process.poll() is None:
+                    os.killpg(process.pid, signal.SIGTERM)
+                process.wait()
+
+            self.stdout.write(
+                f'{server:>10}: ready in {startup:.2f}s, {rate:.1f} req/s, '
+                f'p50 {statistics.median(latencies) * 1000:.1f}ms, '
+                f'p99 {latencies[int(len(latencies) * .99) - 1] * 1000:.1f}ms'
+            )
+
+    def _command(self, server, port):
+        """Return the command line starting a server on a port"""
+        if server == 'runserver':
+            return [sys.executable, 'manage.py', 'runserver', '--noreload',
+                    f'127.0.0.1:{port}']
+        return [sys.executable, '-m', 'gunicorn',
+                '-c', 'python:app.gunicorn_conf',
+                '--bind', f'127.0.0.1:{port}']
+
+    def _request(self, options, connection=None):
+        """Send one request, reusing a keep-alive connection if given"""
+        connection = connection or http.client.HTTPConnection(
+            '127.0.0.1', options['port'], timeout=10)
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        connection.request('GET', options['path'], headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.getheader('Connection', '').lower() == 'close':
+            connection.close()
+        return connection
+
+    def _wait_ready(self, process, options):
+        """Return the seconds until the server answered its first request"""
+        start = time.perf_counter()
+        while time.perf_counter() - start < options['startup_timeout']:
+            if process.poll() is not None:
+                raise CommandError('The server exited while starting')
+            try:
+                self._request(options).close()
+                return time.perf_counter() - start
+            except (ConnectionError, socket.timeout,
+                    http.client.HTTPException):
+                time.sleep(0.05)  # not listening yet
+        raise CommandError('The server did not start in time')
+
+    def _load(self, options):
+        """Return requests/sec and sorted latencies under concurrent load"""
+        per_thread = options['requests'] // options['concurrency']
+        latencies = []
+        lock = threading.Lock()
+
+        def client():
+            connection = None
+            timings = []
+            for _ in range(per_thread):
+                started = time.perf_counter()
+                try:
+                    connection = self._request(options, connection)
+                except (ConnectionError, http.client.HTTPException):
+                    connection = None  # the server closed it, reconnect
+                    continue
+                timings.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(timings)
+
+        clients = [threading.Thread(target=client)
+                   for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if not latencies:
+            raise CommandError('No request succeeded')
+        return len(latencies) / elapsed, sorted(latencies)
@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import AnonRateThrottle
+
+from core import throttling
+
+
+class Command(BaseCommand):
+    """Django command measuring the cost of a throttle check"""
+    help = 'Measure the time the throttles add to every request'
+    # e.g. --clients 5: the fixed window gets slower as the requests of a
+    # client pile up, the bucket stays two numbers
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=100,
+                            help='Distinct client addresses')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        requests = []
+        for client in range(options['clients']):
+            request = Request(factory.get(
+                '/', REMOTE_ADDR=f'10.0.{client // 256}.{client % 256}'))
+            request.user = AnonymousUser()
+            requests.append(request)
+
+        # DRF's fixed window throttle as a reference, it stores the time of
+        # every request of the window
+        class ReferenceThrottle(AnonRateThrottle):
+            rate = '1000000/min'
+
+        for name, throttle in (
+                ('token bucket', throttling.ReadThrottle('1000000/min')),
+                ('DRF fixed window', ReferenceThrottle())):
+            throttle.cache.clear()
+            start = time.perf_counter()
+            for check in range(options['checks']):
+                throttle.allow_request(requests[check % len(requests)], None)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{name:>16}: {elapsed / options["checks"] * 1e6:8.1f} '
+                f'us per check'
+            )
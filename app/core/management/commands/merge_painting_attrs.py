@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core import dedup
+from core.models import Category, Supply, Painting
+
+
+class Command(BaseCommand):
+    """Django command merging categories and supplies differing by case"""
+    help = 'Merge the duplicated category and supply names of users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='emails', default=[],
+            help='Only merge the names of the user with this email, can be '
+                 'repeated'
+        )
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the duplicated names')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        # run it before migrating big tables: the migration adding the
+        # unique indexes merges in its own, single, transaction
+        database = options['database']
+        user_ids = None
+        if options['emails']:
+            user_ids = list(
+                get_user_model().objects.using(database)
+                .filter(email__in=options['emails'])
+                .values_list('id', flat=True)
+            )
+        for name, model in (('categories', Category), ('supplies', Supply)):
+            through = getattr(Painting, name).through
+            column = f'{model._meta.model_name}_id'
+            if options['dry_run']:
+                groups = dedup.duplicate_groups(model, database, user_ids)
+                self.stdout.write(f'{len(groups)} duplicated {name} names.')
+                continue
+            merged = dedup.merge_duplicates(model, through, column, database,
+                                            user_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'Merged {merged} duplicated {name}.'
+            ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+from core.models import User
+
+
+class Command(BaseCommand):
+    """Django command moving the data of a user to another database"""
+    help = 'Move the categories, supplies and paintings of a user to a shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Email of the user')
+        parser.add_argument('--to', required=True, dest='target',
+                            help='Alias of the target database')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows copied or deleted per transaction')
+        parser.add_argument('--no-wait', action='store_true',
+                            help="Don't wait for the processes to see the "
+                                 'move, when the API is stopped')
+
+    def handle(self, *args, **options):
+        # the user can read their paintings all along, their writes are
+        # refused with a 503 while the rows are copied
+        user = User.objects.filter(email=options['user']).first()
+        if user is None:
+            raise CommandError(f'No user {options["user"]!r}.')
+        try:
+            sharding.move_user(
+                user.pk, options['target'], options['batch_size'],
+                wait=0 if options['no_wait'] else None,
+                log=self.stdout.write)
+        except sharding.ShardError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {user.email} to {options["target"]}.'
+        ))
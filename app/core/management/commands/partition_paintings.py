@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import partitioning
+
+
+class Command(BaseCommand):
+    """Django command hash partitioning the painting tables"""
+    help = 'Partition core_painting by user and its M2M tables by painting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Rows copied per transaction')
+        parser.add_argument('--drop-old', action='store_true',
+                            help='Drop the unpartitioned tables, kept as '
+                                 '<table>_old otherwise')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        # the copy runs alongside the API, only the final catch-up and
+        # swap hold a lock blocking the writes to the painting tables
+        database = options['database']
+        if options['partitions'] < 2:
+            raise CommandError('At least 2 partitions are needed.')
+        try:
+            seconds = partitioning.partition(
+                database, options['partitions'], options['batch_size'],
+                log=self.stdout.write)
+        except partitioning.PartitioningError as error:
+            raise CommandError(str(error))
+        if options['drop_old']:
+            partitioning.drop_old_tables(database)
+        self.stdout.write(self.style.SUCCESS(
+            f'Partitioned the painting tables in {seconds:.1f}s.'
+        ))
@@ -0,0 +1,67 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import deletion, sharding
+from core.models import Painting, User
+
+
+class Command(BaseCommand):
+    """Django command removing the soft deleted paintings and users"""
+    help = 'Delete the rows, links and images of soft deleted data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--older-than', type=float, default=0,
+            help='Only purge what was deleted this many hours ago'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to sleep between two users, to spread the load'
+        )
+        parser.add_argument(
+            '--database',
+            help='Only purge this database, every shard by default'
+        )
+
+    def handle(self, *args, **options):
+        databases = sharding.databases()
+        if options['database']:
+            databases = [options['database']]
+        cutoff = timezone.now() - datetime.timedelta(
+            hours=options['older_than'])
+
+        paintings = 0
+        for database in databases:
+            paintings += deletion.purge_paintings(
+                Painting.objects.filter(deleted_at__lte=cutoff),
+                options['batch_size'], database
+            )
+        users = 0
+        if 'default' in databases:
+            # the users are on the default database, purge_user() finds
+            # the shard of their data
+            user_ids = User.objects.using('default') \
+                .filter(deleted_at__lte=cutoff).values_list('id', flat=True)
+            for user_id in list(user_ids):
+                paintings += deletion.purge_user(user_id,
+                                                 options['batch_size'])
+                users += 1
+                time.sleep(options['pause'])
+
+        # older cursors get a full sync, their tombstones aren't needed
+        before = timezone.now() - datetime.timedelta(
+            seconds=settings.SYNC_CURSOR_MAX_AGE)
+        tombstones = 0
+        for database in databases:
+            tombstones += deletion.purge_tombstones(
+                before, options['batch_size'], database)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {paintings} paintings and {users} users, '
+            f'{tombstones} sync tombstones.'
+        ))
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core import sharding, stats
+
+
+class Command(BaseCommand):
+    """Django command to recompute the denormalized painting counters"""
+    help = 'Recompute painting counts of users, categories and supplies'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='emails', default=[],
+            help='Only reconcile the user with this email, can be repeated'
+        )
+        parser.add_argument(
+            '--database',
+            help='Only reconcile the users whose paintings are on this '
+                 'database, all of them by default'
+        )
+
+    def handle(self, *args, **options):
+        # the users are all on the default database, their paintings and
+        # counters on the shard of each of them
+        users = get_user_model().objects.using('default')
+        if options['emails']:
+            users = users.filter(email__in=options['emails'])
+        # one transaction per user keeps the locks short on big tables
+        fixed = checked = skipped = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            using, read_only = sharding.assignment(user_id)
+            if options['database'] and using != options['database']:
+                continue
+            if read_only:
+                skipped += 1  # being moved, its rows are being copied
+                continue
+            fixed += stats.reconcile_user(user_id, using)
+            checked += 1
+        if skipped:
+            self.stdout.write(f'Skipped {skipped} users being moved.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled {checked} users, fixed {fixed} counters.'
+        ))
@@ -0,0 +1,107 @@
+import multiprocessing
+import multiprocessing.connection
+import logging
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, DatabaseError
+
+from core import jobs
+
+
+logger = logging.getLogger(__name__)
+
+
+def worker_loop(stop, options):
+    """Run jobs until the stop event is set"""
+    # the parent handles ctrl-c and tells the workers to stop, a job is
+    # never interrupted in the middle
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        while not stop.is_set():
+            try:
+                done = jobs.work(options['batch'], options['database'])
+            except DatabaseError:
+                # e.g. a restarting database, try again with a new
+                # connection instead of losing the worker
+                logger.exception('Claiming jobs failed')
+                connections.close_all()
+                stop.wait(options['poll_interval'])
+                continue
+            if not done:
+                if options['once']:
+                    return
+                stop.wait(options['poll_interval'])
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """Django command running the background jobs of core.jobs"""
+    help = 'Run queued background jobs in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count(),
+            help='Number of worker processes, 0 runs the due jobs in this '
+                 'process and exits'
+        )
+        parser.add_argument('--batch', type=int, default=1,
+                            help='Jobs claimed by a worker at once')
+        parser.add_argument('--poll-interval', type=float, default=1,
+                            help='Seconds to wait when no job is due')
+        parser.add_argument('--metrics-interval', type=float, default=60,
+                            help='Seconds between two metrics lines')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due')
+        parser.add_argument('--database', default='default')
+
+    def write_metrics(self, database):
+        metrics = jobs.metrics(database)
+        self.stdout.write(' '.join(f'{k}={v}' for k, v in metrics.items()))
+
+    def handle(self, *args, **options):
+        if not options['processes']:
+            worker_loop(multiprocessing.Event(), {**options, 'once': True})
+            self.write_metrics(options['database'])
+            return
+
+        # a forked child must not share the socket of the parent connection
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+
+        def start_worker():
+            worker = context.Process(target=worker_loop, args=(stop, options),
+                                     daemon=True)
+            worker.start()
+            return worker
+
+        workers = [start_worker() for _ in range(options['processes'])]
+
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping, waiting for the running jobs ...')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        last_metrics = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            multiprocessing.connection.wait(
+                [worker.sentinel for worker in workers if worker.is_alive()],
+                timeout=1)
+            for index, worker in enumerate(workers):
+                # a crashed worker is replaced, its job is claimed again
+                # after JOB_TIMEOUT
+                if worker.exitcode and not stop.is_set():
+                    self.stderr.write(
+                        f'Worker {worker.pid} exited with {worker.exitcode}')
+                    workers[index] = start_worker()
+            if time.monotonic() - last_metrics >= options['metrics_interval']:
+                self.write_metrics(options['database'])
+                connections.close_all()
+                last_metrics = time.monotonic()
+
+        self.write_metrics(options['database'])
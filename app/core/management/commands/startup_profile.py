@@ -0,0 +1,113 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# what a worker does before it can answer its first request
+STARTUP_CODE = '''
+import sys
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+get_wsgi_application()
+get_resolver().url_patterns
+sys.stdout.write(' '.join(sorted(sys.modules)))
+'''
+
+IMPORTTIME_RE = re.compile(
+    r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s(\s*)(\S+)$'
+)
+
+
+def parse_importtime(output):
+    """Return (module, self us, cumulative us, depth) for -X importtime"""
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            imports.append((module, int(own), int(cumulative),
+                            len(indent) // 2))
+    return imports
+
+
+def group_by_package(imports):
+    """Return the self import time of every top level package"""
+    packages = defaultdict(int)
+    for module, own, _, _ in imports:
+        packages[module.split('.')[0]] += own
+    return sorted(packages.items(), key=lambda item: -item[1])
+
+
+class Command(BaseCommand):
+    """Django command reporting where the worker start up time goes"""
+    help = 'Profile the imports done while a worker starts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--settings-module',
+            default=os.environ.get('DJANGO_SETTINGS_MODULE'),
+            help='Settings to profile, e.g. app.settings_api'
+        )
+        parser.add_argument('--top', type=int, default=15)
+        parser.add_argument('--json', action='store_true',
+                            help='Print the measures as JSON for metrics')
+
+    def handle(self, *args, **options):
+        # a fresh interpreter, in this one everything is imported already
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+            cwd=settings.BASE_DIR,
+            env={**os.environ,
+                 'DJANGO_SETTINGS_MODULE': options['settings_module']},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        wall = time.perf_counter() - start
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        imports = parse_importtime(result.stderr)
+        modules = set(result.stdout.split())
+        report = {
+            'settings': options['settings_module'],
+            'wall_seconds': round(wall, 3),
+            'import_seconds': round(
+                sum(own for _, own, _, _ in imports) / 1e6, 3),
+            'modules': len(modules),
+            # image libraries should only load when an image is handled
+            'pillow_imported': 'PIL' in modules,
+            'packages': [
+                {'package': package, 'seconds': round(own / 1e6, 4)}
+                for package, own in group_by_package(imports)[:options['top']]
+            ],
+            'slowest_modules': [
+                {'module': module, 'seconds': round(cumulative / 1e6, 4)}
+                for module, _, cumulative, _ in sorted(
+                    imports, key=lambda item: -item[2])[:options['top']]
+            ],
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+
+        self.stdout.write(
+            f'{report["settings"]}: started in {report["wall_seconds"]}s, '
+            f'{report["import_seconds"]}s importing {report["modules"]} '
+            f'modules, Pillow imported: {report["pillow_imported"]}'
+        )
+        self.stdout.write('Self import time by package:')
+        for row in report['packages']:
+            self.stdout.write(f'  {row["seconds"]:8.4f}s  {row["package"]}')
+        self.stdout.write('Slowest modules including their imports:')
+        for row in report['slowest_modules']:
+            self.stdout.write(f'  {row["seconds"]:8.4f}s  {row["module"]}')
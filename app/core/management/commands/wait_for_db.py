@@ -1,23 +1,130 @@
+import math
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
 # import connection module to test if the database connection is available
 from django.db import connections
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
     """ Django command to pause execution until database is available"""
+    help = 'Wait until the databases accept queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Database alias to wait for, can be repeated '
+                 '(default: default)'
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=60,
+            help='Give up after this many seconds, 0 waits forever'
+        )
+        parser.add_argument(
+            '--initial-delay', type=float, default=0.1,
+            help='Seconds to wait after the first failed attempt'
+        )
+        parser.add_argument(
+            '--max-delay', type=float, default=5,
+            help='Longest wait between two attempts'
+        )
+
+    def probe(self, alias, timeout=None):
+        """Run a query on a database, raise OperationalError if it's down"""
+        # connections[alias] alone never connects, the database is only
+        # really available when it answers a query
+        connection = connections[alias]
+        if timeout is not None and connection.vendor == 'postgresql':
+            # a connection to a host dropping the packets would hang for
+            # minutes, past --timeout; libpq waits at least 2 seconds and
+            # forever on 0
+            options = connection.settings_dict.get('OPTIONS', {})
+            seconds = max(2, math.ceil(timeout))
+            configured = int(options.get('connect_timeout') or 0)
+            if configured:
+                seconds = min(seconds, configured)
+            # a copy, the settings are shared by the connections of every
+            # thread while this one only lives in the thread of the probe
+            connection.settings_dict = {
+                **connection.settings_dict,
+                'OPTIONS': {**options, 'connect_timeout': seconds},
+            }
+        try:
+            connection.ensure_connection()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        finally:
+            connection.close()  # every probe runs in its own thread
+
+    def wait_for(self, alias, options):
+        """Probe a database until it answers, return the seconds it took"""
+        start = time.monotonic()
+        delay = options['initial_delay']
+        attempts = 0
+        while True:
+            attempts += 1
+            remaining = None
+            if options['timeout']:
+                remaining = options['timeout'] - (time.monotonic() - start)
+            try:
+                self.probe(alias, remaining)
+                return time.monotonic() - start, attempts
+            except OperationalError:
+                pass
+            # exponential backoff, the jitter keeps many containers starting
+            # together from retrying in lockstep
+            sleep = delay / 2 + random.uniform(0, delay / 2)
+            elapsed = time.monotonic() - start
+            if options['timeout'] and elapsed + sleep > options['timeout']:
+                raise CommandError(
+                    f'Database {alias} is unavailable after {elapsed:.2f}s '
+                    f'({attempts} attempts)'
+                )
+            self.stdout.write(
+                f'Database {alias} is unavailable, waiting {sleep:.2f} '
+                f'seconds.'
+            )
+            time.sleep(sleep)
+            delay = min(delay * 2, options['max_delay'])
 
     def handle(self, *args, **options):
+        aliases = options['databases'] or ['default']
+        # a typo would otherwise fail in every thread with a traceback
+        unknown = [alias for alias in aliases
+                   if alias not in settings.DATABASES]
+        if unknown:
+            raise CommandError(
+                f'Unknown database {", ".join(unknown)}, the aliases are '
+                f'{", ".join(settings.DATABASES)}.'
+            )
         self.stdout.write('Waiting for Database to start ...')
-        db_conn = None
-        while not db_conn:  # false value until database is available
+        start = time.monotonic()
+        # all the databases are waited for at the same time, thus the total
+        # wait is the one of the slowest database
+        with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+            waits = {
+                alias: executor.submit(self.wait_for, alias, options)
+                for alias in aliases
+            }
+        errors = []
+        for alias, wait in waits.items():
             try:
-                db_conn = connections['default']  # if connection is error and
-                # django will raise an error
-            except OperationalError:
-                self.stdout.write('Database is unavailable, waiting 1 second.')
-                time.sleep(1)
+                seconds, attempts = wait.result()
+            except CommandError as exc:
+                errors.append(str(exc))
+                continue
+            self.stdout.write(
+                f'Database {alias} is ready after {seconds:.2f}s '
+                f'({attempts} attempts).'
+            )
+        if errors:
+            raise CommandError(' '.join(errors))
 
-        self.stdout.write(self.style.SUCCESS('Database is available!'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Database is available! Time to ready: '
+            f'{time.monotonic() - start:.2f}s'
+        ))
@@ -0,0 +1,79 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def populate_counters(apps, schema_editor):
+    """Fill the new counters from the existing paintings"""
+    db = schema_editor.connection.alias
+    Painting = apps.get_model('core', 'Painting')
+    for model_name, field in (('Category', 'categories'),
+                              ('Supply', 'supplies')):
+        model = apps.get_model('core', model_name)
+        through = Painting._meta.get_field(field).remote_field.through
+        column = f'{model_name.lower()}_id'
+        counts = through.objects.using(db).filter(**{column: OuterRef('pk')}) \
+            .values(column).annotate(n=Count('id')).values('n')
+        model.objects.using(db).update(
+            painting_count=Coalesce(Subquery(counts), Value(0))
+        )
+
+    paintings = Painting.objects.using(db)
+    UserPaintingStats = apps.get_model('core', 'UserPaintingStats')
+    UserPaintingStats.objects.using(db).bulk_create(
+        UserPaintingStats(user_id=user_id, painting_count=n)
+        for user_id, n in paintings.values_list('user_id')
+        .annotate(n=Count('id')).order_by()
+    )
+    MonthlyPaintingCount = apps.get_model('core', 'MonthlyPaintingCount')
+    MonthlyPaintingCount.objects.using(db).bulk_create(
+        MonthlyPaintingCount(user_id=user_id, month=month, painting_count=n)
+        for user_id, month, n in paintings
+        .annotate(month=TruncMonth('painting_create_date'))
+        .values_list('user_id', 'month').annotate(n=Count('id')).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_painting_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPaintingStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='painting_stats', serialize=False, to='core.user')),
+                ('painting_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='painting_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='supply',
+            name='painting_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MonthlyPaintingCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('painting_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlypaintingcount',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='unique_monthly_painting_count'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
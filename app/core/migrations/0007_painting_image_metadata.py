@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_painting_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='painting',
+            name='image_dominant_color',
+            field=models.CharField(blank=True, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='image_format',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='image_phash',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='image_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='painting',
+            index=models.Index(fields=['user', 'image_width'], name='painting_user_width_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='painting',
+            index=models.Index(fields=['user', 'image_height'], name='painting_user_height_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='painting',
+            index=models.Index(fields=['user', 'image_format'], name='painting_user_format_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='painting',
+            index=models.Index(fields=['user', 'image_phash'], name='painting_user_phash_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+from core import dedup
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge the existing duplicates, the unique indexes would fail"""
+    db = schema_editor.connection.alias
+    Painting = apps.get_model('core', 'Painting')
+    for model_name, field in (('Category', 'categories'),
+                              ('Supply', 'supplies')):
+        model = apps.get_model('core', model_name)
+        through = Painting._meta.get_field(field).remote_field.through
+        dedup.merge_duplicates(model, through, f'{model_name.lower()}_id',
+                               using=db)
+
+
+class Migration(migrations.Migration):
+    # Django 3.2 can't declare a UniqueConstraint on Lower('name'), the
+    # expression indexes are created with SQL that PostgreSQL and SQLite
+    # both understand. LOWER(name) = LOWER(%s) lookups use them as well.
+
+    dependencies = [
+        ('core', '0008_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX category_user_lower_name_uniq '
+            'ON core_category (user_id, LOWER(name))',
+            'DROP INDEX category_user_lower_name_uniq',
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX supply_user_lower_name_uniq '
+            'ON core_supply (user_id, LOWER(name))',
+            'DROP INDEX supply_user_lower_name_uniq',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='painting',
+            name='image_original_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
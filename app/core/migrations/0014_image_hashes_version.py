@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_sharding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpaintingstats',
+            name='image_hashes_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
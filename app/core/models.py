@@ -4,6 +4,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                         PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
 
 
 def painting_image_file_path(instance, filename):
@@ -50,6 +51,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # set by core.deletion.soft_delete_user, the user can't log in anymore
+    # and purge_deleted removes the rows in small batches later
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     """assign user manage to objects attribute"""
     objects = UserManager()
@@ -65,7 +69,25 @@ class Category(models.Model):
         settings.AUTH_USER_MODEL,  # used from the settings imported on top
         on_delete=models.CASCADE,  # if the user is deleted the category will
         # be deleted as well
+        # no constraint: the category may be on a shard and the user on the
+        # default database, see core/sharding.py
+        db_constraint=False,
     )
+    # denormalized number of paintings in this category, maintained by the
+    # signals in core.signals so the stats endpoint doesn't need to count
+    # over the painting_categories table
+    painting_count = models.IntegerField(default=0)
+    # the names are unique per user whatever their case, see the
+    # category_user_lower_name_uniq index of migration 0009, a migration
+    # changing the table on SQLite must create it again (see 0011)
+    # the sync endpoint returns the rows changed after a client's cursor
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at'],
+                         name='category_user_updated_idx'),
+        ]
 
     def __str__(self):  # retrun the string representation
         return self.name
@@ -77,7 +99,17 @@ class Supply(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,  # see Category.user
     )
+    painting_count = models.IntegerField(default=0)
+    # unique (user_id, LOWER(name)) index, see migration 0009
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at'],
+                         name='supply_user_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -87,7 +119,8 @@ class Painting(models.Model):
     """Painting object"""
     user = models.ForeignKey(  # one painting can belong to only one user
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_constraint=False,  # see Category.user
     )
     # every field will be a column in the data table
     title = models.CharField(max_length=255)
@@ -105,7 +138,178 @@ class Painting(models.Model):
     image = models.ImageField(null=True, upload_to=painting_image_file_path)
     # we havent called the painting_image_file_path() function rather we are
     # passing a reference
+    # metadata of the image filled once at upload by core.imaging, so clients
+    # can filter and find duplicates without downloading the files
+    # the dimensions are not width_field/height_field of the ImageField, with
+    # those django opens the file of every loaded painting whose dimensions
+    # are still empty
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_size = models.PositiveIntegerField(null=True, blank=True)  # bytes
+    image_format = models.CharField(max_length=10, blank=True)
+    image_dominant_color = models.CharField(max_length=7, blank=True)
+    image_phash = models.CharField(max_length=16, blank=True)  # hex dhash
+    # size of the upload before painting.tasks.optimize_image stripped
+    # it, image_size is the size now; null until the job ran
+    image_original_size = models.PositiveIntegerField(null=True, blank=True)
+    # deleting only sets this, the API doesn't show the painting anymore and
+    # purge_deleted removes the row, its links and its image later
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # also changed by the soft delete and when the categories or supplies
+    # of the painting change, see core.signals
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # the paintings are always filtered by user first, the
+        # partition_paintings command hash partitions the table on user_id
+        indexes = [
+            models.Index(fields=['user', 'updated_at'],
+                         name='painting_user_updated_idx'),
+            # only the few deleted paintings waiting for the purge
+            models.Index(fields=['deleted_at'], name='painting_deleted_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+            models.Index(fields=['user', 'image_width'],
+                         name='painting_user_width_idx'),
+            models.Index(fields=['user', 'image_height'],
+                         name='painting_user_height_idx'),
+            models.Index(fields=['user', 'image_format'],
+                         name='painting_user_format_idx'),
+            models.Index(fields=['user', 'image_phash'],
+                         name='painting_user_phash_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class UserPaintingStats(models.Model):
+    """Denormalized painting counters of a user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,  # one row per user, looked up by the user id
+        related_name='painting_stats',
+        db_constraint=False,  # see Category.user
+    )
+    painting_count = models.IntegerField(default=0)
+    # bumped whenever an image hash of the user changes, the similar image
+    # searches build their tree again (see painting.similarity)
+    image_hashes_version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.painting_count}'
+
+
+class MonthlyPaintingCount(models.Model):
+    """Number of paintings of a user per month of painting_create_date"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,  # see Category.user
+    )
+    month = models.DateField()  # always the first day of the month
+    painting_count = models.IntegerField(default=0)
+
+    class Meta:
+        # the unique constraint also gives us the (user, month) index used
+        # by the stats endpoint and by the counter updates
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'month'],
+                name='unique_monthly_painting_count'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.month:%Y-%m}: {self.painting_count}'
 # Create your models here.
+
+
+class Job(models.Model):
+    """Background task queued in the database and run by run_workers"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=255)  # dotted path of the function
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField()  # not before, moved back on retries
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        # the workers look for the oldest due jobs of a status
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
+
+
+class SyncTombstone(models.Model):
+    """Painting, category or supply deleted, for the sync endpoint"""
+    PAINTING = 'painting'
+    CATEGORY = 'category'
+    SUPPLY = 'supply'
+    KIND_CHOICES = [
+        (PAINTING, 'Painting'),
+        (CATEGORY, 'Category'),
+        (SUPPLY, 'Supply'),
+    ]
+
+    # no constraint: the tombstones of a user are written while the user is
+    # being deleted, purge_deleted removes the old ones
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+'
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'],
+                         name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class ShardAssignment(models.Model):
+    """Database holding the categories, supplies and paintings of a user"""
+    # on the default database with the users, the users without a row are
+    # on the default database, as they all were before the sharding
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard'
+    )
+    database = models.CharField(max_length=100)  # alias in DATABASES
+    # set by move_user_shard while the rows are copied, the API refuses
+    # the writes of the user meanwhile
+    read_only = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.database}'
@@ -0,0 +1,315 @@
+"""Hash partitioning of the painting tables, PostgreSQL only
+
+core_painting is partitioned on user_id, the queries of the API always
+filter on it and only touch one partition. The M2M tables have no user_id
+column, Django writes their rows without one, they are partitioned on
+painting_id, which every lookup of theirs filters on. The primary keys
+become (id, partition key); no foreign key can point at the partitioned
+core_painting anymore, the link rows are deleted by the code before the
+paintings (see core.deletion) rather than by the database.
+
+A trigger logs the id of every row inserted, updated or deleted from the
+moment the copies exist. The rows are copied by batches while the API
+keeps running, then catch-up passes copy again the logged rows, each one
+in a short transaction, until few are left. Only the last pass runs with
+the tables locked against writes, before they are swapped with the
+originals.
+"""
+import hashlib
+import re
+import time
+
+from django.db import connections, transaction
+
+from core.models import Painting
+
+
+TABLES = (
+    (Painting._meta.db_table, 'user_id'),
+    (Painting.categories.through._meta.db_table, 'painting_id'),
+    (Painting.supplies.through._meta.db_table, 'painting_id'),
+)
+INDEX_RE = re.compile(r'^CREATE (UNIQUE )?INDEX (\S+) ON (\S+) (.*)$')
+MIN_PG_VERSION = 110000
+# the ids changed while copying, by table
+LOG_TABLE = 'partition_log'
+LOG_FUNCTION = 'partition_log_row'
+# rows left to catch up with before locking the tables for the last pass
+FINAL_DELTA = 1000
+MAX_CATCH_UP_PASSES = 20
+
+
+class PartitioningError(Exception):
+    """The tables can't be partitioned"""
+
+
+def check_vendor(using):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        raise PartitioningError(
+            'Partitioning needs PostgreSQL, the database '
+            f'{using!r} is {connection.vendor}.')
+    # hash partitions, and keys and indexes on partitioned tables
+    if connection.pg_version < MIN_PG_VERSION:
+        raise PartitioningError(
+            'Partitioning needs PostgreSQL 11 or later, the database '
+            f'{using!r} runs {connection.pg_version // 10000}.')
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT relkind = 'p' FROM pg_class "
+        "WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def temporary_name(name, prefix):
+    """Return a name for an index while the tables are swapped"""
+    # the names are limited to 63 characters, Django's unique M2M index
+    # names are close to it already
+    return f'{prefix}_{hashlib.md5(name.encode()).hexdigest()[:20]}'
+
+
+def rewrite_index(definition, table, key):
+    """Return (name, definition) of an index for the partitioned table
+
+    The new index gets a temporary name, a unique index must contain the
+    partition key.
+    """
+    match = INDEX_RE.match(definition)
+    if not match:
+        raise PartitioningError(f'Unexpected index: {definition}')
+    unique, name, _, rest = match.groups()
+    columns = re.match(r'USING \w+ \(([^)]*)\)', rest)
+    columns = [column.strip().strip('"')
+               for column in columns.group(1).split(',')] if columns else []
+    if unique and key not in columns:
+        raise PartitioningError(
+            f'The unique index {name} of {table} lacks {key}.')
+    return name, (f'CREATE {unique or ""}INDEX '
+                  f'{temporary_name(name, "part")} ON {table}_part {rest}')
+
+
+def _indexes(cursor, table):
+    """Return (name, definition) of the indexes of a table but its key"""
+    cursor.execute(
+        'SELECT i.indexname, i.indexdef FROM pg_indexes i '
+        'JOIN pg_class c ON c.relname = i.indexname '
+        'JOIN pg_index x ON x.indexrelid = c.oid '
+        'WHERE i.tablename = %s AND NOT x.indisprimary', [table])
+    return cursor.fetchall()
+
+
+def _foreign_keys(cursor, table):
+    """Return (name, definition, referenced table) of the foreign keys"""
+    cursor.execute(
+        'SELECT conname, pg_get_constraintdef(oid), '
+        'confrelid::regclass::text FROM pg_constraint '
+        "WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+    return cursor.fetchall()
+
+
+def _trigger(table):
+    return f'{table}_partition_log'
+
+
+def _drop_log(cursor):
+    for table, _ in TABLES:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {_trigger(table)} ON {table}')
+    cursor.execute(f'DROP FUNCTION IF EXISTS {LOG_FUNCTION}()')
+    cursor.execute(f'DROP TABLE IF EXISTS {LOG_TABLE}')
+
+
+def _create_log(cursor):
+    """Log the ids of the rows changed from now on"""
+    cursor.execute(
+        f'CREATE TABLE {LOG_TABLE} (table_name text NOT NULL, '
+        'row_id bigint NOT NULL)')
+    cursor.execute(f"""
+        CREATE FUNCTION {LOG_FUNCTION}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                INSERT INTO {LOG_TABLE} VALUES (TG_TABLE_NAME, OLD.id);
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {LOG_TABLE} VALUES (TG_TABLE_NAME, NEW.id);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""")
+    for table, _ in TABLES:
+        cursor.execute(
+            f'CREATE TRIGGER {_trigger(table)} AFTER INSERT OR UPDATE OR '
+            f'DELETE ON {table} FOR EACH ROW EXECUTE PROCEDURE '
+            f'{LOG_FUNCTION}()')
+
+
+def create_tables(using='default', partitions=16):
+    """Create the empty partitioned copies of the tables and the log"""
+    painting_table = TABLES[0][0]
+    with transaction.atomic(using=using), \
+            connections[using].cursor() as cursor:
+        _drop_log(cursor)
+        for table, key in TABLES:
+            if is_partitioned(cursor, table):
+                raise PartitioningError(f'{table} is partitioned already.')
+            cursor.execute(f'DROP TABLE IF EXISTS {table}_part')
+            # the columns, defaults (the id sequence) and checks
+            cursor.execute(
+                f'CREATE TABLE {table}_part (LIKE {table} INCLUDING '
+                f'DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) '
+                f'PARTITION BY HASH ({key})')
+            cursor.execute(
+                f'ALTER TABLE {table}_part ADD CONSTRAINT {table}_part_pkey '
+                f'PRIMARY KEY (id, {key})')
+            for remainder in range(partitions):
+                cursor.execute(
+                    f'CREATE TABLE {table}_p{remainder} PARTITION OF '
+                    f'{table}_part FOR VALUES WITH '
+                    f'(MODULUS {partitions}, REMAINDER {remainder})')
+            for _, definition in _indexes(cursor, table):
+                cursor.execute(rewrite_index(definition, table, key)[1])
+            for name, definition, referenced in _foreign_keys(cursor, table):
+                if referenced == painting_table:
+                    continue
+                # checked at each copied row instead of a scan under lock
+                cursor.execute(f'ALTER TABLE {table}_part ADD CONSTRAINT '
+                               f'{name} {definition}')
+
+        # any other table pointing at the paintings would be left with a
+        # foreign key to the old table
+        cursor.execute(
+            'SELECT conrelid::regclass::text FROM pg_constraint '
+            "WHERE confrelid = %s::regclass AND contype = 'f'",
+            [painting_table])
+        others = {name for name, in cursor.fetchall()} - \
+            {table for table, _ in TABLES}
+        if others:
+            raise PartitioningError(
+                f'Foreign keys to {painting_table} from '
+                f'{", ".join(sorted(others))}.')
+        # committed with the tables: what the copy doesn't see is logged
+        _create_log(cursor)
+
+
+def copy_rows(table, using='default', batch_size=50000, log=None):
+    """Copy the rows of a table to its partitioned copy, by id ranges
+
+    Return the highest id copied.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+        last_id, = cursor.fetchone()
+        start = 0
+        while start < last_id:
+            # one short transaction per batch, autocommit
+            cursor.execute(
+                f'INSERT INTO {table}_part SELECT * FROM {table} '
+                'WHERE id > %s AND id <= %s', [start, start + batch_size])
+            start += batch_size
+            if log:
+                log(f'{table}: {min(start, last_id)}/{last_id}')
+    return last_id
+
+
+def catch_up(cursor):
+    """Copy again the logged rows, return how many there were
+
+    Only the log rows committed are consumed, the others are left for the
+    next pass.
+    """
+    cursor.execute(
+        'CREATE TEMP TABLE partition_changed ON COMMIT DROP AS '
+        f'WITH logged AS (DELETE FROM {LOG_TABLE} RETURNING *) '
+        'SELECT DISTINCT table_name, row_id FROM logged')
+    # no autovacuum for temporary tables, the planner needs the row count
+    cursor.execute('ANALYZE partition_changed')
+    for table, _ in TABLES:
+        changed = ('id IN (SELECT row_id FROM partition_changed '
+                   'WHERE table_name = %s)')
+        # the row as it is now, if it still exists
+        cursor.execute(f'DELETE FROM {table}_part WHERE {changed}', [table])
+        cursor.execute(f'INSERT INTO {table}_part SELECT * FROM {table} '
+                       f'WHERE {changed}', [table])
+    cursor.execute('SELECT count(*) FROM partition_changed')
+    return cursor.fetchone()[0]
+
+
+def swap_tables(using='default', log=None):
+    """Catch up with the writes since the copy started, swap the tables
+
+    The originals are kept as <table>_old.
+    """
+    for _ in range(MAX_CATCH_UP_PASSES):
+        # one short transaction per pass, the writes go on
+        with transaction.atomic(using=using), \
+                connections[using].cursor() as cursor:
+            changed = catch_up(cursor)
+        if log:
+            log(f'Caught up with {changed} changed rows')
+        if changed <= FINAL_DELTA:
+            break
+
+    with transaction.atomic(using=using), \
+            connections[using].cursor() as cursor:
+        tables = ', '.join(table for table, _ in TABLES)
+        # reads go on, writes wait until the commit
+        cursor.execute(f'LOCK TABLE {tables} IN EXCLUSIVE MODE')
+        catch_up(cursor)
+        _drop_log(cursor)
+
+        for table, _ in TABLES:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')",
+                           [table])
+            sequence, = cursor.fetchone()
+            names = [name for name, _ in _indexes(cursor, table)]
+            for name in names:
+                cursor.execute(f'ALTER INDEX {name} '
+                               f'RENAME TO {temporary_name(name, "old")}')
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+            cursor.execute(f'ALTER INDEX {table}_pkey '
+                           f'RENAME TO {table}_old_pkey')
+            cursor.execute(f'ALTER TABLE {table}_part RENAME TO {table}')
+            cursor.execute(f'ALTER INDEX {table}_part_pkey '
+                           f'RENAME TO {table}_pkey')
+            for name in names:
+                cursor.execute(f'ALTER INDEX {temporary_name(name, "part")} '
+                               f'RENAME TO {name}')
+            # dropping the old table must not drop the id sequence
+            if sequence:
+                cursor.execute(
+                    f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+
+
+def drop_old_tables(using='default'):
+    """Drop the unpartitioned tables kept by swap_tables"""
+    with connections[using].cursor() as cursor:
+        # the M2M tables first, they point at the old paintings table
+        for table, _ in reversed(TABLES):
+            cursor.execute(f'DROP TABLE IF EXISTS {table}_old')
+
+
+def abort(using='default'):
+    """Drop the log and the partitioned copies of an unfinished run"""
+    with transaction.atomic(using=using), \
+            connections[using].cursor() as cursor:
+        _drop_log(cursor)
+        for table, _ in TABLES:
+            if not is_partitioned(cursor, table):
+                cursor.execute(f'DROP TABLE IF EXISTS {table}_part')
+
+
+def partition(using='default', partitions=16, batch_size=50000, log=None):
+    """Partition the painting tables, return the seconds it took"""
+    check_vendor(using)
+    start = time.monotonic()
+    create_tables(using, partitions)
+    try:
+        for table, _ in TABLES:
+            copy_rows(table, using, batch_size, log)
+        swap_tables(using, log)
+    except BaseException:
+        # the trigger would go on logging every write
+        abort(using)
+        raise
+    return time.monotonic() - start
@@ -0,0 +1,359 @@
+"""Resized copies of the uploaded images, cached on disk
+
+A rendition is rendered once and kept in the IMAGE_CACHE_PREFIX directory
+of the media root, under a name derived from the source file and the
+requested size, fit and format. The least recently used renditions are
+deleted once the directory grows over IMAGE_CACHE_MAX_BYTES.
+
+The uploads themselves get variants in the formats of
+IMAGE_NEGOTIATED_FORMATS, written next to the original (a.jpg.webp) the
+first time a client accepting them asks for the image.
+"""
+import contextlib
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not POSIX, only the threads of a process are locked
+    fcntl = None
+
+from django.conf import settings
+
+
+FITS = ('contain', 'cover')
+# Pillow format name and file extension of the output formats
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+    'avif': ('AVIF', 'avif'),
+}
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 4},
+    'AVIF': {'quality': 60},
+}
+# the modes Pillow resizes, the others are converted first
+RESAMPLED_MODES = ('L', 'LA', 'RGB', 'RGBA')
+# the uploads that get variants in the negotiated formats
+VARIANT_SOURCES = ('.jpg', '.jpeg', '.png')
+
+# unknown to the mimetypes module of older Pythons
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/avif', '.avif')
+
+
+class RenditionError(ValueError):
+    """The requested rendition is not allowed, or the image is unreadable"""
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, settings.IMAGE_CACHE_PREFIX)
+
+
+def validate(width, height, fit, image_format):
+    """Check the options of a rendition against the allowed ones"""
+    # a whitelist: every size asked would otherwise be rendered and cached
+    sizes = settings.IMAGE_RENDITION_SIZES
+    for name, value in (('w', width), ('h', height)):
+        if value is not None and value not in sizes:
+            raise RenditionError(
+                f'{name} must be one of {", ".join(map(str, sizes))}.')
+    if width is None and height is None:
+        raise RenditionError('w or h is required.')
+    if fit not in FITS:
+        raise RenditionError(f'fit must be one of {", ".join(FITS)}.')
+    if image_format is not None and not saveable(image_format):
+        raise RenditionError(
+            f'format must be one of {", ".join(filter(saveable, FORMATS))}.')
+
+
+def saveable(image_format):
+    """Return whether Pillow can write a format, AVIF needs a plugin"""
+    from PIL import Image
+
+    if image_format not in FORMATS:
+        return False
+    Image.init()  # registers the plugins, a no-op once done
+    return FORMATS[image_format][0] in Image.SAVE
+
+
+def accepted_format(accept):
+    """Return the best negotiated format of an Accept header, or None
+
+    The formats must be named, image/* is sent by every browser. The order
+    of IMAGE_NEGOTIATED_FORMATS wins over the q values of the client.
+    """
+    accepted = {}
+    for item in accept.split(','):
+        media_type, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        accepted[media_type.strip().lower()] = quality
+    for image_format in settings.IMAGE_NEGOTIATED_FORMATS:
+        if accepted.get(f'image/{image_format}', 0) > 0 and \
+                saveable(image_format):
+            return image_format
+    return None
+
+
+def cache_name(source, width, height, fit, image_format):
+    """Return the name of a rendition inside of the media root"""
+    stat = os.stat(source)
+    # the uploads never change, size and mtime catch a replaced file anyway
+    key = hashlib.sha256(
+        f'{source}|{stat.st_size}|{stat.st_mtime_ns}|'
+        f'{width}|{height}|{fit}|{image_format}'.encode()
+    ).hexdigest()
+    extension = FORMATS[image_format][1] if image_format else \
+        os.path.splitext(source)[1].lstrip('.').lower()
+    return os.path.join(settings.IMAGE_CACHE_PREFIX, key[:2],
+                        f'{key}.{extension}')
+
+
+def _target_size(size, width, height, fit):
+    """Return the size of the rendition of an image of a given size"""
+    source_width, source_height = size
+    if width is None and height is None:
+        return size
+    if width is None:
+        width = max(1, round(source_width * height / source_height))
+    elif height is None:
+        height = max(1, round(source_height * width / source_width))
+    elif fit == 'contain':
+        scale = min(width / source_width, height / source_height)
+        width = max(1, round(source_width * scale))
+        height = max(1, round(source_height * scale))
+    return width, height
+
+
+def render(source, destination, width, height, fit, image_format):
+    """Write the resized copy of an image"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(source) as image:
+            pil_format = FORMATS[image_format][0] if image_format \
+                else image.format
+            size = image.size
+            # the orientations 5 to 8 turn the image by 90 degrees
+            rotated = image.getexif().get(0x0112) in (5, 6, 7, 8)
+            if rotated:
+                size = size[::-1]
+            target = _target_size(size, width, height, fit)
+            # JPEG: decode at 1/2, 1/4 or 1/8 of the size straight away,
+            # still at least as big as the rendition
+            image.draft('RGB', target[::-1] if rotated else target)
+            # a copy, decoded before the file is closed
+            image = ImageOps.exif_transpose(image)
+    except FileNotFoundError:
+        raise
+    except (OSError, SyntaxError, Image.DecompressionBombError) as error:
+        # not an image, a truncated one or too many pixels to decode
+        raise RenditionError('The image file can\'t be decoded.') from error
+
+    if image.mode not in RESAMPLED_MODES:
+        # palette, bilevel or 16 bit images can't be resampled
+        transparent = 'A' in image.getbands() or \
+            'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+    try:
+        # shrink by an integer factor, a cheap box filter, keeping twice
+        # the target size for the quality of the final resampling
+        factor = min(image.width // target[0],
+                     image.height // target[1]) // 2
+        if factor >= 2:
+            image = image.reduce(factor)
+        if fit == 'cover' and width and height:
+            image = ImageOps.fit(image, target, Image.LANCZOS)
+        elif image.size != target:
+            image = image.resize(target, Image.LANCZOS)
+    except ValueError as error:  # a mode Pillow can't resize
+        raise RenditionError('The image can\'t be resized.') from error
+
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    # written aside then renamed, a reader never sees half a file
+    temporary = f'{destination}.{os.getpid()}.tmp'
+    try:
+        image.save(temporary, pil_format, **SAVE_OPTIONS.get(pil_format, {}))
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, destination)
+
+
+_locks = {}  # key: [lock, number of threads using it]
+_locks_lock = threading.Lock()
+
+
+def _lock_file(path):
+    """Open and lock the file at path, return it once locked"""
+    while True:
+        lock = open(path, 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(lock.fileno()), os.stat(path)):
+                return lock
+        except FileNotFoundError:
+            pass
+        # removed by its holder while this process waited, a third one
+        # may hold a new file at the same path already
+        lock.close()
+
+
+@contextlib.contextmanager
+def single_flight(key):
+    """Let one thread of one process at a time work on a key"""
+    with _locks_lock:
+        entry = _locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if fcntl is None:
+                yield
+                return
+            # the other worker processes wait on the lock file
+            lock_dir = os.path.join(cache_dir(), 'locks')
+            os.makedirs(lock_dir, exist_ok=True)
+            path = os.path.join(lock_dir, f'{key}.lock')
+            lock = _lock_file(path)
+            try:
+                yield
+            finally:
+                # removed while still locked, the waiters open a new one
+                os.remove(path)
+                lock.close()
+    finally:
+        with _locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[key]
+
+
+# bytes in the cache directory as known by this process, None until the
+# directory is first scanned
+_cache_bytes = None
+_cache_bytes_lock = threading.Lock()
+
+
+def _cache_files():
+    """Return (last access, size, path) of every cached rendition"""
+    files = []
+    for root, dirs, names in os.walk(cache_dir()):
+        dirs[:] = [name for name in dirs if name != 'locks']
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # evicted by another process
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+    return files
+
+
+def evict(max_bytes=None):
+    """Delete the least recently used renditions over the size limit"""
+    global _cache_bytes
+    max_bytes = settings.IMAGE_CACHE_MAX_BYTES if max_bytes is None \
+        else max_bytes
+    files = _cache_files()
+    total = sum(size for _, size, _ in files)
+    if total > max_bytes:
+        # down to 90%, thus the next renditions don't evict one by one
+        for _, size, path in sorted(files):
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+    with _cache_bytes_lock:
+        _cache_bytes = total
+    return total
+
+
+def _added(size):
+    """Count a new rendition, evict when over the limit"""
+    global _cache_bytes
+    with _cache_bytes_lock:
+        known = _cache_bytes
+        if known is not None:
+            _cache_bytes = known + size
+    # the other processes add renditions too, the scan of evict() counts
+    # them, this process' count only decides when to scan
+    if known is None or known + size > settings.IMAGE_CACHE_MAX_BYTES:
+        evict()
+
+
+def _render_once(path, key, render_args):
+    """Render a missing file, once whatever the concurrent requests"""
+    if os.path.exists(path):
+        return False
+    with single_flight(key):
+        # a burst of the same request: the first renders, the others
+        # find the file once the lock is theirs
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        render(*render_args)
+        return True
+
+
+def variant_names(name):
+    """Return the names the variants of a media file would have"""
+    return [f'{name}.{FORMATS[image_format][1]}'
+            for image_format in settings.IMAGE_NEGOTIATED_FORMATS]
+
+
+def variant(name, image_format):
+    """Return (path, name) of an upload in another format
+
+    None if the format is not smaller than the original, or the original
+    is not an image.
+    """
+    source = os.path.join(settings.MEDIA_ROOT, name)
+    variant_name = f'{name}.{FORMATS[image_format][1]}'
+    path = os.path.join(settings.MEDIA_ROOT, variant_name)
+    key = hashlib.sha256(variant_name.encode()).hexdigest()
+    try:
+        _render_once(path, key,
+                     (source, path, None, None, 'contain', image_format))
+        smaller = os.path.getsize(path) < os.path.getsize(source)
+    except (OSError, ValueError):  # not an image, or an unknown one
+        return None
+    # a bigger variant is kept anyway, it isn't rendered again
+    return (path, variant_name) if smaller else None
+
+
+def get(source, width, height, fit='contain', image_format=None):
+    """Return (path, name) of a rendition, rendering it if needed"""
+    validate(width, height, fit, image_format)
+    name = cache_name(source, width, height, fit, image_format)
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    key = os.path.splitext(os.path.basename(name))[0]
+    if _render_once(path, key,
+                    (source, path, width, height, fit, image_format)):
+        _added(os.path.getsize(path))
+        return path, name
+    # the access time orders the eviction, mtime stays for the ETag
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+    return path, name
@@ -0,0 +1,212 @@
+"""Placement of the data of the users on several databases
+
+DATABASE_SHARDS lists the databases holding the categories, supplies,
+paintings, counters and tombstones of the users, core.db.routers sends
+the queries of a request to the one of its user. ShardAssignment rows, on
+the default database with the users, say which one it is; a user without
+a row is on the default database, where everybody was before sharding.
+
+The directory is cached by every process for SHARD_DIRECTORY_TTL seconds,
+move_user() relies on it: the user is made read only, then moved once
+every process saw it, and the rows are only deleted from the old database
+once every process reads from the new one.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.db.routers import get_shards
+from core.models import Category, Supply, Painting, UserPaintingStats, \
+                        MonthlyPaintingCount, SyncTombstone, ShardAssignment
+
+
+# copied in this order, the links after the rows they point at
+MOVED_MODELS = (
+    Category, Supply, Painting,
+    Painting.categories.through, Painting.supplies.through,
+    UserPaintingStats, MonthlyPaintingCount, SyncTombstone,
+)
+# deleted in this order, the tombstones written by deleting the categories
+# and supplies go last
+DELETED_MODELS = (
+    Painting.categories.through, Painting.supplies.through, Painting,
+    Category, Supply, UserPaintingStats, MonthlyPaintingCount, SyncTombstone,
+)
+# each shard numbers its rows from its index times this, the ids of the
+# moved rows are kept and never collide with the new rows of the target
+ID_RANGE = 10 ** 12
+DIRECTORY_SIZE = 10000  # users whose shard is cached by a process
+
+_directory = collections.OrderedDict()  # user id: (expiry, database, ro)
+_directory_lock = threading.Lock()
+
+
+class ShardError(Exception):
+    """A user can't be moved"""
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your paintings are being moved, try again shortly.'
+    default_code = 'shard_moving'
+
+
+def assignment(user_id):
+    """Return (database, read only) of the data of a user"""
+    if not get_shards():
+        return DEFAULT_DB_ALIAS, False
+    now = time.monotonic()
+    with _directory_lock:
+        cached = _directory.get(user_id)
+        if cached is not None and cached[0] > now:
+            _directory.move_to_end(user_id)
+            return cached[1:]
+    # outside of the lock, a concurrent lookup of the same user just
+    # writes the same entry
+    found = ShardAssignment.objects.using(DEFAULT_DB_ALIAS) \
+        .filter(user_id=user_id).values_list('database', 'read_only').first()
+    database, read_only = found or (DEFAULT_DB_ALIAS, False)
+    with _directory_lock:
+        _directory[user_id] = (now + settings.SHARD_DIRECTORY_TTL,
+                               database, read_only)
+        _directory.move_to_end(user_id)
+        while len(_directory) > DIRECTORY_SIZE:
+            _directory.popitem(last=False)
+    return database, read_only
+
+
+def database_for(user_id):
+    """Return the database holding the data of a user"""
+    return assignment(user_id)[0]
+
+
+def databases():
+    """Return every database holding the data of users"""
+    # the users without a shard are on the default database
+    return [DEFAULT_DB_ALIAS] + [database for database in get_shards()
+                                 if database != DEFAULT_DB_ALIAS]
+
+
+def forget(user_id=None):
+    """Drop a user, or everybody, from the directory of this process"""
+    with _directory_lock:
+        if user_id is None:
+            _directory.clear()
+        else:
+            _directory.pop(user_id, None)
+
+
+def place(user, using=DEFAULT_DB_ALIAS):
+    """Pick the database of a new user, return it"""
+    shards = get_shards()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    database = shards[user.pk % len(shards)]
+    ShardAssignment.objects.using(using).create(user=user, database=database)
+    forget(user.pk)
+    return database
+
+
+def reserve_id_range(using):
+    """Start the ids of the tables of a shard in its own range"""
+    shards = get_shards()
+    if using not in shards or connections[using].vendor != 'postgresql':
+        return  # SQLite: a single database in tests and development
+    start = shards.index(using) * ID_RANGE
+    if not start:
+        return
+    with connections[using].cursor() as cursor:
+        for model in MOVED_MODELS:
+            if model._meta.pk.column != 'id':
+                continue
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')",
+                           [model._meta.db_table])
+            sequence, = cursor.fetchone()
+            cursor.execute(f'SELECT last_value FROM {sequence}')
+            if cursor.fetchone()[0] < start:
+                cursor.execute('SELECT setval(%s, %s, false)',
+                               [sequence, start])
+
+
+def _user_rows(model, user_id, using):
+    rows = model.objects.using(using)
+    if model._meta.auto_created:  # the M2M tables have no user_id
+        return rows.filter(painting__user_id=user_id)
+    return rows.filter(user_id=user_id)
+
+
+def copy_rows(model, user_id, source, target, batch_size=1000):
+    """Copy the rows of a user with their ids, return how many"""
+    rows = _user_rows(model, user_id, source).order_by('pk')
+    copied = 0
+    last = None
+    while True:
+        batch = list((rows if last is None else rows.filter(pk__gt=last))
+                     [:batch_size])
+        if not batch:
+            return copied
+        # no signal: the counters are copied as they are
+        with transaction.atomic(using=target):
+            model.objects.using(target).bulk_create(batch)
+        last = batch[-1].pk
+        copied += len(batch)
+
+
+def delete_rows(model, user_id, using, batch_size=1000):
+    """Delete the rows of a user from a database, batch by batch"""
+    rows = _user_rows(model, user_id, using)
+    while True:
+        ids = list(rows.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        with transaction.atomic(using=using):
+            if model is Painting:
+                # not counted anymore, see core.signals, the counters go
+                # with the user's other rows
+                Painting.objects.using(using) \
+                    .filter(pk__in=ids, deleted_at__isnull=True) \
+                    .update(deleted_at=timezone.now())
+            model.objects.using(using).filter(pk__in=ids).delete()
+
+
+def move_user(user_id, target, batch_size=1000, wait=None, log=None):
+    """Move the data of a user to another database"""
+    if target not in get_shards():
+        raise ShardError(f'{target!r} is not in DATABASE_SHARDS.')
+    wait = settings.SHARD_DIRECTORY_TTL if wait is None else wait
+    shard, _ = ShardAssignment.objects.using(DEFAULT_DB_ALIAS) \
+        .get_or_create(user_id=user_id,
+                       defaults={'database': DEFAULT_DB_ALIAS})
+    source = shard.database
+    if source == target:
+        raise ShardError(f'The user is on {target!r} already.')
+
+    # the API answers 503 to the writes of the user from now on
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS) \
+        .filter(user_id=user_id).update(read_only=True)
+    forget(user_id)
+    time.sleep(wait)
+
+    # the leftovers of an interrupted move, nothing reads them
+    for model in DELETED_MODELS:
+        delete_rows(model, user_id, target, batch_size)
+    for model in MOVED_MODELS:
+        copied = copy_rows(model, user_id, source, target, batch_size)
+        if log:
+            log(f'{model._meta.db_table}: {copied} rows copied')
+
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS) \
+        .filter(user_id=user_id).update(database=target, read_only=False)
+    forget(user_id)
+    # the processes still reading from the source until their entry expires
+    time.sleep(wait)
+    for model in DELETED_MODELS:
+        delete_rows(model, user_id, source, batch_size)
+    if log:
+        log(f'Rows deleted from {source}')
@@ -0,0 +1,191 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, \
+                                     post_delete, m2m_changed, post_migrate
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core import caching, sharding, stats
+from core.models import Category, Supply, Painting, SyncTombstone, User
+
+
+# the M2M tables whose rows are counted, with the model on the other side
+# and the name of its column in the through table
+COUNTED_LINKS = {
+    Painting.categories.through: (Category, 'category_id'),
+    Painting.supplies.through: (Supply, 'supply_id'),
+}
+
+
+@receiver(pre_save, sender=Painting)
+def remember_painting_date(sender, instance, raw, using, update_fields,
+                           **kwargs):
+    """Keep the stored date and image hash of a painting being updated"""
+    if raw or instance._state.adding:
+        return
+    fields = {'painting_create_date', 'image_phash'}
+    if update_fields is not None:
+        fields &= set(update_fields)
+    if not fields:
+        return
+    stored = sender.objects.using(using).filter(pk=instance.pk) \
+        .values(*fields).first() or {}
+    instance._stats_old_date = stored.get('painting_create_date')
+    instance._stats_old_phash = stored.get('image_phash')
+
+
+@receiver(post_save, sender=Painting)
+def count_saved_painting(sender, instance, created, raw, using, **kwargs):
+    """Update the user and monthly counters after a painting is saved"""
+    if raw:
+        return
+    if created:
+        stats.painting_added(instance, using)
+        if instance.image_phash:
+            stats.image_hashes_changed(instance.user_id, using)
+        return
+    old_date = instance.__dict__.pop('_stats_old_date', None)
+    if old_date is not None:
+        stats.painting_moved(instance, old_date, using)
+    old_phash = instance.__dict__.pop('_stats_old_phash', None)
+    if old_phash is not None and old_phash != instance.image_phash:
+        stats.image_hashes_changed(instance.user_id, using)
+
+
+@receiver(pre_delete, sender=Painting)
+def count_deleted_painting(sender, instance, using, **kwargs):
+    """Update all the counters of a painting that is about to be deleted"""
+    if instance.deleted_at is None:  # else uncounted by the soft delete
+        stats.painting_removed(instance, using)
+
+
+def _linked(sender, instance, reverse, pk_set, using):
+    """Return the (painting_id, attr_id) links a removal will delete"""
+    attr_column = COUNTED_LINKS[sender][1]
+    links = sender.objects.using(using)
+    if reverse:  # category.painting_set.remove(...)
+        links = links.filter(**{attr_column: instance.pk},
+                             painting__deleted_at__isnull=True)
+        if pk_set is not None:
+            links = links.filter(painting_id__in=pk_set)
+    else:  # painting.categories.remove(...)
+        links = links.filter(painting_id=instance.pk)
+        if pk_set is not None:
+            links = links.filter(**{f'{attr_column}__in': pk_set})
+    return list(links.values_list('painting_id', attr_column))
+
+
+@receiver(m2m_changed, sender=Painting.categories.through)
+@receiver(m2m_changed, sender=Painting.supplies.through)
+def count_painting_links(sender, instance, action, reverse, pk_set, using,
+                         **kwargs):
+    """Keep the painting counts of categories and supplies up to date"""
+    model = COUNTED_LINKS[sender][0]
+    if not reverse and instance.deleted_at is not None:
+        return  # the links of soft deleted paintings are not counted
+    if action in ('pre_remove', 'pre_clear'):
+        # the ids passed to remove() may not all be linked, and clear()
+        # passes no ids at all, thus look at what is actually there
+        instance._stats_removed_links = _linked(
+            sender, instance, reverse, pk_set, using
+        )
+    elif action in ('post_remove', 'post_clear'):
+        links = instance.__dict__.pop('_stats_removed_links', [])
+        if reverse:
+            counts = {instance.pk: -len(links)}
+        else:
+            counts = {attr_id: -1 for _, attr_id in links}
+        stats.bump_attrs(model, counts, using)
+        _touch_paintings(instance, reverse,
+                         {painting_id for painting_id, _ in links}, using)
+    elif action == 'post_add':
+        # Django only passes the ids that were not linked yet
+        if reverse:
+            added = Painting.objects.using(using).filter(
+                pk__in=pk_set, deleted_at__isnull=True).count()
+            counts = {instance.pk: added}
+        else:
+            counts = {pk: 1 for pk in pk_set}
+        stats.bump_attrs(model, counts, using)
+        _touch_paintings(instance, reverse, pk_set, using)
+
+
+def _touch_paintings(instance, reverse, painting_ids, using):
+    """Set updated_at of paintings whose categories or supplies changed"""
+    # the links are part of a painting for the sync endpoint
+    if not reverse:
+        painting_ids = [instance.pk]
+    if painting_ids:
+        Painting.objects.using(using).filter(pk__in=painting_ids) \
+            .update(updated_at=timezone.now())
+
+
+# the deleted paintings are returned by their soft deleted row, until the
+# purge writes their tombstones in bulk
+@receiver(post_delete, sender=Category, dispatch_uid='category_tombstone')
+@receiver(post_delete, sender=Supply, dispatch_uid='supply_tombstone')
+@receiver(post_delete, sender=Painting, dispatch_uid='painting_tombstone')
+def write_tombstone(sender, instance, using, **kwargs):
+    """Remember a deleted object for the clients syncing later"""
+    if getattr(instance, 'deleted_at', None) is not None:
+        return
+    SyncTombstone.objects.using(using).create(
+        user_id=instance.user_id,
+        kind=sender._meta.model_name,
+        object_id=instance.pk
+    )
+
+
+@receiver(post_save, sender=User, dispatch_uid='user_shard')
+def place_new_user(sender, instance, created, raw, using, **kwargs):
+    """Pick the database of the paintings of a new user"""
+    if created and not raw:
+        sharding.place(instance, using)
+
+
+@receiver(post_migrate, dispatch_uid='shard_id_range')
+def reserve_shard_ids(sender, using, **kwargs):
+    """Number the rows of each shard in its own range of ids"""
+    if sender.label == 'core':
+        sharding.reserve_id_range(using)
+
+
+# the tokens and users read by core.authentication, and the lists and stats
+# cached by the painting views; the writes done with update() or
+# bulk_create() call caching.user_data_changed() themselves
+@receiver(post_save, sender=User, dispatch_uid='user_cache')
+@receiver(post_delete, sender=User, dispatch_uid='user_cache_delete')
+def forget_user(sender, instance, using, **kwargs):
+    """Drop a changed user from the caches"""
+    keys = [caching.user_key(instance.pk)]
+    if kwargs.get('created'):
+        # a user id of a rolled back transaction may be given again
+        keys += caching.user_data_keys(instance.pk)
+    caching.tiered.invalidate(keys, using)
+
+
+@receiver(post_save, sender=Token, dispatch_uid='token_cache')
+@receiver(post_delete, sender=Token, dispatch_uid='token_cache_delete')
+def forget_token(sender, instance, using, **kwargs):
+    """Drop a token from the caches, an unknown key may be cached too"""
+    caching.tiered.invalidate([caching.token_key(instance.key)], using)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='category_cache')
+@receiver(post_save, sender=Supply, dispatch_uid='supply_cache')
+@receiver(post_save, sender=Painting, dispatch_uid='painting_cache')
+@receiver(post_delete, sender=Category, dispatch_uid='category_cache_delete')
+@receiver(post_delete, sender=Supply, dispatch_uid='supply_cache_delete')
+@receiver(post_delete, sender=Painting, dispatch_uid='painting_cache_delete')
+def forget_user_data(sender, instance, using, **kwargs):
+    """Drop the lists and stats of a user whose data changed"""
+    caching.user_data_changed(instance.user_id, using)
+
+
+@receiver(m2m_changed, sender=Painting.categories.through,
+          dispatch_uid='categories_cache')
+@receiver(m2m_changed, sender=Painting.supplies.through,
+          dispatch_uid='supplies_cache')
+def forget_linked_data(sender, instance, action, using, **kwargs):
+    """Drop the lists and stats of a user whose painting links changed"""
+    if action.startswith('post_'):
+        caching.user_data_changed(instance.user_id, using)
@@ -0,0 +1,93 @@
+"""Coalescing of identical calls running at the same time in a process
+
+The first thread calling with a key runs the function, the threads coming
+with the same key meanwhile wait for it and share its result instead of
+running the same queries again. They wait SINGLE_FLIGHT_TIMEOUT seconds
+at most, then run the function themselves, as they do when it failed.
+
+Only the threads of one process are coalesced (the gthread workers of
+gunicorn_conf.py); renditions.single_flight also locks across processes
+but doesn't share results, the rendition it waited for is on disk.
+"""
+import collections
+import logging
+import threading
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """A running call and what it returned"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+
+class Group:
+    """Calls coalesced by key"""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}  # key: _Call
+        self._lock = threading.Lock()
+        # leaders: calls run, coalesced: results shared, timeouts: waits
+        # given up, failures: calls raising, their waiters run again
+        self.counts = collections.Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def do(self, key, function):
+        """Return function(), shared with the identical concurrent calls"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counts['leaders'] += 1
+        if leader:
+            try:
+                call.result = function()
+                call.ok = True
+                return call.result
+            except BaseException:
+                self._count('failures')
+                raise
+            finally:
+                with self._lock:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.done.set()
+
+        timeout = settings.SINGLE_FLIGHT_TIMEOUT if self.timeout is None \
+            else self.timeout
+        if call.done.wait(timeout) and call.ok:
+            self._count('coalesced')
+            return call.result
+        if call.done.is_set():
+            logger.debug('Coalesced call %r failed, running it again', key)
+        else:
+            self._count('timeouts')
+        return function()
+
+    def forget(self, matches):
+        """Let the next calls of the keys matching run again
+
+        The threads waiting already still get the result of the running
+        call, e.g. a read started before a write.
+        """
+        with self._lock:
+            for key in [key for key in self._calls if matches(key)]:
+                del self._calls[key]
+
+    def coalesced_ratio(self):
+        """Return the share of the calls answered by another one's result"""
+        total = self.counts['leaders'] + self.counts['coalesced'] + \
+            self.counts['timeouts']
+        return self.counts['coalesced'] / total if total else 0
@@ -0,0 +1,170 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+
+from core.models import Category, Supply, Painting, UserPaintingStats, \
+                        MonthlyPaintingCount
+
+
+def month_of(date):
+    """Return the first day of the month of a date"""
+    return date.replace(day=1)
+
+
+def _bump(model, lookup, delta, using):
+    """Add delta to the painting_count of the rows matching the lookup"""
+    # F() makes the database do the addition, thus two requests updating the
+    # same counter at the same time can't overwrite each other
+    return model.objects.using(using).filter(**lookup).update(
+        painting_count=F('painting_count') + delta
+    )
+
+
+def _bump_or_create(model, lookup, delta, using):
+    """Add delta to a per user counter row, creating the row if needed"""
+    if _bump(model, lookup, delta, using) or delta < 0:
+        # we never create rows for a decrement, the row may be about to be
+        # deleted together with its user
+        return
+    try:
+        with transaction.atomic(using=using):  # savepoint for the race below
+            model.objects.using(using).create(painting_count=delta, **lookup)
+    except IntegrityError:
+        # another request created the row in between, just add to it
+        _bump(model, lookup, delta, using)
+
+
+def bump_attrs(model, counts, using='default'):
+    """Apply a {id: delta} mapping to category or supply painting counts"""
+    # one UPDATE per distinct delta, not per row: linking a painting to many
+    # categories costs the same as linking it to one
+    ids_by_delta = {}
+    for pk, delta in counts.items():
+        if delta:
+            ids_by_delta.setdefault(delta, []).append(pk)
+    for delta, ids in ids_by_delta.items():
+        _bump(model, {'pk__in': ids}, delta, using)
+
+
+def painting_added(painting, using='default'):
+    """Count a newly created painting"""
+    _bump_or_create(UserPaintingStats, {'user_id': painting.user_id}, 1,
+                    using)
+    _bump_or_create(
+        MonthlyPaintingCount,
+        {
+            'user_id': painting.user_id,
+            'month': month_of(painting.painting_create_date)
+        },
+        1,
+        using
+    )
+
+
+def image_hashes_changed(user_id, using='default'):
+    """Tell the similar image searches the image hashes of a user changed"""
+    UserPaintingStats.objects.using(using).filter(user_id=user_id).update(
+        image_hashes_version=F('image_hashes_version') + 1
+    )
+
+
+def painting_moved(painting, old_date, using='default'):
+    """Move a painting to another month after painting_create_date changed"""
+    old_month = month_of(old_date)
+    new_month = month_of(painting.painting_create_date)
+    if old_month == new_month:
+        return
+    _bump_or_create(MonthlyPaintingCount,
+                    {'user_id': painting.user_id, 'month': old_month},
+                    -1, using)
+    _bump_or_create(MonthlyPaintingCount,
+                    {'user_id': painting.user_id, 'month': new_month},
+                    1, using)
+
+
+def painting_removed(painting, using='default'):
+    """Uncount a painting together with its category and supply links"""
+    # has to run before the links are deleted, Django removes the rows of
+    # the M2M tables without sending m2m_changed when a painting is deleted
+    categories = Painting.categories.through.objects.using(using).filter(
+        painting_id=painting.pk
+    ).values_list('category_id', flat=True)
+    supplies = Painting.supplies.through.objects.using(using).filter(
+        painting_id=painting.pk
+    ).values_list('supply_id', flat=True)
+    bump_attrs(Category, {pk: -1 for pk in categories}, using)
+    bump_attrs(Supply, {pk: -1 for pk in supplies}, using)
+    _bump_or_create(UserPaintingStats, {'user_id': painting.user_id}, -1,
+                    using)
+    _bump_or_create(
+        MonthlyPaintingCount,
+        {
+            'user_id': painting.user_id,
+            'month': month_of(painting.painting_create_date)
+        },
+        -1,
+        using
+    )
+
+
+def _reconcile_attrs(model, link_field, user_id, using):
+    """Recompute the painting counts of a user's categories or supplies"""
+    through = getattr(Painting, link_field).through
+    attr_id = f'{model._meta.model_name}_id'
+    actual = dict(
+        through.objects.using(using)
+        .filter(painting__user_id=user_id,
+                painting__deleted_at__isnull=True)
+        .values_list(attr_id)
+        .annotate(n=Count('id'))
+    )
+    stale = []
+    for obj in model.objects.using(using).filter(user_id=user_id):
+        count = actual.get(obj.pk, 0)
+        if obj.painting_count != count:
+            obj.painting_count = count
+            stale.append(obj)
+    model.objects.using(using).bulk_update(stale, ['painting_count'])
+    return len(stale)
+
+
+def reconcile_user(user_id, using='default'):
+    """Recompute every counter of a user, return the number of fixed rows"""
+    fixed = 0
+    with transaction.atomic(using=using):
+        fixed += _reconcile_attrs(Category, 'categories', user_id, using)
+        fixed += _reconcile_attrs(Supply, 'supplies', user_id, using)
+
+        paintings = Painting.objects.using(using).filter(
+            user_id=user_id, deleted_at__isnull=True)
+        total = paintings.count()
+        stats, created = UserPaintingStats.objects.using(using) \
+            .get_or_create(user_id=user_id, defaults={'painting_count': total})
+        if not created and stats.painting_count != total:
+            stats.painting_count = total
+            stats.save(using=using)
+            fixed += 1
+        fixed += created
+
+        actual = dict(
+            paintings.annotate(month=TruncMonth('painting_create_date'))
+            .values_list('month')
+            .annotate(n=Count('id'))
+        )
+        months = MonthlyPaintingCount.objects.using(using) \
+            .filter(user_id=user_id)
+        for row in months:
+            count = actual.pop(row.month, 0)
+            if row.painting_count != count:
+                row.painting_count = count
+                row.save(using=using)
+                fixed += 1
+        # whatever is left are months without a counter row yet
+        MonthlyPaintingCount.objects.using(using).bulk_create([
+            MonthlyPaintingCount(user_id=user_id, month=month,
+                                 painting_count=count)
+            for month, count in actual.items()
+        ])
+        fixed += len(actual)
+
+    return fixed
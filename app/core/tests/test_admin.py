@@ -1,7 +1,15 @@
+import datetime
+from unittest.mock import MagicMock, patch
+
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator
+from core.models import Category, Painting
+
 
 class AdminSiteTests(TestCase):  # inherited from test cases
     # we need a set up function here, that will run before every test case
@@ -51,3 +59,79 @@ class AdminSiteTests(TestCase):  # inherited from test cases
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_painting_changelist(self):
+        """Test the queries don't grow with the number of paintings"""
+        url = reverse('admin:core_painting_changelist')
+        queries = []
+        for number in range(6):
+            Painting.objects.create(
+                user=self.user, title=f'Painting {number}',
+                painting_create_date=datetime.date(2020, 1, 1)
+            )
+            if number in (0, 5):
+                with CaptureQueriesContext(connection) as context:
+                    res = self.client.get(url)
+                queries.append(len(context))
+
+        self.assertContains(res, 'Painting 5')
+        self.assertContains(res, self.user.email)
+        self.assertEqual(queries[0], queries[1])
+
+    def test_painting_change_page_without_select_widgets(self):
+        """Test categories and supplies are entered by id"""
+        Category.objects.create(user=self.user, name='Not listed category')
+        painting = Painting.objects.create(
+            user=self.user, title='Painting',
+            painting_create_date=datetime.date(2020, 1, 1)
+        )
+        url = reverse('admin:core_painting_change', args=[painting.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotContains(res, 'Not listed category')
+
+    def test_search_uses_exact_lookups(self):
+        """Test the search matches an email or an id exactly"""
+        url = reverse('admin:core_user_changelist')
+
+        res = self.client.get(url, {'q': self.user.email})
+        self.assertContains(res, self.user.name)
+
+        res = self.client.get(url, {'q': 'test@'})
+        self.assertNotContains(res, self.user.name)
+
+        res = self.client.get(url, {'q': str(self.user.id)})
+        self.assertContains(res, self.user.name)
+
+        # a digit but no number, not an id
+        res = self.client.get(url, {'q': '\u00b2'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_estimated_count_of_big_tables(self):
+        """Test the planner estimate replaces COUNT(*) on big tables"""
+        queryset = Painting.objects.order_by('id')
+        with patch.object(EstimatedCountPaginator, '_estimate',
+                          return_value=5000000):
+            self.assertEqual(EstimatedCountPaginator(queryset, 50).count,
+                             5000000)
+        with patch.object(EstimatedCountPaginator, '_estimate',
+                          return_value=10):
+            self.assertEqual(EstimatedCountPaginator(queryset, 50).count, 0)
+        # no estimate outside of PostgreSQL
+        self.assertIsNone(EstimatedCountPaginator(queryset, 50)._estimate())
+
+    def test_estimate_of_partitioned_tables(self):
+        """Test the estimate adds up the partitions of a partitioned table"""
+        queryset = Painting.objects.order_by('id')
+        postgresql = MagicMock(vendor='postgresql')
+        cursor = postgresql.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (4000000,)
+        with patch('core.admin.connections', {'default': postgresql}):
+            estimate = EstimatedCountPaginator(queryset, 50)._estimate()
+
+        self.assertEqual(estimate, 4000000)
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn('pg_inherits', sql)
+        self.assertEqual(params, ['p', Painting._meta.db_table])
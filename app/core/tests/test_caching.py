@@ -0,0 +1,189 @@
+import shutil
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core import caching
+
+
+SHARED_DIR = tempfile.mkdtemp()
+# a file based cache stands in for memcached, shared by the processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SHARED_DIR,
+    },
+    # the local memory of two worker processes
+    'first': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'first',
+    },
+    'second': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'second',
+    },
+}
+
+
+@override_settings(CACHES=CACHES)
+class TieredCacheTests(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.addCleanup(shutil.rmtree, SHARED_DIR, True)
+        # two worker processes sharing the Django cache
+        self.first = caching.TieredCache('shared', max_items=100,
+                                         local_ttl=5, timeout=60)
+        self.second = caching.TieredCache('shared', max_items=100,
+                                          local_ttl=5, timeout=60)
+
+    def test_local_hits(self):
+        """Test the hot keys are answered by the memory of the process"""
+        loads = []
+        for _ in range(100):
+            self.first.get_or_set('hot', lambda: loads.append(1) or 'value')
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(self.first.counts['local_hits'], 99)
+        self.assertEqual(self.first.counts['misses'], 1)
+        self.assertGreaterEqual(self.first.hit_ratios()['local'], 0.99)
+
+    def test_shared_between_processes(self):
+        """Test a value loaded by one process is found by the others"""
+        self.first.get_or_set('key', lambda: 'first')
+
+        value = self.second.get_or_set('key', lambda: 'second')
+        self.second.get('key')
+
+        self.assertEqual(value, 'first')
+        self.assertEqual(self.second.counts['shared_hits'], 1)
+        self.assertEqual(self.second.counts['local_hits'], 1)
+        self.assertEqual(self.second.hit_ratios()['overall'], 1)
+
+    def test_values_are_copies(self):
+        """Test changing a returned value doesn't change the cached one"""
+        self.first.set('list', [1, 2])
+        self.first.get('list').append(3)
+
+        self.assertEqual(self.first.get('list'), [1, 2])
+
+    def test_lru_bound(self):
+        """Test the least recently used keys leave the memory first"""
+        small = caching.TieredCache('shared', max_items=2, local_ttl=5,
+                                    timeout=60)
+        small.set('a', 1)
+        small.set('b', 2)
+        small.get('a')
+        small.set('c', 3)
+
+        self.assertEqual(list(small._local), ['a', 'c'])
+
+    def test_invalidation_reaches_other_process(self):
+        """Test a notified process stops serving the old value at once"""
+        self.first.set('user', 'old')
+        self.assertEqual(self.second.get('user'), 'old')
+
+        self.first.invalidate(['user'])
+        self.first.set('user', 'new')
+        # what the listener of the second process does with the NOTIFY
+        self.second.discard(['user'])
+
+        self.assertEqual(self.second.get('user'), 'new')
+
+    @patch('core.caching.time.monotonic')
+    def test_staleness_bound(self, monotonic):
+        """Test a missed notification is stale for local_ttl at most"""
+        monotonic.return_value = 1000
+        self.first.set('user', 'old')
+        self.second.get('user')
+        self.first.invalidate(['user'])
+        self.first.set('user', 'new')
+
+        stale = []
+        for elapsed in range(0, 11):
+            monotonic.return_value = 1000 + elapsed
+            if self.second.get('user') == 'old':
+                stale.append(elapsed)
+
+        self.assertEqual(stale, [0, 1, 2, 3, 4])
+
+    @patch('core.caching.time.monotonic')
+    def test_staleness_bound_process_local(self, monotonic):
+        """Test the bound holds when the Django cache is per process"""
+        # without a shared cache, e.g. the default LocMemCache
+        first = caching.TieredCache('first', max_items=100, local_ttl=5,
+                                    timeout=300)
+        second = caching.TieredCache('second', max_items=100, local_ttl=5,
+                                     timeout=300)
+        row = ['old']
+        monotonic.return_value = 1000
+        first.get_or_set('user', lambda: row[0])
+        second.get_or_set('user', lambda: row[0])
+        row[0] = 'new'
+        first.invalidate(['user'])
+
+        stale = []
+        for elapsed in range(0, 11):
+            monotonic.return_value = 1000 + elapsed
+            if second.get_or_set('user', lambda: row[0]) == 'old':
+                stale.append(elapsed)
+
+        self.assertEqual(stale, [0, 1, 2, 3, 4])
+        self.assertEqual(first.get_or_set('user', lambda: row[0]), 'new')
+        # the process local caches are never used as the second tier
+        self.assertIsNone(caches['second'].get('user'))
+        self.assertEqual(second.counts['shared_hits'], 0)
+
+    def test_invalidated_again_on_commit(self):
+        """Test a value cached before the commit is dropped by it"""
+        self.first.set('list', 'old')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.invalidate(['list'])
+            self.assertIsNone(self.first.get('list'))
+            # read by another request before the commit
+            self.second.set('list', 'old')
+
+        self.assertIsNone(caches['shared'].get('list'))
+
+    def test_keys_of_user_data(self):
+        """Test the keys of a user's lists and stats are all known"""
+        keys = caching.user_data_keys(7)
+
+        self.assertIn(caching.attrs_key('category', 7, True), keys)
+        self.assertIn(caching.attrs_key('supply', 7, False), keys)
+        self.assertIn(caching.stats_key(7), keys)
+        self.assertNotIn('abc', caching.token_key('abc'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY needs '
+            'PostgreSQL')
+@override_settings(CACHES=CACHES)
+class ListenerTests(TransactionTestCase):
+
+    def test_notify(self):
+        """Test the keys invalidated by a process leave the others"""
+        caches['shared'].clear()
+        sender = caching.TieredCache('shared', max_items=10, local_ttl=60,
+                                     timeout=60)
+        receiver = caching.TieredCache('shared', max_items=10, local_ttl=60,
+                                       timeout=60)
+        receiver.start_listener()
+        self.addCleanup(receiver._listener.stop)
+        self.assertTrue(receiver._listener.listening.wait(5))
+        sender.set('key', 'old')
+        receiver.get('key')
+
+        sender.invalidate(['key'] + [f'other:{i}' for i in range(1000)])
+
+        for _ in range(50):
+            if 'key' not in receiver._local:
+                break
+            receiver._listener.stopped.wait(0.1)
+        self.assertNotIn('key', receiver._local)
@@ -1,43 +1,162 @@
-from unittest.mock import patch
+from io import StringIO
+from unittest.mock import MagicMock, patch, call
 
+from django.conf import settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
 from django.test import TestCase
 import sys  # to write the output while running unit tests
 
+from core.management.commands import startup_profile, wait_for_db
+
+
+PROBE = 'core.management.commands.wait_for_db.Command.probe'
+
 
 class CommandTests(TestCase):
 
     def test_wait_for_db_ready(self):
-        """Test waiting for db when db is not available"""
-        # override the behavior of the ConnectionHandler
-        # use patch to mock the ConnectionHandler
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            # the __getitem__ is actually called when you retrieve the database
-            # mock the __getitem__ using patch and assign as a variable 'gi'
-            # during the test the mock item will override django behavior and
-            # replace with mock object which will return value 'True' and allow
-            # to monitor how many times the command was called
-            gi.return_value = True
-            call_command('wait_for_db')  # testing the command 'wait_for_db'
-
-            self.assertEqual(gi.call_count, 1)  # testing the command is called
-            # once
+        """Test waiting for db when db is available"""
+        # override the probe that runs a query on the database
+        # use patch to mock the probe
+        with patch(PROBE) as probe:
+            # during the test the mock item will override the command behavior
+            # and return without raising which means the database answered,
+            # and allow to monitor how many times the probe was called
+            call_command('wait_for_db', stdout=StringIO())  # testing the
+            # command 'wait_for_db'
+
+            self.assertEqual(probe.call_count, 1)  # testing the probe is
+            # called once
+            self.assertEqual(probe.call_args[0][0], 'default')
+            self.assertLessEqual(probe.call_args[0][1], 60)  # --timeout
             sys.stderr.write(repr('test 1 is done') + '\n')
 
     @patch('time.sleep', return_value=True)  # in the test it won't wait the
     # seconds, rather speed up the test by replacing the behavior of time.sleep
-    # this code does the same as line 14, and it would pass in as an argument
-    # to test_wait_for_db function, that is why we use 'ts' even though we are
-    # not using it in the test
+    # it is passed in as an argument to test_wait_for_db function, thus we can
+    # check how long the command wanted to wait
     def test_wait_for_db(self, ts):
         """test waiting for db"""
         # the number is 6 is used to make it reseasonable in realtime execution
         # any number higher than 1 can be used here
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
+        with patch(PROBE) as probe:
             # 5 times raise the operational error, and the 6th time doesn't
-            gi.side_effect = [OperationalError] * 5 + [True]
-            call_command('wait_for_db')
+            probe.side_effect = [OperationalError] * 5 + [None]
+            call_command('wait_for_db', stdout=StringIO())
 
-            self.assertEqual(gi.call_count, 6)
+            self.assertEqual(probe.call_count, 6)
+            self.assertEqual(ts.call_count, 5)
             sys.stderr.write(repr('test 2 is done') + '\n')
+
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_backoff(self, ts, uniform):
+        """Test the wait doubles after each failure up to the maximum"""
+        with patch(PROBE) as probe:
+            probe.side_effect = [OperationalError] * 5 + [None]
+            call_command('wait_for_db', '--initial-delay', '1',
+                         '--max-delay', '4', stdout=StringIO())
+
+        # without the jitter the waits are 1, 2, 4, 4, 4 seconds
+        self.assertEqual(ts.call_args_list,
+                         [call(1), call(2), call(4), call(4), call(4)])
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_timeout(self, ts):
+        """Test the command fails when the database never comes up"""
+        with patch(PROBE, side_effect=OperationalError), \
+                patch('time.monotonic', side_effect=range(0, 1000, 10)):
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', '--timeout', '30',
+                             stdout=StringIO())
+
+    def test_wait_for_several_databases(self):
+        """Test every requested database is probed"""
+        with patch(PROBE) as probe, \
+                patch.dict(settings.DATABASES, {'replica_1': {}}):
+            call_command('wait_for_db', '--database', 'default',
+                         '--database', 'replica_1', stdout=StringIO())
+
+        self.assertEqual(sorted(c[0][0] for c in probe.call_args_list),
+                         ['default', 'replica_1'])
+
+    def test_wait_for_unknown_database(self):
+        """Test an alias missing from the settings is refused up front"""
+        with patch(PROBE) as probe, \
+                self.assertRaisesMessage(CommandError, 'Unknown database '
+                                         'typo'):
+            call_command('wait_for_db', '--database', 'default',
+                         '--database', 'typo', stdout=StringIO())
+
+        probe.assert_not_called()
+
+    def test_wait_for_db_runs_query(self):
+        """Test the probe really queries the database"""
+        with patch('django.db.backends.utils.CursorWrapper.execute') as ex:
+            call_command('wait_for_db', stdout=StringIO())
+
+        ex.assert_called_once_with('SELECT 1')
+
+    def test_wait_for_db_connect_timeout(self):
+        """Test a connection attempt can't outlast the --timeout"""
+        postgresql = MagicMock(vendor='postgresql', settings_dict={
+            'NAME': 'app', 'OPTIONS': {'sslmode': 'require'},
+        })
+        shared = postgresql.settings_dict
+        command = wait_for_db.Command()
+        with patch('core.management.commands.wait_for_db.connections',
+                   {'default': postgresql}):
+            command.probe('default', 12.5)
+
+        self.assertEqual(postgresql.settings_dict['OPTIONS'],
+                         {'sslmode': 'require', 'connect_timeout': 13})
+        self.assertEqual(shared['OPTIONS'], {'sslmode': 'require'})
+        postgresql.ensure_connection.assert_called_once_with()
+
+        # the shortest of the configured one and the time left
+        postgresql.settings_dict = {'OPTIONS': {'connect_timeout': 5}}
+        with patch('core.management.commands.wait_for_db.connections',
+                   {'default': postgresql}):
+            command.probe('default', 0.1)
+        self.assertEqual(postgresql.settings_dict['OPTIONS'],
+                         {'connect_timeout': 2})
+
+
+class StartupProfileTests(TestCase):
+
+    def test_parse_importtime(self):
+        """Test the -X importtime output is parsed and grouped"""
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |   django.utils',
+            'import time:       300 |        400 | django',
+            'import time:        50 |         50 | PIL.Image',
+            'not an import time line',
+        ])
+
+        imports = startup_profile.parse_importtime(output)
+
+        self.assertEqual(imports, [
+            ('django.utils', 100, 100, 1),
+            ('django', 300, 400, 0),
+            ('PIL.Image', 50, 50, 0),
+        ])
+        self.assertEqual(startup_profile.group_by_package(imports),
+                         [('django', 400), ('PIL', 50)])
+
+    def test_api_settings_leave_out_unneeded_apps(self):
+        """Test the API only profile drops the admin, sessions and CSRF"""
+        from app import settings_api
+
+        self.assertNotIn('django.contrib.admin', settings_api.INSTALLED_APPS)
+        self.assertNotIn('django.contrib.sessions',
+                         settings_api.INSTALLED_APPS)
+        self.assertIn('core', settings_api.INSTALLED_APPS)
+        self.assertNotIn('django.middleware.csrf.CsrfViewMiddleware',
+                         settings_api.MIDDLEWARE)
+        self.assertEqual(
+            settings_api.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'],
+            ['rest_framework.renderers.JSONRenderer']
+        )
@@ -0,0 +1,163 @@
+import threading
+from unittest.mock import patch, Mock
+
+from django.test import SimpleTestCase
+from psycopg2 import extensions, pool as pg_pool
+
+from core.db.backends.postgresql import base
+
+
+def sample_settings(**extra):
+    """Return the settings of a database using our backend"""
+    settings_dict = {
+        'ENGINE': 'core.db.backends.postgresql',
+        'NAME': 'app',
+        'USER': 'postgres',
+        'PASSWORD': 'secret',
+        'HOST': 'db',
+        'PORT': '',
+        'OPTIONS': {},
+        'CONN_MAX_AGE': 0,
+        'AUTOCOMMIT': True,
+        'ATOMIC_REQUESTS': False,
+        'TIME_ZONE': None,
+        'TEST': {},
+    }
+    settings_dict.update(extra)
+    return settings_dict
+
+
+class PooledBackendTests(SimpleTestCase):
+
+    def tearDown(self):
+        base._pools.clear()
+
+    def test_pool_option_not_passed_to_psycopg2(self):
+        """Test the pool settings are not used as connection parameters"""
+        wrapper = base.DatabaseWrapper(sample_settings(
+            OPTIONS={'pool': {'max_size': 4}, 'sslmode': 'require'}
+        ), 'pooled')
+
+        params = wrapper.get_connection_params()
+
+        self.assertNotIn('pool', params)
+        self.assertEqual(params['sslmode'], 'require')
+
+    @patch('core.db.backends.postgresql.base.ConnectionPool')
+    def test_connection_taken_from_and_returned_to_pool(self, pool_class):
+        """Test pooled connections go back to the pool instead of closing"""
+        connection = Mock(closed=0, isolation_level=None)
+        connection.get_transaction_status.return_value = \
+            extensions.TRANSACTION_STATUS_INTRANS
+        pool = pool_class.return_value
+        pool.closed = False
+        pool.getconn.return_value = connection
+        wrapper = base.DatabaseWrapper(sample_settings(
+            OPTIONS={'pool': {'min_size': 1, 'max_size': 4}}
+        ), 'pooled')
+
+        with patch('core.db.backends.postgresql.base.extras'):
+            wrapper.connection = wrapper.get_new_connection(
+                wrapper.get_connection_params()
+            )
+        wrapper._close()
+
+        pool_class.assert_called_once_with(1, 4, database='app',
+                                           user='postgres',
+                                           password='secret', host='db')
+        connection.rollback.assert_called_once()  # left in a transaction
+        connection.close.assert_not_called()
+        pool.putconn.assert_called_once_with(connection, close=False)
+
+    @patch('core.db.backends.postgresql.base.ConnectionPool')
+    def test_closed_pooled_connection_discarded(self, pool_class):
+        """Test a connection closed by the server is not handed out"""
+        dead = Mock(closed=2)
+        alive = Mock(closed=0)
+        pool = pool_class.return_value
+        pool.closed = False
+        pool.getconn.side_effect = [dead, alive]
+        wrapper = base.DatabaseWrapper(sample_settings(
+            OPTIONS={'pool': {'max_size': 2}}
+        ), 'pooled')
+
+        self.assertIs(wrapper._checkout(pool, timeout=0), alive)
+        pool.putconn.assert_called_once_with(dead, close=True)
+
+    def test_health_check_replaces_dead_connection(self):
+        """Test a dead persistent connection is replaced on first use"""
+        wrapper = base.DatabaseWrapper(sample_settings(
+            CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True
+        ), 'persistent')
+        wrapper.connection = Mock()
+
+        with patch.object(wrapper, 'is_usable', return_value=False), \
+                patch.object(wrapper, 'connect') as connect:
+            wrapper.ensure_connection()
+
+        connect.assert_called_once()
+        self.assertTrue(wrapper.health_check_done)
+
+    def test_health_check_once_per_request(self):
+        """Test the health check only runs on the first use in a request"""
+        wrapper = base.DatabaseWrapper(sample_settings(
+            CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True
+        ), 'persistent')
+        wrapper.connection = Mock()
+
+        with patch.object(wrapper, 'is_usable', return_value=True) as usable:
+            wrapper.ensure_connection()
+            wrapper.ensure_connection()
+            self.assertEqual(usable.call_count, 1)
+
+            with patch.object(wrapper, 'get_autocommit', return_value=True):
+                wrapper.close_if_unusable_or_obsolete()  # next request
+            wrapper.ensure_connection()
+            self.assertEqual(usable.call_count, 2)
+
+
+@patch('psycopg2.connect')
+class ConnectionPoolTests(SimpleTestCase):
+    """Test the pool class itself, only the connections are fake"""
+
+    def _connect(self, connect):
+        def new_connection(*args, **kwargs):
+            connection = Mock(closed=0)
+            connection.info.transaction_status = \
+                extensions.TRANSACTION_STATUS_IDLE
+            return connection
+        connect.side_effect = new_connection
+
+    def test_returned_connections_reused(self, connect):
+        """Test the connections given back stay open up to max_size"""
+        self._connect(connect)
+        pool = base.ConnectionPool(1, 4, database='app')
+        taken = [pool.getconn() for _ in range(4)]
+        for connection in taken:
+            pool.putconn(connection)
+
+        again = [pool.getconn() for _ in range(4)]
+
+        self.assertCountEqual(again, taken)
+        self.assertEqual(connect.call_count, 4)
+        for connection in taken:
+            connection.close.assert_not_called()
+
+    def test_waits_for_returned_connection(self, connect):
+        """Test a thread waits for a connection instead of failing"""
+        self._connect(connect)
+        pool = base.ConnectionPool(1, 1, database='app')
+        connection = pool.getconn()
+        threading.Timer(0.05, pool.putconn, args=(connection,)).start()
+
+        self.assertIs(pool.getconn(timeout=5), connection)
+        self.assertEqual(connect.call_count, 1)
+
+    def test_wait_bounded(self, connect):
+        """Test the pool gives up waiting after the timeout"""
+        self._connect(connect)
+        pool = base.ConnectionPool(1, 1, database='app')
+        pool.getconn()
+
+        with self.assertRaises(pg_pool.PoolError):
+            pool.getconn(timeout=0.05)
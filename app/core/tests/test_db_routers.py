@@ -0,0 +1,52 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from core import models
+from core.db import routers
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+
+    def test_reads_use_default_outside_safe_requests(self):
+        """Test reads are left to the default database by default"""
+        self.assertIsNone(self.router.db_for_read(models.Painting))
+
+    def test_reads_use_replica_when_allowed(self):
+        """Test reads go to one of the replicas when allowed"""
+        token = routers.use_replicas()
+        try:
+            db = self.router.db_for_read(models.Painting)
+        finally:
+            routers.reset_replicas(token)
+
+        self.assertIn(db, ['replica_1', 'replica_2'])
+        self.assertIsNone(self.router.db_for_read(models.Painting))
+
+    def test_writes_always_use_default(self):
+        """Test writes go to the default database even during reads"""
+        token = routers.use_replicas()
+        try:
+            db = self.router.db_for_write(models.Painting)
+        finally:
+            routers.reset_replicas(token)
+
+        self.assertEqual(db, 'default')
+
+    def test_replicas_not_migrated(self):
+        """Test migrations never run on a replica"""
+        self.assertFalse(self.router.allow_migrate('replica_1', 'core'))
+        self.assertIsNone(self.router.allow_migrate('default', 'core'))
+
+    @patch('core.db.routers.cache')
+    def test_pin_to_primary(self, cache):
+        """Test a user is pinned to the primary after a write"""
+        user = models.User(id=5, email='test@sajiazafreen.com')
+        with self.settings(DATABASE_REPLICA_STICKY_SECONDS=7):
+            routers.pin_to_primary(user)
+
+        cache.set.assert_called_once_with('db-primary-pin:5', True, 7)
@@ -0,0 +1,100 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, IntegrityError, transaction
+from django.test import TestCase
+
+from core import dedup
+from core.models import Category, Supply, Painting
+
+
+class DedupTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'dedup@sajiazafreen.com', 'testpass')
+
+    def _painting(self, title='Painting'):
+        return Painting.objects.create(
+            user=self.user, title=title,
+            painting_create_date=datetime.date(2020, 1, 1)
+        )
+
+    def _duplicates(self, model, index, *names):
+        """Create rows with the same name, as before migration 0009"""
+        # the DDL is rolled back with the transaction of the test
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX {index}')
+        return [model.objects.create(user=self.user, name=name)
+                for name in names]
+
+    def test_names_unique_whatever_the_case(self):
+        """Test the database refuses the same name in another case"""
+        Category.objects.create(user=self.user, name='Oil')
+        other = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        Category.objects.create(user=other, name='oil')  # other user is fine
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Category.objects.create(user=self.user, name='OIL')
+
+    def test_filter_name(self):
+        """Test names are found whatever their case"""
+        oil = Supply.objects.create(user=self.user, name='Oil')
+
+        self.assertEqual(
+            list(dedup.filter_name(Supply.objects.all(), 'oIL')), [oil])
+
+    def test_merge_duplicates(self):
+        """Test the paintings of the duplicates move to the oldest row"""
+        oil, oil2, oil3 = self._duplicates(
+            Category, 'category_user_lower_name_uniq', 'Oil', 'oil', 'OIL')
+        first, second, third = (self._painting(t) for t in 'abc')
+        first.categories.add(oil, oil2)  # linked twice
+        second.categories.add(oil2, oil3)
+        third.categories.add(oil3)
+
+        merged = dedup.merge_duplicates(
+            Category, Painting.categories.through, 'category_id')
+
+        self.assertEqual(merged, 2)
+        self.assertEqual(list(Category.objects.all()), [oil])
+        for painting in (first, second, third):
+            self.assertEqual(list(painting.categories.all()), [oil])
+        oil.refresh_from_db()
+        self.assertEqual(oil.painting_count, 3)
+
+    def test_merge_touches_paintings(self):
+        """Test the paintings of the duplicates are synced again"""
+        oil, oil2 = self._duplicates(
+            Category, 'category_user_lower_name_uniq', 'Oil', 'oil')
+        moved, kept = self._painting('moved'), self._painting('kept')
+        moved.categories.add(oil2)
+        kept.categories.add(oil)
+        old = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+        Painting.objects.update(updated_at=old)
+
+        dedup.merge_duplicates(
+            Category, Painting.categories.through, 'category_id')
+
+        moved.refresh_from_db()
+        kept.refresh_from_db()
+        self.assertGreater(moved.updated_at, old)
+        self.assertEqual(kept.updated_at, old)
+
+    def test_merge_command(self):
+        """Test the command merges the supplies of the given user"""
+        self._duplicates(Supply, 'supply_user_lower_name_uniq',
+                         'Brush', 'brush')
+        out = StringIO()
+
+        call_command('merge_painting_attrs', '--dry-run', stdout=out)
+        self.assertIn('1 duplicated supplies names', out.getvalue())
+        self.assertEqual(Supply.objects.count(), 2)
+
+        call_command('merge_painting_attrs', '--user', self.user.email,
+                     stdout=out)
+        self.assertIn('Merged 1 duplicated supplies', out.getvalue())
+        self.assertEqual(Supply.objects.count(), 1)
@@ -0,0 +1,177 @@
+import datetime
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import deletion, sharding
+from core.db.routers import reset_shard, use_shard
+from core.models import Category, Painting, UserPaintingStats, \
+                        ShardAssignment, SyncTombstone
+
+
+class DeletionTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'deleted@sajiazafreen.com', 'testpass')
+        self.category = Category.objects.create(user=self.user, name='Oil')
+
+    def _painting(self, image=None):
+        painting = Painting.objects.create(
+            user=self.user, title='Painting',
+            painting_create_date=datetime.date(2020, 1, 1)
+        )
+        painting.categories.add(self.category)
+        if image:
+            painting.image = default_storage.save(
+                'uploads/recipe/deletion-test.png', ContentFile(b'png'))
+            painting.save()
+        return painting
+
+    def _counts(self):
+        self.category.refresh_from_db()
+        stats = UserPaintingStats.objects.get(user=self.user)
+        return stats.painting_count, self.category.painting_count
+
+    def test_soft_delete_uncounts_painting(self):
+        """Test a soft deleted painting is uncounted once, even when purged"""
+        painting = self._painting()
+        self._painting()
+
+        self.assertTrue(deletion.soft_delete_painting(painting))
+        self.assertFalse(deletion.soft_delete_painting(painting))
+        self.assertEqual(self._counts(), (1, 1))
+
+        call_command('purge_deleted', stdout=StringIO())
+        self.assertEqual(self._counts(), (1, 1))
+        self.assertFalse(Painting.objects.filter(id=painting.id).exists())
+
+    def test_purge_removes_links_and_image(self):
+        """Test the purge deletes the M2M rows and, once committed, files"""
+        painting = self._painting(image=True)
+        name = painting.image.name
+        variant = default_storage.save(f'{name}.webp', ContentFile(b'webp'))
+        deletion.soft_delete_painting(painting)
+        out = StringIO()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_deleted', '--batch-size', '1', stdout=out)
+
+        self.assertIn('Purged 1 paintings and 0 users', out.getvalue())
+        self.assertFalse(Painting.categories.through.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(variant))
+
+    def test_purge_older_than(self):
+        """Test recently deleted paintings are kept for the grace period"""
+        deletion.soft_delete_painting(self._painting())
+
+        call_command('purge_deleted', '--older-than', '24',
+                     stdout=StringIO())
+
+        self.assertEqual(Painting.objects.count(), 1)
+
+    def test_soft_deleted_user_purged(self):
+        """Test a deleted user can't log in, then is purged in batches"""
+        for _ in range(3):
+            self._painting()
+        deletion.soft_delete_user(self.user)
+        self.assertFalse(self.user.is_active)
+
+        call_command('purge_deleted', '--batch-size', '2',
+                     stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Painting.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+
+@skipUnless('shard_1' in settings.DATABASES, 'needs a second database')
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+class ShardedPurgeTests(TestCase):
+    # the class is collected even when skipped
+    databases = {'default'} | {'shard_1'} & set(settings.DATABASES)
+
+    def setUp(self):
+        sharding.forget()
+        self.addCleanup(sharding.forget)
+        self.user = get_user_model().objects.create_user(
+            'shard@sajiazafreen.com', 'testpass')
+        ShardAssignment.objects.filter(user=self.user) \
+            .update(database='shard_1')
+        token = use_shard('shard_1')
+        self.addCleanup(reset_shard, token)
+        self.painting = Painting.objects.create(
+            user=self.user, title='Painting',
+            painting_create_date=datetime.date(2020, 1, 1))
+        deletion.soft_delete_painting(self.painting, 'shard_1')
+        SyncTombstone.objects.create(
+            user=self.user, kind=SyncTombstone.PAINTING, object_id=1,
+            deleted_at=datetime.datetime(2000, 1, 1,
+                                         tzinfo=datetime.timezone.utc))
+
+    def test_purge_every_shard(self):
+        """Test the paintings and tombstones of every shard are purged"""
+        call_command('purge_deleted', stdout=StringIO())
+
+        self.assertFalse(Painting.objects.using('shard_1').exists())
+        self.assertEqual(SyncTombstone.objects.using('shard_1')
+                         .get().object_id, self.painting.pk)
+
+    def test_purge_one_database(self):
+        """Test --database leaves the other shards alone"""
+        call_command('purge_deleted', database='default', stdout=StringIO())
+
+        self.assertTrue(Painting.objects.using('shard_1').exists())
+        self.assertEqual(SyncTombstone.objects.using('shard_1').count(), 1)
+
+
+class DeletionApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'api@sajiazafreen.com', 'testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_deleted_painting_hidden(self):
+        """Test a deleted painting disappears from the API at once"""
+        painting = Painting.objects.create(
+            user=self.user, title='Painting',
+            painting_create_date=datetime.date(2020, 1, 1)
+        )
+
+        res = self.client.delete(reverse('painting:painting-detail',
+                                         args=[painting.id]))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+        painting.refresh_from_db()
+        self.assertIsNotNone(painting.deleted_at)
+        res = self.client.get(reverse('painting:painting-list'))
+        self.assertEqual(res.data, [])
+        res = self.client.get(reverse('painting:painting-detail',
+                                      args=[painting.id]))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_me(self):
+        """Test a user deleting their account can't use its token anymore"""
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        res = client.delete(reverse('user:me'))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+        res = client.get(reverse('user:me'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
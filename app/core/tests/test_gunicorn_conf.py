@@ -0,0 +1,35 @@
+import importlib
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from app import gunicorn_conf
+
+
+class GunicornConfTests(SimpleTestCase):
+
+    def load(self, **environ):
+        """Return the gunicorn settings read with an environment"""
+        with patch.dict('os.environ', environ):
+            return importlib.reload(gunicorn_conf)
+
+    def tearDown(self):
+        importlib.reload(gunicorn_conf)
+
+    def test_settings_from_environment(self):
+        """Test the server settings are read from the environment"""
+        conf = self.load(GUNICORN_WORKERS='3', GUNICORN_THREADS='4',
+                         GUNICORN_MAX_REQUESTS='50', GUNICORN_PRELOAD='0')
+
+        self.assertEqual(conf.workers, 3)
+        self.assertEqual(conf.threads, 4)
+        self.assertEqual(conf.worker_class, 'gthread')
+        self.assertEqual(conf.max_requests, 50)
+        self.assertFalse(conf.preload_app)
+
+    def test_single_thread_uses_sync_workers(self):
+        """Test one thread per worker uses the pre-fork sync worker"""
+        conf = self.load(GUNICORN_THREADS='1')
+
+        self.assertEqual(conf.worker_class, 'sync')
+        self.assertEqual(conf.wsgi_app, 'app.wsgi:application')
@@ -0,0 +1,223 @@
+import io
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import skipUnless
+
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import imaging, sharding
+from core.db.routers import reset_shard, use_shard
+from core.models import Painting, ShardAssignment, UserPaintingStats
+import datetime
+
+
+def image_file(color=(255, 0, 0), size=(40, 30), fmt='JPEG', draw=None):
+    """Return an in memory image file"""
+    img = Image.new('RGB', size, color)
+    if draw:
+        draw(img)
+    f = io.BytesIO()
+    img.save(f, format=fmt)
+    f.seek(0)
+    f.size = len(f.getvalue())
+    return f
+
+
+def half_white(img):
+    """Paint the right half of an image white"""
+    img.paste((255, 255, 255), (img.width // 2, 0, img.width, img.height))
+
+
+class ImagingTests(TestCase):
+
+    def test_image_metadata(self):
+        """Test the metadata of an image is extracted"""
+        f = image_file(color=(0, 0, 255), size=(40, 30), fmt='PNG')
+
+        metadata = imaging.image_metadata(f)
+
+        self.assertEqual(metadata['image_width'], 40)
+        self.assertEqual(metadata['image_height'], 30)
+        self.assertEqual(metadata['image_size'], f.size)
+        self.assertEqual(metadata['image_format'], 'png')
+        self.assertEqual(metadata['image_dominant_color'], '#0000ff')
+        self.assertEqual(len(metadata['image_phash']), 16)
+        self.assertEqual(f.tell(), 0)  # ready to be saved afterwards
+
+    def test_similar_images_have_close_hashes(self):
+        """Test the hash survives resizing and re-encoding"""
+        big = imaging.image_metadata(
+            image_file(size=(400, 300), draw=half_white))
+        small = imaging.image_metadata(
+            image_file(size=(80, 60), fmt='PNG', draw=half_white))
+        other = imaging.image_metadata(image_file(size=(400, 300)))
+
+        self.assertLessEqual(
+            imaging.hamming(big['image_phash'], small['image_phash']), 4)
+        self.assertGreater(
+            imaging.hamming(big['image_phash'], other['image_phash']), 4)
+
+    def test_hamming(self):
+        """Test the distance of two hashes counts the different bits"""
+        self.assertEqual(imaging.hamming('00000000000000ff',
+                                         '000000000000000f'), 4)
+
+    def test_optimize_keeps_jpeg_pixels(self):
+        """Test a JPEG loses its metadata but not a bit of its image data"""
+        img = Image.new('RGB', (40, 20), (0, 128, 0))
+        exif = img.getexif()
+        exif[0x0112] = 6  # turned by 90 degrees
+        exif[0x010f] = 'Camera' * 1000  # make
+        f = io.BytesIO()
+        img.save(f, format='JPEG', quality=95, exif=exif.tobytes(),
+                 icc_profile=b'profile' * 100, comment=b'comment')
+
+        data = imaging.optimize(f)
+
+        self.assertLess(len(data), len(f.getvalue()))
+        # the scan is copied as is
+        scan = f.getvalue().index(b'\xff\xda')
+        self.assertTrue(data.endswith(f.getvalue()[scan:]))
+        with Image.open(f) as original, \
+                Image.open(io.BytesIO(data)) as optimized:
+            self.assertEqual(optimized.size, (40, 20))
+            self.assertEqual(dict(optimized.getexif()), {0x0112: 6})
+            self.assertNotIn('comment', optimized.info)
+            self.assertEqual(optimized.info['icc_profile'],
+                             b'profile' * 100)
+            self.assertEqual(optimized.quantization, original.quantization)
+            self.assertEqual(optimized.tobytes(), original.tobytes())
+
+    def test_strip_jpeg_malformed(self):
+        """Test a JPEG whose segments can't be read is left alone"""
+        f = image_file()
+
+        self.assertIsNone(imaging.strip_jpeg(f.getvalue()[:30]))
+        self.assertIsNone(imaging.strip_jpeg(b'not a jpeg'))
+
+    def test_optimize_turns_png(self):
+        """Test a turned PNG is made upright, losslessly"""
+        img = Image.new('RGB', (40, 20), (0, 128, 0))
+        img.paste((255, 255, 255), (0, 0, 20, 20))
+        exif = img.getexif()
+        exif[0x0112] = 6
+        f = io.BytesIO()
+        img.save(f, format='PNG', exif=exif.tobytes())
+
+        data = imaging.optimize(f)
+
+        with Image.open(io.BytesIO(data)) as optimized:
+            self.assertEqual(optimized.size, (20, 40))
+            self.assertEqual(optimized.format, 'PNG')
+            self.assertNotIn(0x0112, optimized.getexif())
+            self.assertEqual(optimized.tobytes(),
+                             img.transpose(Image.ROTATE_270).tobytes())
+
+    def test_optimize_keeps_animations(self):
+        """Test an animated PNG is left alone, with all its frames"""
+        frames = [Image.new('RGB', (40, 20), (i * 50, 0, 0))
+                  for i in range(5)]
+        exif = frames[0].getexif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera' * 1000  # make
+        f = io.BytesIO()
+        frames[0].save(f, format='PNG', save_all=True,
+                       append_images=frames[1:], exif=exif.tobytes())
+
+        self.assertIsNone(imaging.optimize(f))
+
+    def test_optimize_not_worth_it(self):
+        """Test an upright image that can't get smaller is left alone"""
+        f = image_file(fmt='GIF')
+        self.assertIsNone(imaging.optimize(f))
+        f = io.BytesIO()
+        Image.new('RGB', (40, 20)).save(f, format='PNG', optimize=True)
+        self.assertIsNone(imaging.optimize(f))
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BackfillImageMetadataTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT)
+        super().tearDownClass()
+
+    def test_backfill_image_metadata(self):
+        """Test images uploaded before the metadata existed get it"""
+        user = get_user_model().objects.create_user('test@sajiazafreen.com',
+                                                    'testpass')
+        painting = Painting.objects.create(
+            user=user, title='Stormy Night',
+            painting_create_date=datetime.date(2014, 6, 11))
+        painting.image.save('old.jpg', ContentFile(image_file().read()))
+        broken = Painting.objects.create(
+            user=user, title='Lost', image='uploads/recipe/missing.jpg',
+            painting_create_date=datetime.date(2014, 6, 11))
+
+        before = Painting.objects.get(id=painting.id).updated_at
+        out = StringIO()
+
+        call_command('backfill_image_metadata', stdout=out,
+                     stderr=StringIO())
+
+        self.assertIn('metadata of 1 images (1 unreadable)', out.getvalue())
+        painting.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertGreater(painting.updated_at, before)
+        self.assertEqual(painting.image_width, 40)
+        self.assertEqual(painting.image_format, 'jpeg')
+        self.assertEqual(painting.image_size,
+                         os.path.getsize(painting.image.path))
+        self.assertEqual(broken.image_phash, '')
+
+
+@skipUnless('shard_1' in settings.DATABASES, 'needs a second database')
+@override_settings(MEDIA_ROOT=MEDIA_ROOT,
+                   DATABASE_SHARDS=['default', 'shard_1'])
+class ShardedBackfillTests(TestCase):
+    # the class is collected even when skipped
+    databases = {'default'} | {'shard_1'} & set(settings.DATABASES)
+
+    def setUp(self):
+        sharding.forget()
+        self.addCleanup(sharding.forget)
+        self.user = get_user_model().objects.create_user(
+            'shard@sajiazafreen.com', 'testpass')
+        ShardAssignment.objects.filter(user=self.user) \
+            .update(database='shard_1')
+        token = use_shard('shard_1')
+        self.addCleanup(reset_shard, token)
+        self.painting = Painting.objects.create(
+            user=self.user, title='Stormy Night',
+            painting_create_date=datetime.date(2014, 6, 11))
+        self.painting.image.save('shard.jpg',
+                                 ContentFile(image_file().read()))
+
+    def test_backfill_every_shard(self):
+        """Test the paintings of every shard get their metadata"""
+        call_command('backfill_image_metadata', stdout=StringIO())
+
+        painting = Painting.objects.using('shard_1').get()
+        self.assertEqual(painting.image_width, 40)
+        self.assertEqual(UserPaintingStats.objects.using('shard_1')
+                         .get(user=self.user).image_hashes_version, 1)
+
+    def test_backfill_one_database(self):
+        """Test --database leaves the other shards alone"""
+        call_command('backfill_image_metadata', database='default',
+                     stdout=StringIO())
+
+        painting = Painting.objects.using('shard_1').get()
+        self.assertEqual(painting.image_phash, '')
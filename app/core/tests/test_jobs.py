@@ -0,0 +1,115 @@
+import datetime
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+
+CALLS = []
+
+
+def record(*args, **kwargs):
+    """Task remembering how it was called"""
+    CALLS.append((args, kwargs))
+
+
+def fail():
+    """Task always failing"""
+    raise RuntimeError('broken task')
+
+
+@override_settings(JOB_MAX_ATTEMPTS=3, JOB_RETRY_DELAY=10,
+                   JOB_MAX_RETRY_DELAY=25, JOB_TIMEOUT=600)
+class JobTests(TestCase):
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_and_run(self):
+        """Test a queued job is run with its arguments"""
+        job = jobs.enqueue(record, args=[1, 'a'], kwargs={'size': 2})
+
+        self.assertEqual(job.task, 'core.tests.test_jobs.record')
+        self.assertEqual(jobs.work(), 1)
+        self.assertEqual(CALLS, [((1, 'a'), {'size': 2})])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(jobs.work(), 0)  # nothing left
+
+    def test_delayed_job_not_claimed(self):
+        """Test a job is only run once it is due"""
+        jobs.enqueue('core.tests.test_jobs.record', delay=60)
+
+        self.assertEqual(jobs.claim(), [])
+
+    def test_failed_job_retried_with_backoff(self):
+        """Test a failing job is queued again later, then marked failed"""
+        job = jobs.enqueue(fail)
+        now = timezone.now()
+
+        jobs.work()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('broken task', job.last_error)
+        self.assertGreaterEqual(job.run_at, now + datetime.timedelta(
+            seconds=10))
+
+        for _ in range(2):
+            Job.objects.update(run_at=timezone.now())
+            jobs.work()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_retry_delay(self):
+        """Test the wait doubles up to JOB_MAX_RETRY_DELAY"""
+        self.assertEqual([jobs.retry_delay(n) for n in (1, 2, 3)],
+                         [10, 20, 25])
+
+    def test_stale_running_job_claimed_again(self):
+        """Test the job of a dead worker is run again after the timeout"""
+        job = jobs.enqueue(record)
+        jobs.claim()
+        self.assertEqual(jobs.claim(), [])
+
+        later = timezone.now() + datetime.timedelta(seconds=601)
+        with patch('django.utils.timezone.now', return_value=later):
+            claimed = jobs.claim()
+
+        self.assertEqual([j.id for j in claimed], [job.id])
+        self.assertEqual(claimed[0].attempts, 2)
+
+    def test_metrics(self):
+        """Test the jobs are counted by status"""
+        jobs.enqueue(record)
+        jobs.enqueue(record)
+        jobs.enqueue(fail, max_attempts=1)
+        jobs.work(batch=3)
+        jobs.enqueue(record)
+
+        metrics = jobs.metrics()
+
+        self.assertEqual(
+            (metrics['queued'], metrics['done'], metrics['failed']),
+            (1, 2, 1)
+        )
+        self.assertGreaterEqual(metrics['average_run_seconds'], 0)
+
+    def test_run_workers_in_process(self):
+        """Test the command runs every due job"""
+        for number in range(3):
+            jobs.enqueue(record, args=[number])
+        out = StringIO()
+
+        call_command('run_workers', '--processes', '0', stdout=out)
+
+        self.assertEqual(sorted(args for args, _ in CALLS),
+                         [(0,), (1,), (2,)])
+        self.assertIn('done=3', out.getvalue())
@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+CONTENT = bytes(range(256)) * 4
+
+
+def media_url(name):
+    """Return the URL of a media file"""
+    return reverse('media', args=[name])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_SENDFILE='')
+class ServeMediaTests(TestCase):
+    """Test serving uploaded files"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(MEDIA_ROOT, 'uploads/recipe'))
+        with open(os.path.join(MEDIA_ROOT, 'uploads/recipe/a.jpg'),
+                  'wb') as f:
+            f.write(CONTENT)
+        with open(os.path.join(MEDIA_ROOT, 'other.txt'), 'w') as f:
+            f.write('other')
+        # noisy enough for the lossy WebP to be smaller than the PNG
+        Image.effect_noise((200, 200), 64).convert('RGB').save(
+            os.path.join(MEDIA_ROOT, 'uploads/recipe/b.png'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT)
+        super().tearDownClass()
+
+    def test_serve_file(self):
+        """Test the whole file is served with caching headers"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertIn('ETag', res)
+        self.assertIn('Last-Modified', res)
+
+    def test_not_immutable_outside_uploads(self):
+        """Test files outside of the uploads get a short max-age"""
+        res = self.client.get(media_url('other.txt'))
+
+        self.assertEqual(res['Cache-Control'], 'public, max-age=3600')
+
+    def test_serve_range(self):
+        """Test a byte range is answered with partial content"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'),
+                              HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res['Content-Range'], f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(res['Content-Length'], '10')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[10:20])
+
+    def test_serve_suffix_range(self):
+        """Test a range of the last bytes of the file"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'),
+                              HTTP_RANGE='bytes=-100')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[-100:])
+
+    def test_unsatisfiable_range(self):
+        """Test a range past the end of the file is refused"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'),
+                              HTTP_RANGE='bytes=5000-')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_if_range_mismatch_serves_whole_file(self):
+        """Test a range of an older version of the file is ignored"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'),
+                              HTTP_RANGE='bytes=10-19',
+                              HTTP_IF_RANGE='"old-etag"')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_not_modified(self):
+        """Test conditional requests of an unchanged file get a 304"""
+        url = media_url('uploads/recipe/a.jpg')
+        res = self.client.get(url)
+
+        by_etag = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        by_date = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect',
+                       MEDIA_ACCEL_REDIRECT_URL='/protected-media/')
+    def test_x_accel_redirect(self):
+        """Test the file is handed over to nginx when configured"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'],
+                         '/protected-media/uploads/recipe/a.jpg')
+        self.assertEqual(res.content, b'')
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect',
+                       MEDIA_ACCEL_REDIRECT_URL='/protected-media/')
+    def test_x_accel_redirect_quoted(self):
+        """Test the name is quoted in the URI handed over to nginx"""
+        name = 'uploads/recipe/caf\u00e9 100%?.jpg'
+        with open(os.path.join(MEDIA_ROOT, name), 'wb') as f:
+            f.write(CONTENT)
+        self.addCleanup(os.remove, os.path.join(MEDIA_ROOT, name))
+
+        res = self.client.get(media_url(name))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'],
+                         '/protected-media/uploads/recipe/'
+                         'caf%C3%A9%20100%25%3F.jpg')
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        """Test the file is handed over to apache when configured"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'))
+
+        self.assertEqual(res['X-Sendfile'],
+                         os.path.join(MEDIA_ROOT, 'uploads/recipe/a.jpg'))
+
+    def test_missing_and_outside_files(self):
+        """Test missing files and paths outside the media root are 404"""
+        missing = self.client.get(media_url('uploads/recipe/missing.jpg'))
+        outside = self.client.get(media_url('../etc/passwd'))
+        directory = self.client.get(media_url('uploads'))
+
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(outside.status_code, 404)
+        self.assertEqual(directory.status_code, 404)
+
+    def test_post_not_allowed(self):
+        """Test media files can only be read"""
+        res = self.client.post(media_url('uploads/recipe/a.jpg'))
+
+        self.assertEqual(res.status_code, 405)
+
+    def test_accepted_format(self):
+        """Test a client accepting WebP gets a WebP copy of a PNG"""
+        url = media_url('uploads/recipe/b.png')
+        png = self.client.get(url, HTTP_ACCEPT='image/png,image/*')
+        webp = self.client.get(url, HTTP_ACCEPT='image/webp,image/*')
+
+        self.assertEqual(png['Content-Type'], 'image/png')
+        self.assertEqual(webp['Content-Type'], 'image/webp')
+        self.assertEqual(png['Vary'], 'Accept')
+        self.assertEqual(webp['Vary'], 'Accept')
+        self.assertLess(len(b''.join(webp.streaming_content)),
+                        len(b''.join(png.streaming_content)))
+        self.assertTrue(os.path.exists(
+            os.path.join(MEDIA_ROOT, 'uploads/recipe/b.png.webp')))
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect',
+                       MEDIA_ACCEL_REDIRECT_URL='/protected-media/')
+    def test_accepted_format_x_accel_redirect(self):
+        """Test nginx is handed the variant of the image"""
+        res = self.client.get(media_url('uploads/recipe/b.png'),
+                              HTTP_ACCEPT='image/webp')
+
+        self.assertEqual(res['X-Accel-Redirect'],
+                         '/protected-media/uploads/recipe/b.png.webp')
+
+    def test_accepted_format_not_an_image(self):
+        """Test the original is served when it can't be converted"""
+        res = self.client.get(media_url('uploads/recipe/a.jpg'),
+                              HTTP_ACCEPT='image/webp')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
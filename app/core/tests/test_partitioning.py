@@ -0,0 +1,110 @@
+import datetime
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+
+from core import partitioning
+from core.models import Category, Painting
+
+
+class PartitioningTests(TestCase):
+
+    def test_postgresql_only(self):
+        """Test the commands refuse to run on another database"""
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('partition_paintings', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('benchmark_partitioning', stdout=StringIO())
+
+    def test_postgresql_11_or_later(self):
+        """Test an older PostgreSQL is refused before touching anything"""
+        connection = Mock(vendor='postgresql', pg_version=100012)
+        with patch('core.partitioning.connections', {'default': connection}), \
+                self.assertRaisesMessage(partitioning.PartitioningError,
+                                         'PostgreSQL 11 or later'):
+            partitioning.partition()
+
+        connection.cursor.assert_not_called()
+
+    def test_rewrite_index(self):
+        """Test an index is created on the partitioned table"""
+        name, definition = partitioning.rewrite_index(
+            'CREATE INDEX painting_user_updated_idx ON public.core_painting '
+            'USING btree (user_id, updated_at)', 'core_painting', 'user_id')
+
+        self.assertEqual(name, 'painting_user_updated_idx')
+        self.assertEqual(
+            definition,
+            f'CREATE INDEX '
+            f'{partitioning.temporary_name(name, "part")} ON '
+            'core_painting_part USING btree (user_id, updated_at)')
+
+    def test_rewrite_partial_unique_index(self):
+        """Test the condition is kept, unique indexes need the key"""
+        _, definition = partitioning.rewrite_index(
+            'CREATE UNIQUE INDEX links_uniq ON public.core_painting_categories'
+            ' USING btree (painting_id, category_id) WHERE (id > 0)',
+            'core_painting_categories', 'painting_id')
+
+        self.assertTrue(definition.startswith('CREATE UNIQUE INDEX'))
+        self.assertTrue(definition.endswith('WHERE (id > 0)'))
+        with self.assertRaises(partitioning.PartitioningError):
+            partitioning.rewrite_index(
+                'CREATE UNIQUE INDEX title_uniq ON public.core_painting '
+                'USING btree (title)', 'core_painting', 'user_id')
+
+    def test_temporary_name_length(self):
+        """Test the temporary names fit in the 63 characters of postgres"""
+        name = 'core_painting_categories_painting_id_category_id_2d7d7b1e_uniq'
+
+        self.assertLessEqual(len(partitioning.temporary_name(name, 'part')),
+                             63)
+        self.assertNotEqual(partitioning.temporary_name(name, 'part'),
+                            partitioning.temporary_name(name + 'x', 'part'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning needs '
+            'PostgreSQL')
+class CatchUpTests(TransactionTestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            'part@sajiazafreen.com', 'testpass123')
+        self.category = Category.objects.create(user=user, name='Oil')
+        self.paintings = [
+            Painting.objects.create(user=user, title=title,
+                                    painting_create_date=datetime.date.today())
+            for title in ('Kept', 'Renamed', 'Deleted')
+        ]
+        self.addCleanup(partitioning.abort)
+
+    def _copy(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT * FROM {table}_part ORDER BY id')
+            return cursor.fetchall()
+
+    def test_changes_during_copy(self):
+        """Test the writes after the copy started reach the copies"""
+        kept, renamed, deleted = self.paintings
+        partitioning.create_tables(partitions=4)
+        for table, _ in partitioning.TABLES:
+            partitioning.copy_rows(table)
+
+        Painting.objects.filter(pk=renamed.pk).update(title='New title')
+        deleted.delete()
+        kept.categories.add(self.category)  # links added in bulk
+        with transaction.atomic(), connection.cursor() as cursor:
+            # the link bumps updated_at of its painting too
+            self.assertGreaterEqual(partitioning.catch_up(cursor), 3)
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.assertEqual(partitioning.catch_up(cursor), 0)
+        for table, _ in partitioning.TABLES:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT * FROM {table} ORDER BY id')
+                self.assertEqual(self._copy(table), cursor.fetchall())
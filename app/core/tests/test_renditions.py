@@ -0,0 +1,222 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+from PIL import Image
+
+from django.test import TestCase, override_settings
+
+from core import renditions
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def write_image(name, size=(400, 300), image_format='JPEG'):
+    """Write an image in the media root, return its path"""
+    path = os.path.join(MEDIA_ROOT, name)
+    Image.new('RGB', size, (200, 40, 40)).save(path, image_format)
+    return path
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_CACHE_PREFIX='cache/',
+                   IMAGE_RENDITION_SIZES=[64, 128, 256],
+                   IMAGE_CACHE_MAX_BYTES=10 * 1024 * 1024)
+class RenditionTests(TestCase):
+
+    def setUp(self):
+        os.makedirs(MEDIA_ROOT, exist_ok=True)
+        self.source = write_image('source.jpg')
+        renditions._cache_bytes = None
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT)
+
+    def test_contain(self):
+        """Test the image fits in the box, keeping its ratio"""
+        path, name = renditions.get(self.source, 128, 128)
+
+        self.assertTrue(name.startswith('cache/'))
+        self.assertTrue(name.endswith('.jpg'))
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (128, 96))
+
+    def test_cover(self):
+        """Test the image is cropped to the exact size"""
+        path, _ = renditions.get(self.source, 64, 64, 'cover', 'png')
+
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (64, 64))
+            self.assertEqual(image.format, 'PNG')
+
+    def test_one_side(self):
+        """Test the other side follows the ratio of the image"""
+        path, _ = renditions.get(self.source, None, 64)
+
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (85, 64))
+
+    def test_not_allowed(self):
+        """Test sizes, fits and formats out of the whitelist are refused"""
+        for args in ((100, None), (None, None), (64, 64, 'stretch'),
+                     (64, 64, 'contain', 'gif')):
+            with self.assertRaises(renditions.RenditionError):
+                renditions.get(self.source, *args)
+
+    def test_palette_image(self):
+        """Test images in modes Pillow can't resample are converted"""
+        for mode, name in (('P', 'palette.png'), ('1', 'bilevel.png'),
+                           ('I;16', 'deep.png')):
+            path = os.path.join(MEDIA_ROOT, name)
+            Image.new(mode, (400, 300)).save(path, 'PNG')
+
+            path, _ = renditions.get(path, 64, None)
+
+            with Image.open(path) as image:
+                self.assertEqual(image.size, (64, 48))
+        path = os.path.join(MEDIA_ROOT, 'transparent.png')
+        Image.new('P', (400, 300)).save(path, 'PNG', transparency=0)
+        with Image.open(renditions.get(path, 64, None)[0]) as image:
+            self.assertEqual(image.mode, 'RGBA')
+
+    def test_unreadable_image(self):
+        """Test a file Pillow can't decode is a rendition error"""
+        with open(os.path.join(MEDIA_ROOT, 'text.jpg'), 'w') as f:
+            f.write('not an image')
+        with open(self.source, 'rb') as f:
+            data = f.read()
+        with open(os.path.join(MEDIA_ROOT, 'truncated.jpg'), 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        for name in ('text.jpg', 'truncated.jpg'):
+            with self.assertRaises(renditions.RenditionError):
+                renditions.get(os.path.join(MEDIA_ROOT, name), 64, None)
+        with mock.patch('PIL.Image.MAX_IMAGE_PIXELS', 100), \
+                self.assertRaises(renditions.RenditionError):
+            renditions.get(self.source, 64, None)
+
+    def test_rendered_once(self):
+        """Test a cached rendition is not rendered again"""
+        first, _ = renditions.get(self.source, 64, None)
+        with mock.patch.object(renditions, 'render') as render:
+            second, _ = renditions.get(self.source, 64, None)
+
+        self.assertEqual(first, second)
+        render.assert_not_called()
+
+    def test_source_changed(self):
+        """Test a replaced source gets a new rendition"""
+        _, first = renditions.get(self.source, 64, None)
+        write_image('source.jpg', size=(500, 300))
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns + 10 ** 9))
+        _, second = renditions.get(self.source, 64, None)
+
+        self.assertNotEqual(first, second)
+
+    def test_single_flight(self):
+        """Test concurrent requests of a rendition render it once"""
+        render = renditions.render
+        calls = []
+
+        def slow_render(*args):
+            calls.append(args)
+            time.sleep(0.1)
+            render(*args)
+
+        with mock.patch.object(renditions, 'render', slow_render):
+            threads = [
+                threading.Thread(target=renditions.get,
+                                 args=(self.source, 256, None))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(renditions._locks, {})
+        # no lock file is left behind
+        locks = os.path.join(renditions.cache_dir(), 'locks')
+        self.assertEqual(os.listdir(locks) if os.path.isdir(locks) else [],
+                         [])
+
+    @skipUnless(renditions.fcntl, 'The lock files need fcntl')
+    def test_lock_file_removed_while_waiting(self):
+        """Test a process waiting on a removed lock file takes a new one"""
+        os.makedirs(os.path.join(renditions.cache_dir(), 'locks'))
+        path = os.path.join(renditions.cache_dir(), 'locks', 'key.lock')
+        holder = renditions._lock_file(path)
+        waiter = []
+        thread = threading.Thread(
+            target=lambda: waiter.append(renditions._lock_file(path)))
+        thread.start()
+        time.sleep(0.05)
+
+        os.remove(path)  # what the holder does on release
+        holder.close()
+        thread.join(5)
+
+        self.assertTrue(os.path.samestat(os.fstat(waiter[0].fileno()),
+                                         os.stat(path)))
+        waiter[0].close()
+
+    def test_evict_least_recently_used(self):
+        """Test the oldest renditions go when the cache is too big"""
+        old, _ = renditions.get(self.source, 64, None)
+        recent, _ = renditions.get(self.source, 128, None)
+        os.utime(old, (time.time() - 3600, os.stat(old).st_mtime))
+
+        # evicts down to 90% of the limit
+        renditions.evict(max_bytes=os.path.getsize(recent) * 10 // 9 + 1)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+
+    def test_hit_keeps_mtime(self):
+        """Test serving from the cache doesn't change the ETag"""
+        path, _ = renditions.get(self.source, 64, None)
+        os.utime(path, (time.time() - 3600, time.time() - 3600))
+        mtime = os.stat(path).st_mtime
+
+        renditions.get(self.source, 64, None)
+
+        self.assertEqual(os.stat(path).st_mtime, mtime)
+        self.assertGreater(os.stat(path).st_atime, time.time() - 60)
+
+    @override_settings(IMAGE_NEGOTIATED_FORMATS=['avif', 'webp'])
+    def test_accepted_format(self):
+        """Test the preferred format the client names is chosen"""
+        with mock.patch.object(renditions, 'saveable',
+                               lambda image_format: True):
+            self.assertEqual(renditions.accepted_format(
+                'image/avif,image/webp,image/*;q=0.8'), 'avif')
+            self.assertEqual(renditions.accepted_format(
+                'image/avif;q=0,image/webp;q=0.5'), 'webp')
+            self.assertIsNone(renditions.accepted_format('image/*,*/*'))
+            self.assertIsNone(renditions.accepted_format(''))
+
+    @override_settings(IMAGE_NEGOTIATED_FORMATS=['avif', 'webp'])
+    def test_accepted_format_not_saveable(self):
+        """Test a format Pillow can't write is skipped"""
+        with mock.patch.object(renditions, 'saveable',
+                               lambda image_format: image_format == 'webp'):
+            self.assertEqual(renditions.accepted_format(
+                'image/avif,image/webp'), 'webp')
+
+    def test_exif_orientation(self):
+        """Test a turned photo is resized as it is seen"""
+        image = Image.new('RGB', (400, 200))
+        exif = image.getexif()
+        exif[0x0112] = 6  # turned by 90 degrees
+        image.save(self.source, 'JPEG', exif=exif.tobytes())
+
+        path, _ = renditions.get(self.source, 64, None)
+
+        with Image.open(path) as rendition:
+            self.assertEqual(rendition.size, (64, 128))
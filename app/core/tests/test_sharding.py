@@ -0,0 +1,193 @@
+import datetime
+import io
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import models, sharding
+from core.db import routers
+
+
+PAINTINGS_URL = reverse('painting:painting-list')
+
+
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+class ShardRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = routers.ShardRouter()
+
+    def test_sharded_models_follow_the_request(self):
+        """Test the user data goes to the shard of the request"""
+        token = routers.use_shard('shard_1')
+        try:
+            read = self.router.db_for_read(models.Painting)
+            write = self.router.db_for_write(models.Painting.categories
+                                             .through)
+            user = self.router.db_for_read(models.User)
+        finally:
+            routers.reset_shard(token)
+
+        self.assertEqual(read, 'shard_1')
+        self.assertEqual(write, 'shard_1')
+        self.assertIsNone(user)
+        self.assertIsNone(self.router.db_for_read(models.Painting))
+
+    def test_default_shard_left_to_replicas(self):
+        """Test the users on the default database keep the replicas"""
+        token = routers.use_shard('default')
+        try:
+            self.assertIsNone(self.router.db_for_read(models.Painting))
+        finally:
+            routers.reset_shard(token)
+
+    def test_related_rows_follow_the_instance(self):
+        """Test the links of a painting are on the painting's database"""
+        painting = models.Painting()
+        painting._state.db = 'shard_1'
+        user = models.User()
+        user._state.db = 'default'
+
+        self.assertEqual(
+            self.router.db_for_read(models.Category, instance=painting),
+            'shard_1')
+        self.assertIsNone(
+            self.router.db_for_read(models.Category, instance=user))
+        self.assertTrue(self.router.allow_relation(painting, user))
+
+
+class DirectoryTests(TestCase):
+
+    def setUp(self):
+        sharding.forget()
+        self.addCleanup(sharding.forget)
+
+    def test_no_shards(self):
+        """Test everybody is on the default database without shards"""
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.assignment(1), ('default', False))
+
+    @override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+    def test_new_users_spread(self):
+        """Test the new users are spread over the shards"""
+        users = [get_user_model().objects.create_user(
+            f'shard{i}@sajiazafreen.com', 'testpass') for i in range(4)]
+
+        databases = {user.pk: user.shard.database for user in users}
+
+        self.assertEqual(set(databases.values()), {'default', 'shard_1'})
+        for user_id, database in databases.items():
+            self.assertEqual(database, ['default', 'shard_1'][user_id % 2])
+
+    @override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+    def test_assignment_cached(self):
+        """Test the directory is only queried once per user"""
+        user = get_user_model().objects.create_user(
+            'cached@sajiazafreen.com', 'testpass')
+        models.ShardAssignment.objects.filter(user=user) \
+            .update(database='shard_1')
+        sharding.forget(user.pk)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sharding.assignment(user.pk),
+                             ('shard_1', False))
+            self.assertEqual(sharding.database_for(user.pk), 'shard_1')
+
+    @override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+    def test_legacy_user_on_default(self):
+        """Test a user without assignment is on the default database"""
+        self.assertEqual(sharding.assignment(12345), ('default', False))
+
+
+@override_settings(DATABASE_SHARDS=['default'])
+class MovingUserApiTests(TestCase):
+
+    def setUp(self):
+        sharding.forget()
+        self.addCleanup(sharding.forget)
+        self.user = get_user_model().objects.create_user(
+            'moving@sajiazafreen.com', 'testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        models.ShardAssignment.objects.filter(user=self.user) \
+            .update(read_only=True)
+
+    def test_writes_refused_while_moving(self):
+        """Test the API refuses to change the data being moved"""
+        res = self.client.post(PAINTINGS_URL, {
+            'title': 'Sample', 'painting_create_date': '2020-01-01',
+        })
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(models.Painting.objects.exists())
+
+    def test_reads_allowed_while_moving(self):
+        """Test the paintings can still be listed"""
+        res = self.client.get(PAINTINGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@skipUnless('shard_1' in settings.DATABASES, 'needs a second database')
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+class MoveUserTests(TestCase):
+    # the class is collected even when skipped
+    databases = {'default'} | {'shard_1'} & set(settings.DATABASES)
+
+    def setUp(self):
+        sharding.forget()
+        self.addCleanup(sharding.forget)
+        self.user = get_user_model().objects.create_user(
+            'move@sajiazafreen.com', 'testpass')
+        models.ShardAssignment.objects.filter(user=self.user) \
+            .update(database='default')
+
+    def test_move_user(self):
+        """Test the rows of a user are copied with their ids"""
+        category = models.Category.objects.create(user=self.user,
+                                                  name='Oil')
+        supply = models.Supply.objects.create(user=self.user, name='Brush')
+        painting = models.Painting.objects.create(
+            user=self.user, title='Moved',
+            painting_create_date=datetime.date(2020, 1, 1))
+        painting.categories.add(category)
+        painting.supplies.add(supply)
+
+        call_command('move_user_shard', user=self.user.email,
+                     target='shard_1', no_wait=True, batch_size=1,
+                     stdout=io.StringIO())
+
+        self.assertEqual(sharding.database_for(self.user.pk), 'shard_1')
+        moved = models.Painting.objects.using('shard_1').get()
+        self.assertEqual(moved.pk, painting.pk)
+        self.assertEqual(list(moved.categories.all()), [category])
+        self.assertEqual(list(moved.supplies.all()), [supply])
+        self.assertEqual(models.Category.objects.using('shard_1')
+                         .get().painting_count, 1)
+        self.assertEqual(models.UserPaintingStats.objects.using('shard_1')
+                         .get(user_id=self.user.pk).painting_count, 1)
+        self.assertFalse(models.SyncTombstone.objects.using('shard_1')
+                         .exists())
+        for model in sharding.DELETED_MODELS:
+            self.assertFalse(model.objects.using('default').exists(),
+                             model)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.get(PAINTINGS_URL)
+        self.assertEqual([row['id'] for row in res.data], [painting.pk])
+        res = client.post(PAINTINGS_URL, {
+            'title': 'New', 'painting_create_date': '2020-02-01',
+            'categories': ['Oil', 'Acrylic'], 'supplies': [],
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(models.Painting.objects.using('shard_1').count(), 2)
+        self.assertEqual(models.Category.objects.using('shard_1').count(), 2)
@@ -0,0 +1,131 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from core import singleflight
+
+
+class GroupTests(SimpleTestCase):
+
+    def setUp(self):
+        self.group = singleflight.Group(timeout=5)
+        self.release = threading.Event()
+        self.calls = []
+
+    def _slow(self, result='result'):
+        def function():
+            self.calls.append(threading.get_ident())
+            self.release.wait(5)
+            return result
+        return function
+
+    def _run(self, count, function, key='key'):
+        """Call the group from count threads, return their results"""
+        results = [None] * count
+
+        def target(index):
+            results[index] = self.group.do(key, function)
+
+        threads = [threading.Thread(target=target, args=(index,))
+                   for index in range(count)]
+        for thread in threads:
+            thread.start()
+        while not self.calls:
+            time.sleep(0.01)
+        time.sleep(0.1)  # the others come and wait for the first call
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_identical_calls_coalesced(self):
+        """Test concurrent calls with a key share a single run"""
+        results = self._run(8, self._slow())
+
+        self.assertEqual(results, ['result'] * 8)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.group.counts['leaders'], 1)
+        self.assertEqual(self.group.counts['coalesced'], 7)
+        self.assertEqual(self.group.coalesced_ratio(), 7 / 8)
+        self.assertFalse(self.group._calls)
+
+    def test_other_keys_not_coalesced(self):
+        """Test calls with different keys all run"""
+        self.release.set()
+        self.group.do('a', self._slow())
+        self.group.do('b', self._slow())
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.group.counts['coalesced'], 0)
+
+    def test_bounded_wait(self):
+        """Test a waiter gives up after the timeout and runs the call"""
+        self.group.timeout = 0.05
+        leader = threading.Thread(target=self.group.do,
+                                  args=('key', self._slow()))
+        leader.start()
+        while not self.calls:
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        result = self.group.do('key', lambda: 'own')
+        waited = time.monotonic() - started
+        self.release.set()
+        leader.join(5)
+
+        self.assertEqual(result, 'own')
+        self.assertLess(waited, 1)
+        self.assertEqual(self.group.counts['timeouts'], 1)
+
+    def test_failure_not_shared(self):
+        """Test the waiters run again when the first call raised"""
+        def failing():
+            self.calls.append(1)
+            self.release.wait(5)
+            if len(self.calls) == 1:
+                raise ValueError('first call')
+            return 'retried'
+
+        errors = []
+        leader = threading.Thread(
+            target=lambda: errors.append(self._raises(failing)))
+        leader.start()
+        while not self.calls:
+            time.sleep(0.01)
+        waiter_result = []
+        waiter = threading.Thread(
+            target=lambda: waiter_result.append(
+                self.group.do('key', failing)))
+        waiter.start()
+        time.sleep(0.05)
+        self.release.set()
+        leader.join(5)
+        waiter.join(5)
+
+        self.assertEqual(errors, [True])
+        self.assertEqual(waiter_result, ['retried'])
+        self.assertEqual(self.group.counts['failures'], 1)
+
+    def _raises(self, function):
+        try:
+            self.group.do('key', function)
+        except ValueError:
+            return True
+        return False
+
+    def test_forget(self):
+        """Test a forgotten key starts a new call"""
+        leader = threading.Thread(target=self.group.do,
+                                  args=((1, 'list'), self._slow('old')))
+        leader.start()
+        while not self.calls:
+            time.sleep(0.01)
+
+        self.group.forget(lambda key: key[0] == 1)
+        result = self.group.do((1, 'list'), lambda: 'new')
+        self.release.set()
+        leader.join(5)
+
+        self.assertEqual(result, 'new')
+        self.assertEqual(self.group.counts['coalesced'], 0)
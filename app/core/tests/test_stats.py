@@ -0,0 +1,159 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import models, sharding
+from core.db.routers import reset_shard, use_shard
+import datetime
+
+
+def sample_user(email='test@sajiazafreen.com', password='testpass'):
+    """create a sample user"""
+    return get_user_model().objects.create_user(email, password)
+
+
+def sample_painting(user, date=datetime.date(2014, 6, 11)):
+    """create a sample painting"""
+    return models.Painting.objects.create(
+        user=user,
+        title='Stormy Night',
+        painting_create_date=date
+    )
+
+
+class PaintingCounterTests(TestCase):
+    """Test the denormalized painting counters follow the paintings"""
+
+    def setUp(self):
+        self.user = sample_user()
+        self.category = models.Category.objects.create(
+            user=self.user, name='Watercolor')
+        self.supply = models.Supply.objects.create(
+            user=self.user, name='Paint Brush')
+
+    def assertCounts(self, total, category, supply):
+        self.category.refresh_from_db()
+        self.supply.refresh_from_db()
+        stats = models.UserPaintingStats.objects.get(user=self.user)
+        self.assertEqual(stats.painting_count, total)
+        self.assertEqual(self.category.painting_count, category)
+        self.assertEqual(self.supply.painting_count, supply)
+
+    def month_counts(self):
+        return dict(
+            models.MonthlyPaintingCount.objects.filter(user=self.user)
+            .values_list('month', 'painting_count')
+        )
+
+    def test_counters_follow_create_link_and_delete(self):
+        """Test creating, linking and deleting paintings updates counters"""
+        painting1 = sample_painting(self.user)
+        painting2 = sample_painting(self.user)
+        painting1.categories.add(self.category)
+        painting1.categories.add(self.category)  # already linked, no change
+        painting2.categories.add(self.category)
+        painting1.supplies.add(self.supply)
+        self.assertCounts(total=2, category=2, supply=1)
+
+        painting1.delete()
+        self.assertCounts(total=1, category=1, supply=0)
+
+    def test_counters_follow_remove_clear_and_reverse(self):
+        """Test removing links from both sides updates counters"""
+        painting1 = sample_painting(self.user)
+        painting2 = sample_painting(self.user)
+        self.category.painting_set.add(painting1, painting2)
+        self.assertCounts(total=2, category=2, supply=0)
+
+        other = models.Category.objects.create(user=self.user, name='Oil')
+        painting1.categories.remove(self.category, other)  # other not linked
+        self.assertCounts(total=2, category=1, supply=0)
+
+        self.category.painting_set.clear()
+        self.assertCounts(total=2, category=0, supply=0)
+
+    def test_month_counters_follow_date_change(self):
+        """Test changing the painting date moves it to another month"""
+        painting = sample_painting(self.user, datetime.date(2014, 6, 11))
+        sample_painting(self.user, datetime.date(2014, 6, 20))
+        painting.painting_create_date = datetime.date(2015, 1, 2)
+        painting.save()
+
+        self.assertEqual(self.month_counts(), {
+            datetime.date(2014, 6, 1): 1,
+            datetime.date(2015, 1, 1): 1,
+        })
+
+    def test_reconcile_fixes_drifted_counters(self):
+        """Test the reconcile command recomputes every counter"""
+        painting = sample_painting(self.user)
+        painting.categories.add(self.category)
+        models.Category.objects.update(painting_count=10)
+        models.UserPaintingStats.objects.all().delete()
+        models.MonthlyPaintingCount.objects.update(painting_count=0)
+        models.MonthlyPaintingCount.objects.create(
+            user=self.user, month=datetime.date(2000, 1, 1), painting_count=3)
+
+        call_command('reconcile_painting_stats', stdout=StringIO())
+
+        self.assertCounts(total=1, category=1, supply=0)
+        self.assertEqual(self.month_counts(), {
+            datetime.date(2014, 6, 1): 1,
+            datetime.date(2000, 1, 1): 0,
+        })
+
+
+@skipUnless('shard_1' in settings.DATABASES, 'needs a second database')
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+class ShardedReconcileTests(TestCase):
+    # the class is collected even when skipped
+    databases = {'default'} | {'shard_1'} & set(settings.DATABASES)
+
+    def setUp(self):
+        sharding.forget()
+        self.addCleanup(sharding.forget)
+        self.user = get_user_model().objects.create_user(
+            'shard@sajiazafreen.com', 'testpass')
+        models.ShardAssignment.objects.filter(user=self.user) \
+            .update(database='shard_1')
+        token = use_shard('shard_1')
+        self.addCleanup(reset_shard, token)
+        sample_painting(self.user)
+
+    def test_reconcile_on_the_shard_of_the_user(self):
+        """Test the counters are recomputed on the database of the user"""
+        models.UserPaintingStats.objects.using('shard_1') \
+            .update(painting_count=5)
+
+        call_command('reconcile_painting_stats', stdout=StringIO())
+
+        self.assertEqual(models.UserPaintingStats.objects.using('shard_1')
+                         .get(user=self.user).painting_count, 1)
+        self.assertFalse(models.UserPaintingStats.objects.using('default')
+                         .exists())
+
+        # only the users of another database
+        models.UserPaintingStats.objects.using('shard_1') \
+            .update(painting_count=5)
+        call_command('reconcile_painting_stats', database='default',
+                     stdout=StringIO())
+        self.assertEqual(models.UserPaintingStats.objects.using('shard_1')
+                         .get(user=self.user).painting_count, 5)
+
+    def test_skip_users_being_moved(self):
+        """Test the counters of a read only user are left alone"""
+        models.ShardAssignment.objects.filter(user=self.user) \
+            .update(read_only=True)
+        models.UserPaintingStats.objects.using('shard_1') \
+            .update(painting_count=5)
+
+        out = StringIO()
+        call_command('reconcile_painting_stats', stdout=out)
+
+        self.assertIn('Skipped 1 users being moved', out.getvalue())
+        self.assertEqual(models.UserPaintingStats.objects.using('shard_1')
+                         .get(user=self.user).painting_count, 5)
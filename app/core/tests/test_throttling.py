@@ -0,0 +1,161 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core import throttling
+
+
+RATES = {
+    'read': '3/min',
+    'write': '2/min',
+    'upload': '1/min',
+    'login': '2/min',
+}
+
+
+def throttle_settings(**rates):
+    """REST_FRAMEWORK settings with test throttle rates"""
+    from django.conf import settings
+    return override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**RATES, **rates},
+    })
+
+
+class TokenBucketTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        self.factory = APIRequestFactory()
+        self.user = get_user_model().objects.create_user(
+            'bucket@sajiazafreen.com', 'testpass')
+
+    def _allowed(self, throttle_class, method='get', user=None):
+        request = Request(getattr(self.factory, method)('/'))
+        request.user = user or self.user
+        throttle = throttle_class()
+        with patch.object(throttle, 'timer', lambda: self.now):
+            allowed = throttle.allow_request(request, None)
+        return allowed, throttle.wait()
+
+    @throttle_settings()
+    def test_burst_then_refill(self):
+        """Test a full bucket allows a burst, then one token per period"""
+        results = [self._allowed(throttling.ReadThrottle)[0]
+                   for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+        allowed, wait = self._allowed(throttling.ReadThrottle)
+        self.assertAlmostEqual(wait, 20)  # 3 tokens a minute
+
+        self.now += 20
+        self.assertEqual(self._allowed(throttling.ReadThrottle), (True, None))
+        self.assertFalse(self._allowed(throttling.ReadThrottle)[0])
+
+    @throttle_settings()
+    def test_scopes_and_clients_separate(self):
+        """Test reads, writes and every client have their own bucket"""
+        for _ in range(2):
+            self._allowed(throttling.WriteThrottle, 'post')
+        self.assertFalse(self._allowed(throttling.WriteThrottle, 'post')[0])
+        # reads are not counted by the write throttle and the other way
+        self.assertTrue(self._allowed(throttling.WriteThrottle, 'get')[0])
+        self.assertTrue(self._allowed(throttling.ReadThrottle)[0])
+        self.assertTrue(self._allowed(throttling.WriteThrottle, 'post',
+                                      AnonymousUser())[0])
+
+    @throttle_settings(upload='10/min')
+    def test_batch_costs_a_token_per_file(self):
+        """Test a batch upload takes as many tokens as it has files"""
+        throttle = throttling.BatchUploadThrottle()
+        request = Request(self.factory.post('/'))
+        request.user = self.user
+        with patch.object(throttle, 'timer', lambda: self.now), \
+                patch.object(throttle, 'get_cost', lambda r, v: 8):
+            self.assertTrue(throttle.allow_request(request, None))
+            self.assertFalse(throttle.allow_request(request, None))
+            self.assertAlmostEqual(throttle.wait(), 36)  # 6 tokens missing
+        # a batch bigger than the bucket waits for a full bucket
+        with patch.object(throttle, 'timer', lambda: self.now + 60), \
+                patch.object(throttle, 'get_cost', lambda r, v: 50):
+            self.assertTrue(throttle.allow_request(request, None))
+
+    @throttle_settings(read=None)
+    def test_no_rate_no_throttle(self):
+        """Test a scope without rate is not throttled"""
+        for _ in range(10):
+            self.assertTrue(self._allowed(throttling.ReadThrottle)[0])
+
+    def test_parse_rate(self):
+        """Test the rate strings of DRF are understood"""
+        self.assertEqual(throttling.TokenBucketThrottle.parse_rate('100/min'),
+                         (100, 60))
+        self.assertEqual(throttling.TokenBucketThrottle.parse_rate('5/s'),
+                         (5, 1))
+
+
+class ThrottledApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    @throttle_settings()
+    def test_login_throttled_with_retry_after(self):
+        """Test token requests get a 429 with Retry-After once over budget"""
+        url = reverse('user:token')
+        payload = {'email': 'nobody@sajiazafreen.com', 'password': 'wrong'}
+        for _ in range(2):
+            res = self.client.post(url, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(url, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '30')
+
+    @throttle_settings()
+    def test_login_throttle_ignores_forged_forwarded_for(self):
+        """Test a client can't get a new budget by faking its address"""
+        url = reverse('user:token')
+        payload = {'email': 'nobody@sajiazafreen.com', 'password': 'wrong'}
+
+        codes = [self.client.post(url, payload,
+                                  HTTP_X_FORWARDED_FOR=f'10.0.0.{i}')
+                 .status_code for i in range(3)]
+
+        self.assertEqual(codes[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_login_throttle_behind_a_proxy(self):
+        """Test the address appended by the proxy is the one throttled"""
+        factory = APIRequestFactory()
+        throttle = throttling.LoginThrottle(rate='2/min')
+        request = Request(factory.post(
+            '/', HTTP_X_FORWARDED_FOR='10.0.0.1, 192.0.2.7'))
+        from django.conf import settings
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                               'NUM_PROXIES': 1}):
+            key = throttle.get_cache_key(request, None)
+
+        self.assertEqual(key, 'throttle:login:192.0.2.7')
+
+    @throttle_settings()
+    def test_painting_reads_throttled_per_user(self):
+        """Test the list endpoint is limited by the read budget"""
+        user = get_user_model().objects.create_user(
+            'reader@sajiazafreen.com', 'testpass')
+        self.client.force_authenticate(user)
+        url = reverse('painting:painting-list')
+
+        codes = [self.client.get(url).status_code for _ in range(4)]
+
+        self.assertEqual(codes, [200, 200, 200, 429])
@@ -0,0 +1,110 @@
+"""Token bucket throttles of the API, see THROTTLE_CACHE"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Allow bursts of `rate` requests, refilled continuously over the period
+
+    Unlike the fixed window throttles of DRF, which store the time of every
+    request, a bucket is two numbers per client: the tokens left and when
+    they were counted. The rate of a scope is read from
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], e.g. '100/min'.
+
+    The bucket is read and written back without a lock, concurrent requests
+    of one client may be let through a few too many times.
+    """
+    scope = None
+    methods = None  # the HTTP methods throttled, None for all of them
+    timer = time.time
+    durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self, rate=None):
+        self.rate = rate or api_settings.DEFAULT_THROTTLE_RATES.get(
+            self.scope)
+        self.wait_seconds = None
+        if self.rate:
+            self.capacity, self.period = self.parse_rate(self.rate)
+            self.refill = self.capacity / self.period  # tokens per second
+
+    @classmethod
+    def parse_rate(cls, rate):
+        """Return (requests, seconds) of a rate like '100/min'"""
+        requests, period = rate.split('/')
+        return int(requests), cls.durations[period[0]]
+
+    @property
+    def cache(self):
+        return caches[settings.THROTTLE_CACHE]
+
+    def get_cache_key(self, request, view):
+        """Throttle the authenticated users by id, the others by address"""
+        if request.user and request.user.is_authenticated:
+            ident = f'user-{request.user.pk}'
+        else:
+            ident = self.get_ident(request)
+        return f'throttle:{self.scope}:{ident}'
+
+    def get_cost(self, request, view):
+        """Return the number of tokens a request takes"""
+        return 1
+
+    def allow_request(self, request, view):
+        if not self.rate:
+            return True
+        if self.methods is not None and request.method not in self.methods:
+            return True
+
+        key = self.get_cache_key(request, view)
+        # a request bigger than the bucket would never be let through
+        cost = min(self.get_cost(request, view), self.capacity)
+        now = self.timer()
+        tokens, counted_at = self.cache.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - counted_at) * self.refill)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        else:
+            self.wait_seconds = (cost - tokens) / self.refill
+        # a bucket untouched for a period is full again, no need to keep it
+        self.cache.set(key, (tokens, now), self.period)
+        return allowed
+
+    def wait(self):
+        """Seconds until a token is back, sent in the Retry-After header"""
+        return self.wait_seconds
+
+
+class ReadThrottle(TokenBucketThrottle):
+    scope = 'read'
+    methods = SAFE_METHODS
+
+
+class WriteThrottle(TokenBucketThrottle):
+    scope = 'write'
+    methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class UploadThrottle(TokenBucketThrottle):
+    """Image uploads, their own budget as each one decodes an image"""
+    scope = 'upload'
+
+
+class BatchUploadThrottle(UploadThrottle):
+    """Image uploads of many paintings at once, a token per image"""
+
+    def get_cost(self, request, view):
+        return max(1, len(request.FILES))
+
+
+class LoginThrottle(TokenBucketThrottle):
+    """Token requests, limited by address against password guessing"""
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
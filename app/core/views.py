@@ -0,0 +1,176 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, \
+                        StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, \
+                              patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from core import renditions
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _parse_range(header, size):
+    """Return the (start, end) of a single byte range, None if unusable"""
+    # several ranges are valid HTTP but browsers and video players never ask
+    # for them, the whole file is an acceptable answer to those
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':  # bytes=-500 is the last 500 bytes
+        return max(size - int(last), 0), size - 1
+    end = min(int(last), size - 1) if last else size - 1
+    return int(first), end
+
+
+def _range_content(path, start, length):
+    """Yield the bytes of a part of a file"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _cache_control(name):
+    """Return the Cache-Control header of a media file"""
+    # uploads get a new uuid file name every time, their content never
+    # changes thus clients and proxies may keep them as long as they want
+    for prefix in settings.MEDIA_IMMUTABLE_PREFIXES:
+        if name.startswith(prefix):
+            return 'public, max-age=31536000, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+def file_response(request, path, name):
+    """Serve a file of the media root, name is its path inside of it"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404('File does not exist')
+    if not os.path.isfile(path):
+        raise Http404('File does not exist')
+
+    etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': _cache_control(name),
+        'Accept-Ranges': 'bytes',
+    }
+
+    # answers If-None-Match and If-Modified-Since with a 304
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    sendfile = settings.MEDIA_SENDFILE
+    if sendfile:
+        # the front server sends the bytes, ranges included, the worker is
+        # free as soon as the headers are out
+        response = HttpResponse(content_type=content_type)
+        if sendfile == 'x-accel-redirect':
+            # nginx decodes the URI, a name with a space, '?', '%' or
+            # non ASCII letters is only found once quoted
+            response['X-Accel-Redirect'] = \
+                settings.MEDIA_ACCEL_REDIRECT_URL + quote(name)
+        else:
+            response['X-Sendfile'] = path
+    else:
+        response = _content_response(request, path, stat.st_size, etag,
+                                     last_modified, content_type)
+
+    for header, value in headers.items():
+        response[header] = value
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def _content_response(request, path, size, etag, last_modified,
+                      content_type):
+    """Return the bytes of a file, or the requested range of them"""
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        byte_range = _parse_range(request.META['HTTP_RANGE'], size)
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range and if_range != etag and \
+                parse_http_date_safe(if_range) != last_modified:
+            byte_range = None  # the file changed, send all of it
+
+    if byte_range is not None:
+        start, end = byte_range
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            [] if request.method == 'HEAD' else
+            _range_content(path, start, length),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+        return response
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(size)
+        return response
+    # FileResponse lets the WSGI server use its file wrapper (sendfile)
+    return FileResponse(open(path, 'rb'), content_type=content_type)
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve an uploaded media file"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('File does not exist')
+    if not _negotiable(path):
+        return file_response(request, full_path, path)
+
+    # a WebP or AVIF copy of the upload for the clients accepting it,
+    # often a fraction of the bytes of the JPEG or PNG uploaded
+    image_format = renditions.accepted_format(
+        request.META.get('HTTP_ACCEPT', ''))
+    found = os.path.isfile(full_path) and image_format and \
+        renditions.variant(path, image_format)
+    if found:
+        full_path, path = found
+    response = file_response(request, full_path, path)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _negotiable(name):
+    """Return whether a media file is served in the accepted format"""
+    # the variants are never rendered again, only the uploads never change
+    return name.lower().endswith(renditions.VARIANT_SOURCES) and any(
+        name.startswith(prefix)
+        for prefix in settings.MEDIA_IMMUTABLE_PREFIXES
+    )
@@ -0,0 +1,190 @@
+"""ZIP backup of the paintings of a user, streamed while it is written
+
+Nothing is written to disk nor kept in memory: the rows are read by
+batches and every piece of the archive written by zipfile is sent to the
+client straight away. The images are stored as they are, JPEG, PNG and
+WebP don't compress any further; the metadata is deflated.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from core.models import Category, Painting, Supply
+
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 500
+COLUMNS = ('id', 'title', 'painting_create_date', 'link_to_instragram',
+           'categories', 'supplies', 'image', 'image_width', 'image_height',
+           'image_size', 'image_format', 'image_dominant_color',
+           'image_phash', 'image_original_size')
+
+
+class _Output(io.RawIOBase):
+    """Write only stream keeping the bytes until they are sent"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+    # not seekable: zipfile writes the sizes and CRC of an entry after its
+    # data instead of going back to the header
+
+
+def image_path(row):
+    """Return the path of the image of a painting inside of the archive"""
+    extension = os.path.splitext(row['image'])[1].lower()
+    return f'images/{row["id"]}{extension}'
+
+
+def painting_batches(user, using='default'):
+    """Yield the paintings of a user by batches of rows"""
+    through = {'categories': Painting.categories.through,
+               'supplies': Painting.supplies.through}
+    paintings = Painting.objects.using(using) \
+        .filter(user=user, deleted_at__isnull=True).order_by('id')
+    fields = [name for name in COLUMNS if name not in through] + \
+        ['updated_at']
+    last_id = 0
+    while True:
+        # keyset pagination, each batch is an index range scan
+        rows = list(paintings.filter(id__gt=last_id)
+                    .values(*fields)[:BATCH_SIZE])
+        if not rows:
+            return
+        by_id = {row['id']: row for row in rows}
+        for name, model in through.items():
+            column = model._meta.get_field(
+                'category' if name == 'categories' else 'supply').attname
+            for row in rows:
+                row[name] = []
+            links = model.objects.using(using) \
+                .filter(painting_id__in=by_id) \
+                .values_list('painting_id', column).order_by(column)
+            for painting_id, related_id in links:
+                by_id[painting_id][name].append(related_id)
+        yield rows
+        last_id = rows[-1]['id']
+
+
+def _paintings_json(user, using):
+    yield b'['
+    separator = b'\n'
+    for rows in painting_batches(user, using):
+        data = []
+        for row in rows:
+            row = {name: row[name] for name in COLUMNS}
+            if row['image']:
+                row['image'] = image_path(row)
+            data.append(separator +
+                        json.dumps(row, cls=DjangoJSONEncoder).encode())
+            separator = b',\n'
+        yield b''.join(data)
+    yield b'\n]\n'
+
+
+def _paintings_csv(user, using):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(COLUMNS)
+    for rows in painting_batches(user, using):
+        for row in rows:
+            writer.writerow([
+                image_path(row) if name == 'image' and row['image'] else
+                ' '.join(map(str, row[name]))
+                if name in ('categories', 'supplies') else
+                row[name] for name in COLUMNS
+            ])
+        yield text.getvalue().encode()
+        text.seek(0)
+        text.truncate()
+    yield text.getvalue().encode()
+
+
+def _attrs_json(model, user, using):
+    rows = model.objects.using(using).filter(user=user) \
+        .order_by('id').values('id', 'name')
+    yield b'['
+    separator = b'\n'
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        yield separator + json.dumps(row).encode()
+        separator = b',\n'
+    yield b'\n]\n'
+
+
+def _file_chunks(name):
+    with default_storage.open(name, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _entry(archive, output, info, chunks):
+    """Write an entry in the archive, yield the bytes as they come"""
+    with archive.open(info, 'w') as entry:
+        for chunk in chunks:
+            entry.write(chunk)
+            data = output.drain()
+            if data:
+                yield data
+    yield output.drain()
+
+
+def _info(name, compress, modified=None, size=None):
+    date = timezone.localtime(modified or timezone.now())
+    info = zipfile.ZipInfo(name, date.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress \
+        else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    if size is not None:
+        # zipfile picks the ZIP64 headers of big files from the size
+        info.file_size = size
+    return info
+
+
+def stream(user, using='default'):
+    """Yield the bytes of a ZIP archive of the paintings of a user"""
+    output = _Output()
+    with zipfile.ZipFile(output, 'w') as archive:
+        metadata = (
+            ('paintings.json', _paintings_json(user, using)),
+            ('paintings.csv', _paintings_csv(user, using)),
+            ('categories.json', _attrs_json(Category, user, using)),
+            ('supplies.json', _attrs_json(Supply, user, using)),
+        )
+        for name, chunks in metadata:
+            yield from _entry(archive, output, _info(name, True), chunks)
+
+        for rows in painting_batches(user, using):
+            for row in rows:
+                if not row['image']:
+                    continue
+                try:
+                    size = default_storage.size(row['image'])
+                except OSError:  # the file is gone, the row is kept
+                    continue
+                info = _info(image_path(row), False, row['updated_at'], size)
+                yield from _entry(archive, output, info,
+                                  _file_chunks(row['image']))
+    # the central directory, written when the archive is closed
+    yield output.drain()
@@ -1,6 +1,9 @@
+from django.db import router, transaction
+from django.db.models.functions import Lower
 from rest_framework import serializers, fields
 
-from core.models import Category, Supply, Painting
+from core.models import Category, Supply, Painting, MonthlyPaintingCount
+from core import dedup, imaging, jobs
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -21,18 +24,59 @@ class SupplySerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)  # the id will be read only field
 
 
+# read only image metadata filled in at upload, see core/imaging.py
+IMAGE_METADATA_FIELDS = ('image_width', 'image_height', 'image_size',
+                         'image_format', 'image_dominant_color',
+                         'image_phash', 'image_original_size')
+
+
+class NameOrPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Related field accepting the id or the name of a user's object
+
+    Strings made of digits are ids. The field only parses the values,
+    PaintingSerializer checks the ids and creates the new names in bulk
+    instead of one query per value.
+    """
+    default_error_messages = {
+        **serializers.PrimaryKeyRelatedField.default_error_messages,
+        'invalid_name': 'Names are 1 to {max_length} characters long.',
+    }
+    max_length = 255  # of the name column
+
+    def get_queryset(self):
+        """Only the objects of the authenticated user can be linked"""
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is not None:
+            queryset = queryset.filter(user=request.user)
+        return queryset
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (int, str)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        # isdigit() would take '²' too, which int() refuses
+        if isinstance(data, int) or data.isdecimal():
+            return int(data)
+        name = data.strip()
+        if not name or len(name) > self.max_length:
+            self.fail('invalid_name', max_length=self.max_length)
+        return name
+
+
 class PaintingSerializer(serializers.ModelSerializer):
     """Serializer for Painting objects"""
     painting_create_date = fields.DateField(input_formats=['%Y-%m-%d'])
     # we need to define primary key related fields within the fields
     # as category and supplies are not part of the serializer they are
     # refering to category and supply models
-    categories = serializers.PrimaryKeyRelatedField(  # this will only include
+    # ids or names, the names that don't exist yet are created, thus a
+    # client needs a single request for a painting with new tags
+    categories = NameOrPrimaryKeyRelatedField(  # this will only include
         # the primary key (id) not the whole object
         many=True,
         queryset=Category.objects.all()
     )
-    supplies = serializers.PrimaryKeyRelatedField(
+    supplies = NameOrPrimaryKeyRelatedField(
         many=True,
         queryset=Supply.objects.all()
     )
@@ -40,8 +84,76 @@ class PaintingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Painting
         fields = ('id', 'title', 'painting_create_date', 'link_to_instragram',
-                  'categories', 'supplies')
-        read_only_fields = ('id',)  # the id will be read only field
+                  'categories', 'supplies') + IMAGE_METADATA_FIELDS
+        read_only_fields = ('id',) + IMAGE_METADATA_FIELDS
+
+    def validate(self, attrs):
+        """Check every given id in one query per field"""
+        for name in ('categories', 'supplies'):
+            values = attrs.get(name)
+            if not values:
+                continue
+            field = self.fields[name].child_relation
+            ids = {value for value in values if isinstance(value, int)}
+            found = field.get_queryset().in_bulk(ids)
+            missing = ids - set(found)
+            if missing:
+                raise serializers.ValidationError({name: [
+                    field.error_messages['does_not_exist'].format(pk_value=pk)
+                    for pk in sorted(missing)
+                ]})
+            attrs[name] = [found.get(value, value) for value in values]
+        return attrs
+
+    def _create_names(self, validated_data, user):
+        """Replace the names by objects, creating the missing ones"""
+        for name, model in (('categories', Category), ('supplies', Supply)):
+            values = validated_data.get(name)
+            if not values:
+                continue
+            names = {}  # lower case name: first spelling given
+            for value in values:
+                if isinstance(value, str):
+                    names.setdefault(value.lower(), value)
+            if not names:
+                continue
+
+            rows = model.objects.filter(user=user) \
+                .annotate(name_lower=Lower('name'))
+            existing = {obj.name_lower: obj for obj in
+                        rows.filter(name_lower__in=list(names))}
+            # ignore_conflicts: a concurrent request may create the same
+            # names, the unique (user, LOWER(name)) index keeps one row
+            model.objects.bulk_create(
+                [model(user=user, name=names[key])
+                 for key in names if key not in existing],
+                ignore_conflicts=True
+            )
+            # bulk_create doesn't return the ids with ignore_conflicts
+            existing.update((obj.name_lower, obj) for obj in
+                            rows.filter(name_lower__in=list(names)))
+            objects = []
+            for value in values:
+                if isinstance(value, str):
+                    # a name whose Python and SQL lower case differ
+                    obj = existing.get(value.lower()) or dedup.filter_name(
+                        model.objects.filter(user=user), value).get()
+                    objects.append(obj)
+                else:
+                    objects.append(value)
+            validated_data[name] = objects
+
+    def create(self, validated_data):
+        # the new categories and supplies are rolled back with the painting,
+        # all of them are on the database of the user
+        with transaction.atomic(using=router.db_for_write(Painting)):
+            self._create_names(validated_data, validated_data['user'])
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with transaction.atomic(using=instance._state.db):
+            self._create_names(validated_data, instance.user)
+            return super().update(instance, validated_data)
 
 
 class PaintingDetailSerializer(PaintingSerializer):
@@ -52,10 +164,72 @@ class PaintingDetailSerializer(PaintingSerializer):
     # these objects
 
 
+class SimilarPaintingSerializer(PaintingSerializer):
+    """Serialize a painting found by the similar image search"""
+    # number of different bits between the image hashes, 0 looks the same
+    distance = fields.IntegerField(read_only=True)
+
+    class Meta(PaintingSerializer.Meta):
+        fields = PaintingSerializer.Meta.fields + ('distance',)
+
+
 class PaintingImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images of the paintings"""
 
     class Meta:
         model = Painting
-        fields = ('id', 'image')
-        read_only_fields = ('id',)
+        fields = ('id', 'image') + IMAGE_METADATA_FIELDS
+        read_only_fields = ('id',) + IMAGE_METADATA_FIELDS
+
+    def validate(self, attrs):
+        """Read the metadata of the image along with its validation"""
+        # the batch upload validates the images in threads, the decoding
+        # is done there rather than in save()
+        if 'image' in attrs:
+            image = attrs['image']
+            # read once here, the file is never opened again to know them
+            attrs.update(
+                imaging.image_metadata(image) if image
+                else imaging.EMPTY_METADATA
+            )
+            attrs['image_original_size'] = None
+        return attrs
+
+    def update(self, instance, validated_data):
+        """Store the image together with its metadata"""
+        instance = super().update(instance, validated_data)
+        if validated_data.get('image'):
+            # re-encoding takes longer than the upload itself, a worker
+            # does it once the response is sent
+            jobs.enqueue('painting.tasks.optimize_image',
+                         args=(instance.id, instance.image.name),
+                         kwargs={'user_id': instance.user_id})
+        return instance
+
+
+class CategoryStatsSerializer(serializers.ModelSerializer):
+    """Serializer for the painting count of a category"""
+
+    class Meta:
+        model = Category
+        fields = ('id', 'name', 'painting_count')
+        read_only_fields = fields
+
+
+class SupplyStatsSerializer(serializers.ModelSerializer):
+    """Serializer for the painting count of a supply"""
+
+    class Meta:
+        model = Supply
+        fields = ('id', 'name', 'painting_count')
+        read_only_fields = fields
+
+
+class MonthlyPaintingCountSerializer(serializers.ModelSerializer):
+    """Serializer for the number of paintings created in a month"""
+    month = fields.DateField(format='%Y-%m', read_only=True)
+
+    class Meta:
+        model = MonthlyPaintingCount
+        fields = ('month', 'painting_count')
+        read_only_fields = fields
@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from core.models import Painting, UserPaintingStats
+
+
+def _distance(hash1, hash2):
+    """Number of different bits of two integer hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree of 64 bit image hashes
+
+    Every child of a node is at a different Hamming distance from it, thus a
+    search only follows the children whose distance can still be within the
+    requested one instead of comparing the hash with every image.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, [painting ids], {distance: child node}]
+        self.size = 0
+
+    def add(self, value, item):
+        """Add an item whose image has the integer hash value"""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = _distance(value, node[0])
+            if distance == 0:  # identical hash, same node
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return the (distance, item) pairs within max_distance of value"""
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = _distance(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            # triangle inequality: only the children at a distance in
+            # [distance - max_distance, distance + max_distance] can match
+            for child_distance, child in node[2].items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        return found
+
+
+# user id: (version, tree), the least recently used trees are dropped
+_trees = OrderedDict()
+_trees_lock = threading.Lock()
+
+
+def _hashed(user_id):
+    return Painting.objects \
+        .filter(user_id=user_id, deleted_at__isnull=True) \
+        .exclude(image_phash='')
+
+
+def _version(user_id):
+    """Return the version of the image hashes of a user, None if unknown
+
+    Kept in the database, every worker process and the jobs see the same
+    one; core.stats.image_hashes_changed bumps it.
+    """
+    return UserPaintingStats.objects.filter(user_id=user_id) \
+        .values_list('image_hashes_version', flat=True).first()
+
+
+def build_tree(user_id):
+    """Build the tree of all the image hashes of a user"""
+    tree = BKTree()
+    hashes = _hashed(user_id).values_list('id', 'image_phash')
+    for painting_id, image_hash in hashes.iterator():
+        tree.add(int(image_hash, 16), painting_id)
+    return tree
+
+
+def get_tree(user_id):
+    """Return the up to date tree of a user, building it if needed"""
+    version = _version(user_id)
+    with _trees_lock:
+        entry = _trees.get(user_id)
+        if entry is not None and version is not None and \
+                entry[0] == version:
+            _trees.move_to_end(user_id)
+            return entry[1]
+
+    # built outside of the lock, other users' searches don't have to wait
+    tree = build_tree(user_id)
+    with _trees_lock:
+        _trees[user_id] = (version, tree)
+        _trees.move_to_end(user_id)
+        while len(_trees) > settings.SIMILARITY_MAX_TREES:
+            _trees.popitem(last=False)
+    return tree
+
+
+def find_similar(painting, max_distance, limit):
+    """Return (distance, painting) of the images looking like a painting's"""
+    value = int(painting.image_phash, 16)
+    matches = {
+        painting_id: distance for distance, painting_id
+        in get_tree(painting.user_id).search(value, max_distance)
+        if painting_id != painting.id
+    }
+    if not matches:
+        return []
+    candidates = Painting.objects.filter(user_id=painting.user_id,
+                                         id__in=matches,
+                                         deleted_at__isnull=True) \
+        .exclude(image_phash='').prefetch_related('categories', 'supplies')
+    found = []
+    for candidate in candidates:
+        # the distance of the stored hash, the tree may have an old one
+        distance = _distance(value, int(candidate.image_phash, 16))
+        if distance <= max_distance:
+            found.append((distance, candidate))
+    found.sort(key=lambda match: (match[0], match[1].id))
+    return found[:limit]
@@ -0,0 +1,64 @@
+"""Changes of a user's catalogue since a cursor, for the sync endpoint"""
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from core.models import Category, Supply, Painting, SyncTombstone
+
+
+CURSOR_SALT = 'painting.sync'
+
+
+def make_cursor(moment):
+    """Return the opaque cursor of a sync made at a moment"""
+    # signed, thus clients can't ask for the changes of any time they like
+    # and the format can change without breaking them
+    start = moment - datetime.timedelta(seconds=settings.SYNC_CURSOR_OVERLAP)
+    return signing.dumps(start.timestamp(), salt=CURSOR_SALT)
+
+
+def read_cursor(cursor):
+    """Return the moment of a cursor, None if it is too old to be used
+
+    Raise signing.BadSignature for a cursor that wasn't issued here.
+    """
+    since = datetime.datetime.fromtimestamp(
+        signing.loads(cursor, salt=CURSOR_SALT), tz=datetime.timezone.utc)
+    max_age = datetime.timedelta(seconds=settings.SYNC_CURSOR_MAX_AGE)
+    if since < timezone.now() - max_age:
+        return None  # its tombstones may have been purged
+    return since
+
+
+def changes(user, since):
+    """Return {kind: (changed rows, deleted ids)} since a moment
+
+    Without a moment every row of the user is returned.
+    """
+    result = {}
+    for kind, model, queryset in (
+            (SyncTombstone.PAINTING, Painting,
+             Painting.objects.prefetch_related('categories', 'supplies')),
+            (SyncTombstone.CATEGORY, Category, Category.objects.all()),
+            (SyncTombstone.SUPPLY, Supply, Supply.objects.all())):
+        rows = queryset.filter(user=user)
+        deleted = []
+        if since is not None:
+            # (user_id, updated_at) indexes
+            rows = rows.filter(updated_at__gt=since)
+            deleted = list(
+                SyncTombstone.objects
+                .filter(user=user, kind=kind, deleted_at__gt=since)
+                .values_list('object_id', flat=True)
+            )
+        changed = []
+        for row in rows.order_by('id'):
+            # soft deleted paintings are tombstones until they are purged
+            if getattr(row, 'deleted_at', None) is not None:
+                deleted.append(row.id)
+            else:
+                changed.append(row)
+        result[kind] = (changed, sorted(set(deleted)))
+    return result
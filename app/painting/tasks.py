@@ -0,0 +1,51 @@
+"""Jobs of the painting API, queued with core.jobs"""
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from core import deletion, imaging, jobs, sharding, stats
+from core.models import Painting, painting_image_file_path
+
+
+def optimize_image(painting_id, name, user_id=None):
+    """Replace an uploaded image by a smaller copy without metadata"""
+    using, read_only = sharding.assignment(user_id) if user_id \
+        else ('default', False)
+    if read_only:
+        # the job runs again later, once the rows are on the new database
+        raise sharding.ShardError('The paintings are being moved.')
+    paintings = Painting.objects.using(using)
+    painting = paintings.filter(
+        id=painting_id, image=name, deleted_at__isnull=True).first()
+    if painting is None:  # replaced or deleted since the upload
+        return
+    with default_storage.open(name) as file:
+        original_size = file.size
+        data = imaging.optimize(file)
+    if data is None:
+        paintings.filter(id=painting_id, image=name) \
+            .update(image_original_size=original_size)
+        return
+
+    # a new file name, the uploads are cached as immutable by the clients
+    new_name = default_storage.save(
+        painting_image_file_path(painting, name), ContentFile(data))
+    metadata = imaging.image_metadata(ContentFile(data))
+    with transaction.atomic(using=using):
+        # unless the image was replaced while the job ran
+        updated = paintings.filter(id=painting_id, image=name).update(
+            image=new_name, image_original_size=original_size,
+            updated_at=timezone.now(), **metadata
+        )
+        if updated and metadata['image_phash'] != painting.image_phash:
+            stats.image_hashes_changed(painting.user_id, using)
+        if not updated:  # never served
+            transaction.on_commit(lambda: deletion.delete_files([new_name]),
+                                  using=using)
+    if updated:
+        # the clients and caches holding the old URL still get the image
+        # until they learn the new one from the API or a sync
+        jobs.enqueue(deletion.delete_files, args=([name],),
+                     delay=settings.REPLACED_IMAGE_GRACE)
@@ -0,0 +1,130 @@
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+import zipfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Category, Painting, Supply
+
+from painting import backup
+
+
+ARCHIVE_URL = reverse('painting:painting-archive')
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BackupTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'backup@sajiazafreen.com', 'testpass')
+        self.client.force_authenticate(self.user)
+        os.makedirs(os.path.join(MEDIA_ROOT, 'uploads/recipe'),
+                    exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT)
+
+    def _paintings(self, count, image_size=0):
+        """Create paintings, with an image file of image_size bytes"""
+        paintings = []
+        for i in range(count):
+            name = ''
+            if image_size:
+                name = f'uploads/recipe/{i}.jpg'
+                with open(os.path.join(MEDIA_ROOT, name), 'wb') as f:
+                    f.write(os.urandom(image_size))
+            paintings.append(Painting.objects.create(
+                user=self.user, title=f'Painting {i}', image=name,
+                painting_create_date=datetime.date(2020, 1, 1)))
+        return paintings
+
+    def test_archive(self):
+        """Test the archive has the metadata and the images"""
+        oil = Category.objects.create(user=self.user, name='Oil')
+        brush = Supply.objects.create(user=self.user, name='Brush')
+        painting, no_image = self._paintings(2, image_size=1000)
+        painting.categories.add(oil)
+        painting.supplies.add(brush)
+        no_image.image = ''
+        no_image.save()
+        other = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        Painting.objects.create(user=other, title='Not mine',
+                                painting_create_date=datetime.date.today())
+
+        res = self.client.get(ARCHIVE_URL, HTTP_ACCEPT='application/zip')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/zip')
+        self.assertIn('paintings.zip', res['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        rows = json.loads(archive.read('paintings.json'))
+        self.assertEqual([row['title'] for row in rows],
+                         ['Painting 0', 'Painting 1'])
+        self.assertEqual(rows[0]['categories'], [oil.id])
+        self.assertEqual(rows[0]['supplies'], [brush.id])
+        self.assertEqual(rows[0]['image'], f'images/{painting.id}.jpg')
+        self.assertEqual(rows[1]['image'], '')
+        self.assertEqual(
+            archive.read(rows[0]['image']),
+            open(os.path.join(MEDIA_ROOT, 'uploads/recipe/0.jpg'),
+                 'rb').read())
+        self.assertEqual(archive.getinfo(rows[0]['image']).compress_type,
+                         zipfile.ZIP_STORED)
+        lines = list(csv.reader(
+            io.StringIO(archive.read('paintings.csv').decode())))
+        self.assertEqual(lines[0], list(backup.COLUMNS))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(archive.read('categories.json')),
+                         [{'id': oil.id, 'name': 'Oil'}])
+        self.assertEqual(json.loads(archive.read('supplies.json')),
+                         [{'id': brush.id, 'name': 'Brush'}])
+
+    def test_missing_image_file(self):
+        """Test a painting whose file is gone is archived without it"""
+        painting, = self._paintings(1, image_size=10)
+        os.remove(painting.image.path)
+
+        data = b''.join(backup.stream(self.user))
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(archive.namelist(),
+                         ['paintings.json', 'paintings.csv',
+                          'categories.json', 'supplies.json'])
+
+    def test_constant_memory(self):
+        """Test a big archive is never held in memory"""
+        image_size = 256 * 1024
+        count = 100
+        self._paintings(count, image_size=image_size)
+        total = 0
+
+        tracemalloc.start()
+        try:
+            # several batches of rows
+            with mock.patch.object(backup, 'BATCH_SIZE', 30):
+                for chunk in backup.stream(self.user):
+                    total += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertGreater(total, count * image_size)
+        # a few chunks and batches of rows, not the 25MB of images
+        self.assertLess(peak, 2 * 1024 * 1024)
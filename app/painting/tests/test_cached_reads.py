@@ -0,0 +1,134 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import caching
+from core.models import Category
+
+
+CATEGORIES_URL = reverse('painting:category-list')
+PAINTINGS_URL = reverse('painting:painting-list')
+STATS_URL = reverse('painting:stats')
+ME_URL = reverse('user:me')
+
+
+class CachedReadsTests(TestCase):
+    """Test the users, lists and stats served by core.caching"""
+
+    def setUp(self):
+        cache.clear()
+        caching.tiered.clear_local()
+        caching.tiered.counts.clear()
+        self.user = get_user_model().objects.create_user(
+            'cached@sajiazafreen.com', 'testpass123', name='Cached')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        # the real token authentication, not force_authenticate
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_hot_list_without_query(self):
+        """Test a list read again costs no query, token and user included"""
+        Category.objects.create(user=self.user, name='Oil')
+        self.client.get(CATEGORIES_URL)
+
+        with self.assertNumQueries(0):
+            for _ in range(20):
+                res = self.client.get(CATEGORIES_URL)
+
+        self.assertEqual([row['name'] for row in res.data], ['Oil'])
+        self.assertGreater(caching.tiered.hit_ratios()['local'], 0.9)
+
+    def test_list_after_changes(self):
+        """Test the API and the ORM writes are seen by the next read"""
+        self.client.get(CATEGORIES_URL)
+
+        self.client.post(CATEGORIES_URL, {'name': 'Acrylic'})
+        res = self.client.get(CATEGORIES_URL)
+        self.assertEqual([row['name'] for row in res.data], ['Acrylic'])
+
+        Category.objects.create(user=self.user, name='Watercolor')
+        res = self.client.get(CATEGORIES_URL)
+        self.assertEqual([row['name'] for row in res.data],
+                         ['Watercolor', 'Acrylic'])
+
+    def test_assigned_only_after_link(self):
+        """Test linking a painting changes the assigned only list"""
+        oil = Category.objects.create(user=self.user, name='Oil')
+        res = self.client.get(CATEGORIES_URL, {'assigned_only': 1})
+        self.assertEqual(res.data, [])
+
+        self.client.post(PAINTINGS_URL, {
+            'title': 'Linked', 'painting_create_date': '2020-01-01',
+            'categories': [oil.id], 'supplies': [],
+        })
+        res = self.client.get(CATEGORIES_URL, {'assigned_only': 1})
+
+        self.assertEqual([row['id'] for row in res.data], [oil.id])
+
+    def test_stats_after_delete(self):
+        """Test the cached stats follow a soft deleted painting"""
+        res = self.client.post(PAINTINGS_URL, {
+            'title': 'Deleted', 'painting_create_date': '2020-01-01',
+        })
+        self.assertEqual(
+            self.client.get(STATS_URL).data['total_paintings'], 1)
+
+        self.client.delete(reverse('painting:painting-detail',
+                                   args=[res.data['id']]))
+
+        self.assertEqual(
+            self.client.get(STATS_URL).data['total_paintings'], 0)
+
+    def test_user_changes(self):
+        """Test the cached user follows its updates"""
+        self.client.get(ME_URL)
+
+        self.client.patch(ME_URL, {'name': 'Renamed',
+                                   'password': 'newpass123'})
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['name'], 'Renamed')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('newpass123'))
+        self.assertNotIn('password', str(caching.tiered.get(
+            caching.user_key(self.user.pk)).__dict__))
+
+    def test_deleted_user_refused(self):
+        """Test a soft deleted user can't use their cached token"""
+        self.client.get(ME_URL)
+
+        self.client.delete(ME_URL)
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_refused(self):
+        """Test a deleted token stops working"""
+        self.client.get(ME_URL)
+
+        Token.objects.filter(user=self.user).get().delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_painting_create_date(self):
+        """Test the months of the cached stats follow an edited painting"""
+        res = self.client.post(PAINTINGS_URL, {
+            'title': 'Moved', 'painting_create_date': '2020-01-01',
+        })
+        self.client.get(STATS_URL)
+
+        self.client.patch(
+            reverse('painting:painting-detail', args=[res.data['id']]),
+            {'painting_create_date': datetime.date(2021, 3, 1)})
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual([row['month'] for row in res.data['months']],
+                         ['2021-03'])
@@ -130,3 +130,13 @@ class PrivateCategoriesApiTests(TestCase):
         res = self.client.get(CATEGORIES_URL, {'assigned_only': 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_create_existing_category_returns_it(self):
+        """Test creating a name that exists in another case reuses it"""
+        category = Category.objects.create(user=self.user, name='Oil')
+
+        res = self.client.post(CATEGORIES_URL, {'name': 'OIL'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'id': category.id, 'name': 'Oil'})
+        self.assertEqual(Category.objects.count(), 1)
@@ -1,19 +1,27 @@
+import io
+import shutil
 import tempfile
 import os
+from unittest import mock
 
 from PIL import Image
 
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Painting, Category, Supply
+from core.models import Painting, Category, Supply, Job
 import datetime
 
+from core import singleflight
+
+from painting import views
 from painting.serializers import PaintingSerializer, PaintingDetailSerializer
 
 
@@ -28,6 +36,14 @@ def image_upload_url(painting_id):
     return reverse('painting:painting-upload-image', args=[painting_id])
 
 
+IMAGES_UPLOAD_URL = reverse('painting:painting-upload-images')
+
+
+def image_url(painting_id):
+    """Return URL of the resized image of a painting"""
+    return reverse('painting:painting-image', args=[painting_id])
+
+
 def detail_painting_url(painting_id):
     """ return the detailed painting id"""
     return reverse('painting:painting-detail', args=[painting_id])
@@ -219,6 +235,79 @@ class PrivatePaintingsApiTests(TestCase):
         categories = painting.categories.all()
         self.assertEqual(len(categories), 0)
 
+    def test_create_painting_with_new_names(self):
+        """Test categories and supplies given by name are created"""
+        category = sample_category(user=self.user, name='Acrylic')
+        payload = {
+            'title': 'After sunset',
+            'painting_create_date': '2014-06-11',
+            'categories': [category.id, 'acrylic', 'Landscape', 'landscape'],
+            'supplies': ['Canvas', 'Brush'],
+        }
+        res = self.client.post(PAINTINGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        painting = Painting.objects.get(id=res.data['id'])
+        self.assertEqual(
+            sorted(c.name for c in painting.categories.all()),
+            ['Acrylic', 'Landscape']
+        )
+        self.assertEqual(
+            sorted(s.name for s in painting.supplies.all()),
+            ['Brush', 'Canvas']
+        )
+        self.assertEqual(Category.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(sorted(res.data['categories']),
+                         sorted(c.id for c in painting.categories.all()))
+
+    def test_create_painting_digit_like_names(self):
+        """Test names of digits that aren't numbers are names"""
+        payload = {
+            'title': 'Squared',
+            'painting_create_date': '2014-06-11',
+            'categories': ['\u00b2', '\u2460'],
+            'supplies': [],
+        }
+        res = self.client.post(PAINTINGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        painting = Painting.objects.get(id=res.data['id'])
+        self.assertEqual(sorted(c.name for c in painting.categories.all()),
+                         ['\u00b2', '\u2460'])
+
+    def test_create_painting_names_in_bulk(self):
+        """Test the queries don't grow with the number of new names"""
+        def create(names):
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.post(PAINTINGS_URL, {
+                    'title': 'Tags',
+                    'painting_create_date': '2014-06-11',
+                    'categories': names,
+                    'supplies': [],
+                }, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(context)
+
+        create(['a'])  # creates the counter rows of the user and month
+        self.assertEqual(create(['b', 'c']), create(['d', 'e', 'f', 'g']))
+
+    def test_create_painting_with_other_users_category(self):
+        """Test the ids of another user's categories are refused"""
+        user2 = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        category = sample_category(user=user2)
+        payload = {
+            'title': 'After sunset',
+            'painting_create_date': '2014-06-11',
+            'categories': [category.id, 'New category'],
+            'supplies': [],
+        }
+        res = self.client.post(PAINTINGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Painting.objects.count(), 0)
+        self.assertFalse(Category.objects.filter(user=self.user).exists())
+
 
 class PaintingImageUploadTests(TestCase):
 
@@ -302,3 +391,291 @@ class PaintingImageUploadTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+    def test_upload_image_stores_metadata(self):
+        """Test the image metadata is stored at upload"""
+        url = image_upload_url(self.painting.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            img = Image.new('RGB', (30, 20), (0, 255, 0))
+            img.save(ntf, format='PNG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.painting.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.painting.image_width, 30)
+        self.assertEqual(self.painting.image_height, 20)
+        self.assertEqual(self.painting.image_format, 'png')
+        self.assertEqual(self.painting.image_dominant_color, '#00ff00')
+        self.assertEqual(self.painting.image_size, self.painting.image.size)
+        self.assertEqual(res.data['image_phash'], self.painting.image_phash)
+
+    def test_filter_paintings_by_image_metadata(self):
+        """Test returning paintings by their stored image metadata"""
+        wide = sample_painting(user=self.user, title='Wide',
+                               image_width=2000, image_height=500,
+                               image_format='jpeg', image_phash='00ff')
+        tall = sample_painting(user=self.user, title='Tall',
+                               image_width=500, image_height=2000,
+                               image_format='png', image_phash='ff00')
+
+        by_width = self.client.get(PAINTINGS_URL, {'min_width': 1000})
+        by_height = self.client.get(PAINTINGS_URL, {'max_height': 1000})
+        by_format = self.client.get(PAINTINGS_URL, {'image_format': 'PNG'})
+        by_hash = self.client.get(PAINTINGS_URL, {'image_phash': '00FF'})
+
+        self.assertEqual([p['id'] for p in by_width.data], [wide.id])
+        self.assertEqual([p['id'] for p in by_height.data], [wide.id])
+        self.assertEqual([p['id'] for p in by_format.data], [tall.id])
+        self.assertEqual([p['id'] for p in by_hash.data], [wide.id])
+
+    def test_filter_paintings_by_invalid_width(self):
+        """Test a non numeric size filter is a bad request"""
+        res = self.client.get(PAINTINGS_URL, {'min_width': 'wide'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_SENDFILE='')
+class PaintingImageRenditionTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@sajiazafreen.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.painting = sample_painting(user=self.user)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (400, 200)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            self.client.post(image_upload_url(self.painting.id),
+                             {'image': ntf}, format='multipart')
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT)
+
+    def test_resized_image(self):
+        """Test the image is returned resized in the asked format"""
+        res = self.client.get(image_url(self.painting.id),
+                              {'w': 128, 'format': 'png'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        self.assertTrue(res['Cache-Control'].startswith('private'))
+        with tempfile.TemporaryFile() as f:
+            f.write(b''.join(res.streaming_content))
+            f.seek(0)
+            with Image.open(f) as image:
+                self.assertEqual(image.size, (128, 64))
+
+    def test_not_modified(self):
+        """Test a client with the rendition gets a 304"""
+        res = self.client.get(image_url(self.painting.id), {'w': 64})
+        again = self.client.get(image_url(self.painting.id), {'w': 64},
+                                HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_size_not_allowed(self):
+        """Test a size out of the whitelist is a bad request"""
+        res = self.client.get(image_url(self.painting.id), {'w': 100})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unreadable_image(self):
+        """Test a stored file that isn't an image is a bad request"""
+        self.painting.refresh_from_db()
+        with open(self.painting.image.path, 'wb') as f:
+            f.write(b'not an image')
+
+        res = self.client.get(image_url(self.painting.id), {'w': 64})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_no_image(self):
+        """Test a painting without image has no rendition"""
+        painting = sample_painting(user=self.user, title='Blank')
+
+        res = self.client.get(image_url(painting.id), {'w': 64})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_accepted_format(self):
+        """Test without a format the client gets the one it accepts"""
+        res = self.client.get(image_url(self.painting.id), {'w': 64},
+                              HTTP_ACCEPT='image/webp,*/*')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        self.assertIn('Accept', res['Vary'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PaintingBatchUploadTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@sajiazafreen.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def _image(self, color):
+        f = io.BytesIO()
+        Image.new('RGB', (20, 10), color).save(f, format='PNG')
+        f.seek(0)
+        f.name = 'scan.png'
+        return f
+
+    def test_upload_many_images(self):
+        """Test the images of several paintings are uploaded at once"""
+        paintings = [sample_painting(user=self.user, title=f'Scan {i}')
+                     for i in range(5)]
+
+        res = self.client.post(IMAGES_UPLOAD_URL, {
+            f'image-{painting.id}': self._image((i * 50, 0, 0))
+            for i, painting in enumerate(paintings)
+        }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['results']],
+                         [p.id for p in paintings])
+        for i, painting in enumerate(paintings):
+            painting.refresh_from_db()
+            self.assertTrue(os.path.exists(painting.image.path))
+            self.assertEqual(painting.image_dominant_color,
+                             f'#{i * 50:02x}0000')
+        self.assertEqual(Job.objects.count(), 5)
+
+    def test_results_per_file(self):
+        """Test the invalid files don't stop the valid ones"""
+        painting = sample_painting(user=self.user)
+        other_user = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        other = sample_painting(user=other_user)
+        broken = sample_painting(user=self.user, title='Broken')
+        text = io.BytesIO(b'not an image')
+        text.name = 'scan.png'
+
+        res = self.client.post(IMAGES_UPLOAD_URL, {
+            f'image-{painting.id}': self._image((0, 0, 0)),
+            f'image-{other.id}': self._image((0, 0, 0)),
+            f'image-{broken.id}': text,
+        }, format='multipart')
+
+        statuses = [r['status'] for r in res.data['results']]
+        self.assertEqual(statuses, [200, 404, 400])
+        other.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertFalse(other.image)
+        self.assertFalse(broken.image)
+
+    def test_bad_field_name(self):
+        """Test files must be named after the paintings"""
+        res = self.client.post(IMAGES_UPLOAD_URL,
+                               {'scan': self._image((0, 0, 0))},
+                               format='multipart')
+        squared = self.client.post(IMAGES_UPLOAD_URL,
+                                   {'image-\u00b2': self._image((0, 0, 0))},
+                                   format='multipart')
+        empty = self.client.post(IMAGES_UPLOAD_URL, {}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(squared.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(empty.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_one_image_per_painting(self):
+        """Test a painting given several images is refused"""
+        painting = sample_painting(user=self.user)
+
+        repeated = self.client.post(IMAGES_UPLOAD_URL, {
+            f'image-{painting.id}': [self._image((0, 0, 0)),
+                                     self._image((255, 0, 0))],
+        }, format='multipart')
+        padded = self.client.post(IMAGES_UPLOAD_URL, {
+            f'image-{painting.id}': self._image((0, 0, 0)),
+            f'image-0{painting.id}': self._image((255, 0, 0)),
+        }, format='multipart')
+
+        self.assertEqual(repeated.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(padded.status_code, status.HTTP_400_BAD_REQUEST)
+        painting.refresh_from_db()
+        self.assertFalse(painting.image)
+
+
+class PaintingListCoalescingTests(TestCase):
+    """Test identical concurrent painting lists share one computation"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'coalesce@sajiazafreen.com', 'testpass')
+        self.client.force_authenticate(self.user)
+        views.list_flights._calls.clear()
+        self.addCleanup(views.list_flights._calls.clear)
+
+    def _key(self, query=()):
+        return (self.user.pk, PAINTINGS_URL, tuple(query))
+
+    def _running(self, key, result=None):
+        """Pretend a request with this key is being computed"""
+        call = singleflight._Call()
+        if result is not None:
+            call.result = result
+            call.ok = True
+            call.done.set()
+        views.list_flights._calls[key] = call
+        return call
+
+    def test_same_params_same_key(self):
+        """Test the order of the query parameters doesn't matter"""
+        with mock.patch.object(views.list_flights, 'do',
+                               wraps=views.list_flights.do) as do:
+            self.client.get(PAINTINGS_URL, {'categories': '1',
+                                            'supplies': '2'})
+            self.client.get(f'{PAINTINGS_URL}?supplies=2&categories=1')
+
+        first, second = [call.args[0] for call in do.call_args_list]
+        self.assertEqual(first, second)
+        self.assertEqual(first, self._key((('categories', ('1',)),
+                                           ('supplies', ('2',)))))
+
+    def test_result_shared(self):
+        """Test a request waits for the identical one and answers alike"""
+        sample_painting(user=self.user)
+        self._running(self._key(), result=[{'id': 0, 'title': 'Shared'}])
+
+        with self.assertNumQueries(0):
+            res = self.client.get(PAINTINGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{'id': 0, 'title': 'Shared'}])
+
+    def test_other_user_not_shared(self):
+        """Test the lists of another user are never shared"""
+        other = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        self._running((other.pk, PAINTINGS_URL, ()), result=['not mine'])
+
+        res = self.client.get(PAINTINGS_URL)
+
+        self.assertEqual(res.data, [])
+
+    def test_write_forgets_running_lists(self):
+        """Test a list started before a write isn't shared after it"""
+        self._running(self._key())
+
+        self.client.post(PAINTINGS_URL, {
+            'title': 'New', 'painting_create_date': '2020-01-01',
+        })
+
+        self.assertNotIn(self._key(), views.list_flights._calls)
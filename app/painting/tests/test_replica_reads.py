@@ -0,0 +1,59 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from django.test import TestCase, override_settings
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+import datetime
+
+
+PAINTINGS_URL = reverse('painting:painting-list')
+CATEGORIES_URL = reverse('painting:category-list')
+
+
+# the default database stands in for the replica, what matters is whether
+# the router picks a replica for the request
+@override_settings(DATABASE_REPLICAS=['default'])
+@patch('core.db.routers.random.choice', side_effect=lambda dbs: dbs[0])
+class ReplicaReadTests(TestCase):
+    """Test which requests of the painting API read from replicas"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@sajiazafreen.com',
+            'passtestlist100'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_reads_from_replica(self, choice):
+        """Test safe requests read from a replica"""
+        res = self.client.get(PAINTINGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(choice.called)
+
+    def test_write_reads_from_primary(self, choice):
+        """Test unsafe requests never read from a replica"""
+        res = self.client.post(CATEGORIES_URL, {'name': 'Acrylic'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(choice.called)
+
+    def test_reads_stick_to_primary_after_write(self, choice):
+        """Test the user reads from the primary right after a write"""
+        self.client.post(PAINTINGS_URL, {
+            'title': 'After sunset',
+            'painting_create_date': datetime.date(2014, 6, 11)
+        })
+        self.client.get(PAINTINGS_URL)
+        self.assertFalse(choice.called)
+
+        cache.clear()  # the sticky window is over
+        self.client.get(PAINTINGS_URL)
+        self.assertTrue(choice.called)
@@ -0,0 +1,162 @@
+import random
+import tempfile
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import stats
+from core.models import Painting
+from painting import similarity
+from painting.tests.test_paintings_api import sample_painting, \
+    image_upload_url
+
+
+def similar_url(painting_id):
+    """Return the similar image search URL of a painting"""
+    return reverse('painting:painting-similar', args=[painting_id])
+
+
+class BKTreeTests(TestCase):
+
+    def test_search_matches_linear_scan(self):
+        """Test the tree finds the same hashes as comparing every hash"""
+        rng = random.Random(34)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        # a few near duplicates of the first hash
+        hashes += [hashes[0] ^ (1 << bit) for bit in (3, 17, 40)]
+        tree = similarity.BKTree()
+        for item, value in enumerate(hashes):
+            tree.add(value, item)
+
+        for max_distance in (0, 2, 8):
+            expected = sorted(
+                (similarity._distance(hashes[0], value), item)
+                for item, value in enumerate(hashes)
+                if similarity._distance(hashes[0], value) <= max_distance
+            )
+            self.assertEqual(sorted(tree.search(hashes[0], max_distance)),
+                             expected)
+        self.assertEqual(tree.size, len(hashes))
+
+    def test_identical_hashes_share_a_node(self):
+        """Test duplicates of a hash are all returned"""
+        tree = similarity.BKTree()
+        tree.add(5, 'a')
+        tree.add(5, 'b')
+
+        self.assertEqual(sorted(tree.search(5, 0)), [(0, 'a'), (0, 'b')])
+
+
+class SimilarPaintingsApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        similarity._trees.clear()
+        self.user = get_user_model().objects.create_user(
+            'similar@sajiazafreen.com',
+            'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        for painting in Painting.objects.all():
+            painting.image.delete()
+
+    def _painting(self, image_phash, **params):
+        return sample_painting(user=self.user, image_phash=image_phash,
+                               **params)
+
+    def test_similar_paintings_by_distance(self):
+        """Test paintings are listed from the closest image hash"""
+        painting = self._painting('00000000000000ff')
+        close = self._painting('00000000000000fe')
+        closer = self._painting('00000000000000ff')
+        self._painting('ffffffffffffff00')  # inverted image
+        self._painting('')  # no image
+        other_user = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        sample_painting(user=other_user, image_phash='00000000000000ff')
+
+        res = self.client.get(similar_url(painting.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([(p['id'], p['distance']) for p in res.data],
+                         [(closer.id, 0), (close.id, 1)])
+
+    def test_similar_paintings_max_distance(self):
+        """Test the max_distance and limit parameters"""
+        painting = self._painting('0000000000000000')
+        self._painting('0000000000000001')
+        self._painting('0000000000000003')
+
+        res = self.client.get(similar_url(painting.id),
+                              {'max_distance': 1})
+        self.assertEqual([p['distance'] for p in res.data], [1])
+
+        res = self.client.get(similar_url(painting.id), {'limit': 1})
+        self.assertEqual(len(res.data), 1)
+
+    def test_similar_without_image(self):
+        """Test a painting without image can't be searched for"""
+        painting = self._painting('')
+
+        res = self.client.get(similar_url(painting.id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tree_kept_until_a_hash_changes(self):
+        """Test the tree is built again only after its hashes changed"""
+        painting = self._painting('0000000000000000')
+        other = self._painting('0000000000000001')
+        self.client.get(similar_url(painting.id))  # builds the tree
+
+        # other changes of the paintings keep the tree
+        self.client.patch(reverse('painting:painting-detail',
+                                  args=[other.id]), {'title': 'Renamed'})
+        # painting, version, matches and their M2M
+        with self.assertNumQueries(5):
+            res = self.client.get(similar_url(painting.id))
+        self.assertEqual([p['id'] for p in res.data], [other.id])
+
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            white = Image.new('RGB', (10, 10), (255, 255, 255))
+            white.save(ntf, format='PNG')
+            ntf.seek(0)
+            self.client.post(image_upload_url(other.id), {'image': ntf},
+                             format='multipart')
+        other.refresh_from_db()
+        painting.image_phash = other.image_phash
+        painting.save()
+
+        # the new hash is found, the tree was built again
+        with self.assertNumQueries(6):
+            res = self.client.get(similar_url(painting.id),
+                                  {'max_distance': 0})
+        self.assertEqual([p['id'] for p in res.data], [other.id])
+
+    def test_tree_follows_other_processes(self):
+        """Test the changes made by another process are seen"""
+        painting = self._painting('0000000000000000')
+        other = self._painting('ffffffffffffffff')
+        self.client.get(similar_url(painting.id))  # builds the tree
+
+        # as the optimize_image job does
+        Painting.objects.filter(pk=other.pk).update(
+            image_phash='0000000000000000', updated_at=timezone.now())
+        stats.image_hashes_changed(self.user.id)
+        res = self.client.get(similar_url(painting.id))
+        self.assertEqual([p['id'] for p in res.data], [other.id])
+
+        self.client.delete(reverse('painting:painting-detail',
+                                   args=[other.id]))
+        res = self.client.get(similar_url(painting.id))
+        self.assertEqual(res.data, [])
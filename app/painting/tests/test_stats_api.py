@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Category, Supply, Painting
+import datetime
+
+
+STATS_URL = reverse('painting:stats')
+
+
+def sample_painting(user, date=datetime.date(1995, 1, 1)):
+    """Create and return a sample painting"""
+    return Painting.objects.create(
+        user=user, title='Sample painting', painting_create_date=date)
+
+
+class PublicStatsApiTests(TestCase):
+    """Test the publicly available stats API"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        """Test that login is required for retrieving the stats"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsApiTests(TestCase):
+    """Test the stats API for an authorized user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@sajiazafreen.com',
+            'passtestlist100'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_empty_stats(self):
+        """Test the stats of a user without paintings"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['total_paintings'], 0)
+        self.assertEqual(res.data['months'], [])
+
+    def test_retrieve_stats(self):
+        """Test the stats count the paintings of the user only"""
+        category = Category.objects.create(user=self.user, name='Acrylic')
+        supply = Supply.objects.create(user=self.user, name='Pen')
+        painting1 = sample_painting(self.user, datetime.date(2014, 6, 11))
+        painting2 = sample_painting(self.user, datetime.date(2014, 6, 20))
+        sample_painting(self.user, datetime.date(2015, 2, 1))
+        painting1.categories.add(category)
+        painting2.categories.add(category)
+        painting2.supplies.add(supply)
+        user2 = get_user_model().objects.create_user(
+            'other@sajiazafreen.com',
+            'testpass'
+        )
+        sample_painting(user2)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['total_paintings'], 3)
+        self.assertEqual(res.data['categories'], [
+            {'id': category.id, 'name': 'Acrylic', 'painting_count': 2}
+        ])
+        self.assertEqual(res.data['supplies'], [
+            {'id': supply.id, 'name': 'Pen', 'painting_count': 1}
+        ])
+        self.assertEqual(res.data['months'], [
+            {'month': '2014-06', 'painting_count': 2},
+            {'month': '2015-02', 'painting_count': 1},
+        ])
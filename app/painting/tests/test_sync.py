@@ -0,0 +1,108 @@
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import deletion
+from core.models import Category, Supply, Painting
+
+
+SYNC_URL = reverse('painting:sync')
+
+
+class SyncApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'sync@sajiazafreen.com', 'testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.oil = Category.objects.create(user=self.user, name='Oil')
+        self.painting = Painting.objects.create(
+            user=self.user, title='Painting',
+            painting_create_date=datetime.date(2020, 1, 1)
+        )
+
+    def _sync(self, cursor=None, at=None):
+        """Sync at a given time, it's the time the next cursor starts at"""
+        params = {'cursor': cursor} if cursor else {}
+        with patch('django.utils.timezone.now',
+                   return_value=at or timezone.now()):
+            res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_first_sync_is_full(self):
+        """Test a sync without cursor returns every row of the user"""
+        other = get_user_model().objects.create_user(
+            'other@sajiazafreen.com', 'testpass')
+        Supply.objects.create(user=other, name='Brush')
+
+        data = self._sync()
+
+        self.assertTrue(data['full'])
+        self.assertEqual([p['id'] for p in data['paintings']['changed']],
+                         [self.painting.id])
+        self.assertEqual(data['categories']['changed'],
+                         [{'id': self.oil.id, 'name': 'Oil'}])
+        self.assertEqual(data['supplies'], {'changed': [], 'deleted': []})
+
+    def test_only_changes_since_cursor(self):
+        """Test the next sync returns the changed and deleted rows only"""
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        Painting.objects.update(updated_at=past)
+        Category.objects.update(updated_at=past)
+        cursor = self._sync()['cursor']
+
+        brush = Supply.objects.create(user=self.user, name='Brush')
+        self.painting.supplies.add(brush)  # the painting changed too
+        oil_id = self.oil.id
+        self.oil.delete()
+        data = self._sync(cursor)
+
+        self.assertFalse(data['full'])
+        self.assertEqual([p['id'] for p in data['paintings']['changed']],
+                         [self.painting.id])
+        self.assertEqual(data['supplies']['changed'],
+                         [{'id': brush.id, 'name': 'Brush'}])
+        self.assertEqual(data['categories'],
+                         {'changed': [], 'deleted': [oil_id]})
+
+    def test_deleted_painting_until_and_after_purge(self):
+        """Test a deleted painting is reported, before and after the purge"""
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        Painting.objects.update(updated_at=past)
+        cursor = self._sync()['cursor']
+        deletion.soft_delete_painting(self.painting)
+
+        data = self._sync(cursor)
+        self.assertEqual(data['paintings'],
+                         {'changed': [], 'deleted': [self.painting.id]})
+
+        deletion.purge_paintings(Painting.objects.all())
+        data = self._sync(cursor)
+        self.assertEqual(data['paintings'],
+                         {'changed': [], 'deleted': [self.painting.id]})
+
+    @override_settings(SYNC_CURSOR_MAX_AGE=60)
+    def test_old_cursor_gets_full_sync(self):
+        """Test a cursor older than the kept tombstones gets everything"""
+        cursor = self._sync(
+            at=timezone.now() - datetime.timedelta(minutes=5))['cursor']
+
+        data = self._sync(cursor)
+
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['paintings']['changed']), 1)
+
+    def test_invalid_cursor(self):
+        """Test a cursor not issued by the server is refused"""
+        res = self.client.get(SYNC_URL, {'cursor': 'made-up'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,129 @@
+import datetime
+import io
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from core import imaging, jobs
+from core.models import Job, Painting
+
+from painting import tasks
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def turned_jpeg():
+    """Return the bytes of a JPEG whose EXIF turns it by 90 degrees"""
+    img = Image.new('RGB', (40, 20), (0, 0, 200))
+    img.paste((255, 255, 255), (0, 0, 20, 20))
+    exif = img.getexif()
+    exif[0x0112] = 6
+    exif[0x010f] = 'Camera' * 1000  # make
+    f = io.BytesIO()
+    img.save(f, format='JPEG', exif=exif.tobytes())
+    return f.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class OptimizeImageTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@sajiazafreen.com', 'testpass')
+        self.painting = Painting.objects.create(
+            user=self.user, title='Turned',
+            painting_create_date=datetime.date(2020, 1, 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT)
+        super().tearDownClass()
+
+    def test_upload_queues_job(self):
+        """Test an upload is optimized by a background job"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = ContentFile(turned_jpeg(), name='turned.jpg')
+
+        client.post(
+            reverse('painting:painting-upload-image', args=[self.painting.id]),
+            {'image': upload}, format='multipart')
+
+        self.painting.refresh_from_db()
+        job = Job.objects.get()
+        self.assertEqual(job.task, 'painting.tasks.optimize_image')
+        self.assertEqual(job.args,
+                         [self.painting.id, self.painting.image.name])
+        self.assertIsNone(self.painting.image_original_size)
+
+    def test_optimize_image(self):
+        """Test the image is replaced by a copy without metadata"""
+        data = turned_jpeg()
+        self.painting.image = default_storage.save(
+            'uploads/recipe/turned.jpg', ContentFile(data))
+        # computed at upload, from the pixels as stored
+        phash = imaging.image_metadata(ContentFile(data))['image_phash']
+        self.painting.image_phash = phash
+        self.painting.save()
+        name = self.painting.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.optimize_image(self.painting.id, name)
+
+        self.painting.refresh_from_db()
+        self.assertNotEqual(self.painting.image.name, name)
+        # the old URL keeps working for a while
+        self.assertTrue(default_storage.exists(name))
+        job = Job.objects.get()
+        self.assertEqual(job.task, 'core.deletion.delete_files')
+        self.assertEqual(job.args, [[name]])
+        self.assertGreater(job.run_at, timezone.now() +
+                           datetime.timedelta(hours=1))
+        jobs.run(job)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(self.painting.image_original_size, len(data))
+        self.assertEqual(self.painting.image_size, self.painting.image.size)
+        self.assertLess(self.painting.image_size, len(data))
+        # the same pixels, still turned by the EXIF orientation
+        self.assertEqual((self.painting.image_width,
+                          self.painting.image_height), (40, 20))
+        self.assertEqual(self.painting.image_phash, phash)
+
+    def test_nothing_to_save(self):
+        """Test an image already optimal only gets its size recorded"""
+        f = io.BytesIO()
+        Image.new('RGB', (40, 20)).save(f, format='PNG', optimize=True)
+        self.painting.image = default_storage.save(
+            'uploads/recipe/optimal.png', ContentFile(f.getvalue()))
+        self.painting.save()
+        name = self.painting.image.name
+
+        tasks.optimize_image(self.painting.id, name)
+
+        self.painting.refresh_from_db()
+        self.assertEqual(self.painting.image.name, name)
+        self.assertEqual(self.painting.image_original_size,
+                         len(f.getvalue()))
+
+    def test_image_replaced_meanwhile(self):
+        """Test the job of an image replaced since is dropped"""
+        self.painting.image = default_storage.save(
+            'uploads/recipe/new.jpg', ContentFile(turned_jpeg()))
+        self.painting.save()
+
+        tasks.optimize_image(self.painting.id, 'uploads/recipe/old.jpg')
+
+        self.painting.refresh_from_db()
+        self.assertEqual(self.painting.image.name, 'uploads/recipe/new.jpg')
+        self.assertIsNone(self.painting.image_original_size)
@@ -14,5 +14,7 @@ router.register('paintings', views.PaintingViewSet)
 app_name = 'painting'
 
 urlpatterns = [  # all urls will be added here if we keep adding router
+    path('stats/', views.PaintingStatsView.as_view(), name='stats'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
     path('', include(router.urls))
 ]
@@ -1,22 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from rest_framework.decorators import action  # for custom actions
 from rest_framework.response import Response
-from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import viewsets, mixins, status, views
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from django.conf import settings
+from django.core import signing
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, router, \
+                      transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from core.models import Category, Supply, Painting, UserPaintingStats, \
+                        MonthlyPaintingCount
+from core import caching, dedup, deletion, renditions, sharding, \
+                 singleflight
+from core.authentication import CachedTokenAuthentication
+from core.throttling import BatchUploadThrottle, UploadThrottle
+from core.db import routers
+from core.views import file_response
+
+from painting import backup, serializers, similarity, sync
+
+
+class ReplicaReadMixin:
+    """Read from the database replicas during safe requests"""
+
+    def initial(self, request, *args, **kwargs):
+        # runs after authentication, the token lookup always hits the
+        # default database
+        super().initial(request, *args, **kwargs)
+        self._replica_token = routers.use_replicas(
+            request.method in SAFE_METHODS and
+            not routers.is_pinned_to_primary(request.user)
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        token = self.__dict__.pop('_replica_token', None)
+        if token is not None:
+            routers.reset_replicas(token)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            routers.pin_to_primary(request.user)  # read your own writes
+        return response
+
+
+class ShardMixin:
+    """Send the queries of a request to the database of its user"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.shard, read_only = sharding.assignment(request.user.pk)
+        if read_only and request.method not in SAFE_METHODS:
+            # the rows are being copied to another database
+            raise sharding.ShardMoving()
+        self._shard_token = routers.use_shard(self.shard)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        token = self.__dict__.pop('_shard_token', None)
+        if token is not None:
+            routers.reset_shard(token)
+        return response
 
-from core.models import Category, Supply, Painting
+    def shard_queryset(self, queryset):
+        """Read the queryset from the user's shard, not from a replica"""
+        if self.shard == DEFAULT_DB_ALIAS:
+            return queryset  # the replicas have the data of these users
+        return queryset.using(self.shard)
 
-from painting import serializers
+
+class FileNegotiation(DefaultContentNegotiation):
+    """Negotiation of the actions whose response is a file"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        # ?format= is the format of the image, not of a DRF renderer, and
+        # an Accept: image/* would end up in a 406, the first renderer
+        # only ever renders the errors
+        return renderers[0], renderers[0].media_type
 
 
 # as the category and supply viewset classes have so much in common
 # it will be better to refactor the common fuctionality in a single
 # class
-class BasePaintingAttrViewSet(viewsets.GenericViewSet,
+class BasePaintingAttrViewSet(ShardMixin, ReplicaReadMixin,
+                              viewsets.GenericViewSet,
                               mixins.ListModelMixin,
                               mixins.CreateModelMixin):
     """Common viewset for user owned painting attributes"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
@@ -32,18 +110,63 @@ class BasePaintingAttrViewSet(viewsets.GenericViewSet,
         # here assigned 0 is a default value, if passed it will be override
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(painting__isnull=False)
+            # in a single filter(), both conditions are on the same join
+            queryset = queryset.filter(painting__isnull=False,
+                                       painting__deleted_at__isnull=True)
 
-        return queryset.filter(
+        return self.shard_queryset(queryset).filter(
             user=self.request.user
             ).order_by('-name').distinct()
         # here we have to add distinct in the end otherwise django will return
         # duplicate items
         # return self.queryset.filter(user=self.request.user).order_by('-name')
 
+    def list(self, request, *args, **kwargs):
+        """List the objects, from core.caching when they didn't change"""
+        assigned_only = bool(
+            int(request.query_params.get('assigned_only', 0)))
+        key = caching.attrs_key(self.queryset.model._meta.model_name,
+                                request.user.pk, assigned_only)
+        return Response(caching.tiered.get_or_set(key, self._load_list))
+
+    def _load_list(self):
+        # from the primary: a lagging replica would put back in the cache
+        # what was just invalidated, for the whole timeout
+        token = routers.use_replicas(False)
+        try:
+            return list(self.get_serializer(
+                self.filter_queryset(self.get_queryset()), many=True).data)
+        finally:
+            routers.reset_replicas(token)
+
+    def create(self, request, *args, **kwargs):
+        """Create an object, answer 200 when the name already existed"""
+        response = super().create(request, *args, **kwargs)
+        if not self._created:
+            response.status_code = status.HTTP_200_OK
+        return response
+
     def perform_create(self, serializer):
-        """Create a new object (category/supply)"""
-        serializer.save(user=self.request.user)
+        """Create a new object (category/supply) unless the name exists"""
+        # "Oil" and "oil" are the same supply, the existing one is returned
+        # instead of a new row
+        self._created = False
+        names = dedup.filter_name(
+            self.queryset.filter(user=self.request.user),
+            serializer.validated_data['name']
+        )
+        existing = names.first()
+        if existing is None:
+            try:
+                model = self.queryset.model
+                with transaction.atomic(using=router.db_for_write(model)):
+                    serializer.save(user=self.request.user)
+                self._created = True
+                return
+            except IntegrityError:
+                # created by a concurrent request, caught by the unique index
+                existing = names.first()
+        serializer.instance = existing
 
 
 class CategoryViewSet(BasePaintingAttrViewSet):
@@ -62,12 +185,26 @@ class SupplyViewSet(BasePaintingAttrViewSet):
     serializer_class = serializers.SupplySerializer
 
 
-class PaintingViewSet(viewsets.ModelViewSet):
+# the painting lists being computed, clients retrying aggressively send
+# bursts of the same request
+list_flights = singleflight.Group()
+
+
+class PaintingViewSet(ShardMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """Manage painting in the databse"""
     serializer_class = serializers.PaintingSerializer
     queryset = Painting.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    # query parameter: lookup on the image metadata columns
+    image_filters = {
+        'min_width': 'image_width__gte',
+        'max_width': 'image_width__lte',
+        'min_height': 'image_height__gte',
+        'max_height': 'image_height__lte',
+        'image_format': 'image_format',
+        'image_phash': 'image_phash',  # exact duplicates of an image
+    }
 
     def _params_to_ints(self, qs):
         """Convert a list of string IDs to a list of integers"""
@@ -77,13 +214,21 @@ class PaintingViewSet(viewsets.ModelViewSet):
         return [int(str_id) for str_id in qs.split(',')]  # qs is the comma
         # seperated list and we change the list items to integers
 
+    def _param_to_int(self, name, value):
+        """Convert a query parameter to an integer or answer with a 400"""
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: 'A valid integer is required.'})
+
     def get_queryset(self):
         """Return paintings for the current authenticated user only"""
         # add filtering
         # request has a query params in a dictionary
         categories = self.request.query_params.get('categories')
         supplies = self.request.query_params.get('supplies')
-        queryset = self.queryset  # get the queryset and the apply the filters
+        # get the queryset and the apply the filters
+        queryset = self.shard_queryset(self.queryset)
         # this filter helps to get painting depending on the categories and
         # supplies
         if categories:
@@ -95,10 +240,40 @@ class PaintingViewSet(viewsets.ModelViewSet):
         if supplies:
             supply_ids = self._params_to_ints(supplies)
             queryset = queryset.filter(supplies__id__in=supply_ids)
+        # filters on the stored image metadata, the files are never opened
+        for param, lookup in self.image_filters.items():
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            if lookup.endswith(('__gte', '__lte')):
+                value = self._param_to_int(param, value)
+            else:
+                value = value.lower()  # formats and hashes are lower case
+            queryset = queryset.filter(**{lookup: value})
 
-        return queryset.filter(user=self.request.user)
+        return queryset.filter(user=self.request.user, deleted_at__isnull=True)
         # we do not need .order_by('-id')
 
+    def list(self, request, *args, **kwargs):
+        """List the paintings, sharing the result of identical requests"""
+        params = tuple(sorted((name, tuple(values)) for name, values
+                              in request.query_params.lists()))
+        key = (request.user.pk, request.path, params)
+        data = list_flights.do(
+            key, lambda: super(PaintingViewSet, self).list(
+                request, *args, **kwargs).data)
+        return Response(data)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # the lists started before the write must not be shared with
+            # the requests coming after it
+            user_id = request.user.pk
+            list_flights.forget(lambda key: key[0] == user_id)
+        return response
+
     # override a serializer class after retrueve action and return detail
     # thus when the retrieve is called we are going to return the detail
     # serializer
@@ -106,7 +281,9 @@ class PaintingViewSet(viewsets.ModelViewSet):
         """Return appropriate serializer class"""
         if self.action == 'retrieve':
             return serializers.PaintingDetailSerializer
-        elif self.action == 'upload_image':
+        elif self.action == 'similar':
+            return serializers.SimilarPaintingSerializer
+        elif self.action in ('upload_image', 'upload_images'):
             return serializers.PaintingImageSerializer
 
         return self.serializer_class
@@ -114,13 +291,19 @@ class PaintingViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Create a new painting object"""
         serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        """Soft delete a painting"""
+        # the row, its links and its image are removed by purge_deleted
+        deletion.soft_delete_painting(instance, instance._state.db)
 # Create your views here.
 # going to use list model fuction from the rest rest_framework
 
     # the actions could be POST, PUT or PATCH
     # detail URL
 
-    @action(methods=['POST'], detail=True, url_path='upload-image')
+    @action(methods=['POST'], detail=True, url_path='upload-image',
+            throttle_classes=[UploadThrottle])
     def upload_image(self, request, pk=None):  # passed in with the URL as pk
         """Upload an image of a painting"""
         painting = self.get_object()
@@ -140,3 +323,202 @@ class PaintingViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(methods=['POST'], detail=False, url_path='upload-images',
+            throttle_classes=[BatchUploadThrottle])
+    def upload_images(self, request):
+        """Upload the images of many paintings, fields image-<painting id>"""
+        files = {}
+        for field, uploads in request.FILES.lists():
+            prefix, _, painting_id = field.partition('-')
+            if prefix != 'image' or not painting_id.isdecimal():
+                raise ValidationError(
+                    {field: 'Expected a field named image-<painting id>.'})
+            # only one image is kept per painting, refuse to pick one
+            if len(uploads) > 1:
+                raise ValidationError(
+                    {field: 'Expected a single image per painting.'})
+            if int(painting_id) in files:  # image-01 and image-1
+                raise ValidationError(
+                    {field: 'The painting has another image field.'})
+            files[int(painting_id)] = uploads[0]
+        if not files:
+            raise ValidationError({'image': 'No image was uploaded.'})
+        if len(files) > settings.IMAGE_BATCH_MAX_FILES:
+            raise ValidationError({'image': 'At most '
+                                   f'{settings.IMAGE_BATCH_MAX_FILES} '
+                                   'images can be uploaded at once.'})
+        paintings = self.get_queryset().in_bulk(list(files))
+
+        def validate(painting_id):
+            painting = paintings.get(painting_id)
+            if painting is None:
+                return None
+            serializer = self.get_serializer(
+                painting, data={'image': files[painting_id]})
+            serializer.is_valid()
+            return serializer
+
+        # decoding the images is most of the time of a request, Pillow
+        # lets the other threads run meanwhile; the database is only used
+        # by this thread
+        workers = min(settings.IMAGE_BATCH_WORKERS, len(files))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            validated = list(pool.map(validate, files))
+
+        results = []
+        for painting_id, serializer in zip(files, validated):
+            if serializer is None:
+                results.append({'id': painting_id,
+                                'status': status.HTTP_404_NOT_FOUND,
+                                'errors': {'detail': 'Not found.'}})
+            elif serializer.errors:
+                results.append({'id': painting_id,
+                                'status': status.HTTP_400_BAD_REQUEST,
+                                'errors': serializer.errors})
+            else:
+                serializer.save()
+                results.append({'status': status.HTTP_200_OK,
+                                **serializer.data})
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False, url_path='archive',
+            content_negotiation_class=FileNegotiation)
+    def archive(self, request):
+        """Download every painting, its metadata and image, as a ZIP file"""
+        # read by the response long after the view returned, when the
+        # replica routing of the request is over
+        using = router.db_for_read(Painting)
+        response = StreamingHttpResponse(
+            backup.stream(request.user, using),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = \
+            'attachment; filename="paintings.zip"'
+        return response
+
+    @action(methods=['GET'], detail=True, url_path='similar')
+    def similar(self, request, pk=None):
+        """List the paintings whose image looks like this one's"""
+        painting = self.get_object()
+        if not painting.image_phash:
+            raise ValidationError({'image': 'The painting has no image.'})
+        params = request.query_params
+        max_distance = self._param_to_int(
+            'max_distance', params.get('max_distance', '10'))
+        limit = self._param_to_int('limit', params.get('limit', '20'))
+        # hashes are 64 bits, beyond a few bits the images are unrelated
+        max_distance = max(0, min(max_distance, 64))
+        limit = max(1, min(limit, 100))
+
+        matches = similarity.find_similar(painting, max_distance, limit)
+        for distance, match in matches:
+            match.distance = distance
+        serializer = self.get_serializer(
+            [match for _, match in matches], many=True)
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=True, url_path='image',
+            content_negotiation_class=FileNegotiation)
+    def image(self, request, pk=None):
+        """Return the image of a painting resized, ?w=&h=&fit=&format="""
+        painting = self.get_object()
+        if not painting.image:
+            raise NotFound('The painting has no image.')
+        params = request.query_params
+        width = params.get('w')
+        height = params.get('h')
+        # without a format, the best one the client accepts
+        image_format = params.get('format', '').lower() or \
+            renditions.accepted_format(request.META.get('HTTP_ACCEPT', ''))
+        try:
+            path, name = renditions.get(
+                painting.image.path,
+                self._param_to_int('w', width) if width else None,
+                self._param_to_int('h', height) if height else None,
+                params.get('fit', 'contain'),
+                image_format,
+            )
+        except renditions.RenditionError as error:
+            raise ValidationError({'image': str(error)})
+        except FileNotFoundError:
+            raise NotFound('The image file does not exist.')
+
+        response = file_response(request._request, path, name)
+        # the painting belongs to a user, shared caches must not keep it
+        response['Cache-Control'] = \
+            f'private, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class PaintingStatsView(ShardMixin, views.APIView):
+    """Summary of the paintings of the authenticated user"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Return the counters kept up to date by core.signals"""
+        return Response(caching.tiered.get_or_set(
+            caching.stats_key(request.user.pk),
+            lambda: self._stats(request.user)))
+
+    def _stats(self, user):
+        # every query here is an indexed read of a few rows, nothing is
+        # counted over the paintings or their M2M tables
+        total = UserPaintingStats.objects.filter(user=user) \
+            .values_list('painting_count', flat=True).first()
+        categories = Category.objects.filter(user=user).order_by('-name')
+        supplies = Supply.objects.filter(user=user).order_by('-name')
+        months = MonthlyPaintingCount.objects.filter(
+            user=user, painting_count__gt=0
+        ).order_by('month')
+
+        return {
+            'total_paintings': total or 0,
+            'categories': serializers.CategoryStatsSerializer(
+                categories, many=True).data,
+            'supplies': serializers.SupplyStatsSerializer(
+                supplies, many=True).data,
+            'months': serializers.MonthlyPaintingCountSerializer(
+                months, many=True).data,
+        }
+
+
+class SyncView(ShardMixin, views.APIView):
+    """Changes of the paintings, categories and supplies since a cursor"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    # no replica: a lagging replica could miss changes older than the
+    # cursor and the client would never get them
+
+    def get(self, request):
+        """Return the changed rows, the deleted ids and the next cursor"""
+        # taken before reading, the changes made during the sync are
+        # returned again next time rather than lost
+        now = timezone.now()
+        cursor = request.query_params.get('cursor')
+        since = None
+        if cursor:
+            try:
+                since = sync.read_cursor(cursor)
+            except signing.BadSignature:
+                raise ValidationError({'cursor': 'Invalid cursor.'})
+
+        changes = sync.changes(request.user, since)
+        data = {
+            'cursor': sync.make_cursor(now),
+            # without a usable cursor every row is sent, the client
+            # replaces what it has
+            'full': since is None,
+        }
+        for kind, name, serializer_class in (
+                ('painting', 'paintings', serializers.PaintingSerializer),
+                ('category', 'categories', serializers.CategorySerializer),
+                ('supply', 'supplies', serializers.SupplySerializer)):
+            changed, deleted = changes[kind]
+            data[name] = {
+                'changed': serializer_class(changed, many=True).data,
+                'deleted': deleted,
+            }
+        return Response(data)
@@ -1,8 +1,11 @@
 # from django.shortcuts import render
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
+from core import deletion
+from core.authentication import CachedTokenAuthentication
+from core.throttling import LoginThrottle
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -16,15 +19,21 @@ class CreateTokenView(ObtainAuthToken):
     """create a new auth token for user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    throttle_classes = (LoginThrottle,)  # ObtainAuthToken has none
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)  # checking
-    # the user is logged in
+    # checking the user is logged in, the user usually comes from the
+    # memory of the process, see core.authentication
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)  # and authenticated
 
     def get_object(self):
         """Retrive and return authentication user"""
         return self.request.user
+
+    def perform_destroy(self, instance):
+        """Deactivate the user, purge_deleted removes their data later"""
+        deletion.soft_delete_user(instance)